@@ -1,32 +1,77 @@
 import os
 import re
+import json
+import base64
 import hashlib
+import hmac
 import io
 import zipfile
-import shutil
+import threading
+import time
+import queue
+import uuid
+import zlib
+import functools
+import random
+import inspect
+import cProfile
+import pstats
+import marshal
+import itertools
+import contextvars
+import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Dict, Tuple, List
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+from typing import Optional, Dict, Tuple, List, Iterable
 
 from fastapi import (
-    FastAPI, UploadFile, File, Form, Depends, HTTPException, status,
-    Query, Request, Body
+    FastAPI, APIRouter, UploadFile, File, Form, Depends, HTTPException, status,
+    Query, Request, Body, Response
 )
+from starlette.concurrency import run_in_threadpool
+import anyio
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from starlette.datastructures import MutableHeaders
+from fastapi.routing import APIRoute
 
 from jose import jwt, JWTError
 from passlib.hash import bcrypt
 
 from sqlalchemy import (
     create_engine, Column, Integer, String, DateTime, ForeignKey, Text,
-    func, UniqueConstraint, desc, Boolean, text, or_
+    func, UniqueConstraint, desc, Boolean, text, or_, and_, update, BigInteger, Float, Index, tuple_,
+    case, false, literal, literal_column, select, delete, insert, event, cast, Numeric
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, NullPool
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import functions
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session, aliased
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+# opcionales: sin ellos se usa json estándar y sólo gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # ----------------- Config -----------------
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")  # opcional: réplica de sólo lectura
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "10"))  # lee del primario tras escribir
 FILES_ROOT = Path(os.getenv("FILES_ROOT", "/data"))
 MAX_FILE_MB = int(os.getenv("MAX_FILE_MB", "50"))
 ALLOWED_EXT = {e.strip().lower() for e in os.getenv("ALLOWED_EXT", "pdf,docx,xlsx,jpg,png,zip").split(",")}
@@ -34,9 +79,161 @@ JWT_SECRET = os.getenv("JWT_SECRET", "change_me")
 JWT_ALG = "HS256"
 ACCESS_TOKEN_EXPIRES_MIN = int(os.getenv("ACCESS_TOKEN_MIN", "120"))
 ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "http://localhost:3001,http://localhost:5173,http://127.0.0.1:5173").split(",") if o.strip()]
+CONTENT_INDEX_ENABLE = os.getenv("CONTENT_INDEX_ENABLE", "true").lower() == "true"
+CONTENT_INDEX_EXT = {e.strip().lower() for e in os.getenv("CONTENT_INDEX_EXT", "pdf,docx,xlsx,txt,csv").split(",") if e.strip()}
+CONTENT_INDEX_MAX_CHARS = int(os.getenv("CONTENT_INDEX_MAX_CHARS", "200000"))
+REAPER_MAX_MBPS = float(os.getenv("REAPER_MAX_MBPS", "50"))  # 0 = sin límite
+REAPER_POLL_S = int(os.getenv("REAPER_POLL_S", "30"))
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", "8"))
+RECONCILE_STAGING_MAX_AGE_S = int(os.getenv("RECONCILE_STAGING_MAX_AGE_S", "21600"))  # .part más viejos = huérfanos
+SCRUB_ENABLE = os.getenv("SCRUB_ENABLE", "true").lower() == "true"
+SCRUB_MAX_MBPS = float(os.getenv("SCRUB_MAX_MBPS", "10"))  # presupuesto de lectura del scrubber
+SCRUB_REVERIFY_DAYS = int(os.getenv("SCRUB_REVERIFY_DAYS", "30"))
+SCRUB_IDLE_S = int(os.getenv("SCRUB_IDLE_S", "300"))
+ASYNC_DB_ENABLE = os.getenv("ASYNC_DB_ENABLE", "true").lower() == "true"  # rutas de lectura /async
+# Pools de hilos por clase de ruta: interactivas (threadpool por defecto), E/S de archivos y CPU
+POOL_INTERACTIVE_THREADS = int(os.getenv("POOL_INTERACTIVE_THREADS", "40"))
+POOL_FILE_IO_THREADS = int(os.getenv("POOL_FILE_IO_THREADS", "8"))
+POOL_FILE_IO_QUEUE = int(os.getenv("POOL_FILE_IO_QUEUE", "32"))
+POOL_CPU_THREADS = int(os.getenv("POOL_CPU_THREADS", str(os.cpu_count() or 2)))
+POOL_CPU_QUEUE = int(os.getenv("POOL_CPU_QUEUE", "8"))
+POOL_RETRY_AFTER_S = int(os.getenv("POOL_RETRY_AFTER_S", "5"))
+# Pool de conexiones a la base. DB_POOL_MODE=pgbouncer usa NullPool: el pooling lo hace PgBouncer
+# en modo transacción y un pool local sólo retendría conexiones del lado del bouncer.
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()  # queue | pgbouncer
+# Conexión directa a PostgreSQL (sin PgBouncer) para migraciones y advisory locks de sesión de los
+# workers de fondo: en modo transacción el lock y el unlock pueden caer en backends distintos y el
+# lock queda tomado en una conexión del bouncer. Obligatoria con DB_POOL_MODE=pgbouncer.
+DATABASE_LOCK_URL = os.getenv("DATABASE_LOCK_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # recicla antes de timeouts de red/servidor
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"  # un round trip extra por checkout
+METRICS_ENABLE = os.getenv("METRICS_ENABLE", "true").lower() == "true"  # /metrics en formato Prometheus
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # token del scraper para /metrics; sin él sólo entra un admin
+SERVER_TIMING_ENABLE = os.getenv("SERVER_TIMING_ENABLE", "true").lower() == "true"  # header Server-Timing
+QUERY_N1_THRESHOLD = int(os.getenv("QUERY_N1_THRESHOLD", "5"))  # repeticiones de una sentencia por petición
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "false").lower() == "true"  # pruebas/CI: falla al exceder
+# Perfilado bajo demanda: un admin envía "X-Profile: 1" o ?__profile=1 y la petición corre bajo cProfile
+PROFILE_ENABLE = os.getenv("PROFILE_ENABLE", "true").lower() == "true"
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "50"))  # perfiles guardados por proceso
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "60"))  # funciones en el resumen de texto
+# Registro de consultas lentas (tabla slow_queries acotada); SLOW_QUERY_MS=0 lo desactiva
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))  # fracción con EXPLAIN ANALYZE
+SLOW_QUERY_EXPLAIN_INTERVAL_S = int(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_S", "300"))  # un plan por sentencia cada N s
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "5000"))  # filas que se conservan
+# Sólo para depurar: guarda los parámetros tal cual (pueden incluir credenciales y datos de usuarios)
+SLOW_QUERY_LOG_PARAMS = os.getenv("SLOW_QUERY_LOG_PARAMS", "false").lower() == "true"
+# Compresión negociada (br si está instalado, si no gzip) de respuestas JSON/texto; nunca de descargas
+COMPRESS_ENABLE = os.getenv("COMPRESS_ENABLE", "true").lower() == "true"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))  # 4-5: buen ratio sin costo de CPU alto
+# Staging de cargas: mismo filesystem que FILES_ROOT para que el rename final sea atómico
+UPLOAD_TMP = FILES_ROOT / ".uploads"
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout (incluye abrir conexiones de overflow)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - t0
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total_s += waited
+                self.wait_max_s = max(self.wait_max_s, waited)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "timeout_s": self._timeout,
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(1000 * self.wait_total_s / self.checkouts, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max_s, 3),
+        }
+
+def _pool_kwargs(async_: bool = False) -> dict:
+    if DB_POOL_MODE == "pgbouncer":
+        return {"poolclass": NullPool}
+    if async_ and not IS_POSTGRES:
+        return {}  # aiosqlite (pruebas) usa su pool por defecto
+    kwargs = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if not async_:
+        kwargs["poolclass"] = InstrumentedQueuePool
+    return kwargs
+
+def pool_stats_of(eng) -> dict:
+    pool = eng.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    if isinstance(pool, QueuePool):  # p. ej. AsyncAdaptedQueuePool del engine async
+        return {"size": pool.size(), "in_use": pool.checkedout(), "idle": pool.checkedin(),
+                "overflow": max(0, pool.overflow())}
+    return {"status": pool.status()}
+
+engine = create_engine(DATABASE_URL, **_pool_kwargs())
+IS_POSTGRES = engine.dialect.name == "postgresql"
+TRGM_ENABLED = False  # se activa en run_migrations si pg_trgm está disponible
+
+@compiles(functions.now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    # CURRENT_TIMESTAMP de SQLite guarda "YYYY-MM-DD HH:MM:SS" y SQLAlchemy liga los datetime como
+    # "YYYY-MM-DD HH:MM:SS.ffffff": al comparar como texto, un cursor keyset con el mismo segundo
+    # repetía filas. Mismo formato que los valores ligados (y precisión de milisegundos).
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+if DB_POOL_MODE == "pgbouncer" and IS_POSTGRES and not DATABASE_LOCK_URL:
+    raise RuntimeError("DB_POOL_MODE=pgbouncer requiere DATABASE_LOCK_URL (conexión directa a PostgreSQL "
+                       "para migraciones y advisory locks)")
+# una conexión por worker de fondo que toma lock (reaper, indexador, scrubber, reconciliación, arranque)
+lock_engine = create_engine(DATABASE_LOCK_URL, pool_size=4, max_overflow=4, pool_recycle=DB_POOL_RECYCLE,
+                            pool_pre_ping=True) if DATABASE_LOCK_URL else engine
+
+# Engine asíncrono para las rutas de lectura /async (convive con el síncrono durante la migración);
+# requiere asyncpg (o aiosqlite en bases de prueba). Sin el driver, las rutas /async no se montan.
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DB_ENABLE and engine.dialect.name in _ASYNC_DRIVERS:
+    try:
+        _async_kwargs = _pool_kwargs(async_=True)
+        if DB_POOL_MODE == "pgbouncer" and IS_POSTGRES:
+            # PgBouncer en modo transacción no soporta sentencias preparadas con nombre
+            _async_kwargs["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        async_engine = create_async_engine(engine.url.set(drivername=_ASYNC_DRIVERS[engine.dialect.name]), **_async_kwargs)
+        AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+    except ImportError as e:
+        print("WARN engine asíncrono no disponible, rutas /async deshabilitadas:", e)
 Base = declarative_base()
 
 # ----------------- Models -----------------
@@ -61,6 +258,8 @@ class Project(Base):
     type = Column(String(16), nullable=False, default="externo")  # externo | interno
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=func.now())
+    deleted_at = Column(DateTime, nullable=True)  # tombstone: oculto mientras el reaper lo elimina
+    template_id = Column(Integer, ForeignKey("checklist_templates.id"), nullable=True)  # versión de checklist fijada
     stages = relationship("Stage", back_populates="project", cascade="all,delete")
 
 class Stage(Base):
@@ -84,6 +283,11 @@ class DeliverableSpec(Base):
     allowed_ext = Column(Text, nullable=False, default="pdf")  # csv: "pdf,docx"
     order_index = Column(Integer, default=0)
     optional_group = Column(String(128))
+    last_version = Column(Integer, nullable=False, default=0, server_default="0")  # contador de versiones
+    # Con plantilla: la fila es sólo el ancla (contador/archivos) del entregable de la plantilla,
+    # salvo que is_override indique que el proyecto diverge y sus campos mandan.
+    template_deliverable_id = Column(Integer, ForeignKey("template_deliverables.id"), nullable=True)
+    is_override = Column(Boolean, nullable=False, default=False, server_default=false())
 
     stage = relationship("Stage", back_populates="deliverables")
 
@@ -96,6 +300,47 @@ Stage.deliverables = relationship(
     "DeliverableSpec", back_populates="stage", cascade="all,delete-orphan"
 )
 
+# ---- Plantillas de checklist versionadas (compartidas entre proyectos; inmutables) ----
+class ChecklistTemplate(Base):
+    __tablename__ = "checklist_templates"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16), nullable=False)        # externo | interno
+    version = Column(Integer, nullable=False)
+    checksum = Column(String(64), nullable=False)    # sha256 del SEED que la generó
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("kind", "version", name="uq_checklist_templates_kind_version"),
+    )
+
+class TemplateStage(Base):
+    __tablename__ = "template_stages"
+    id = Column(Integer, primary_key=True)
+    template_id = Column(Integer, ForeignKey("checklist_templates.id", ondelete="CASCADE"), nullable=False)
+    code = Column(String(32), nullable=False)
+    name = Column(String(255), nullable=False)
+    order_index = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("template_id", "code", name="uq_template_stages_template_code"),
+    )
+
+class TemplateDeliverable(Base):
+    __tablename__ = "template_deliverables"
+    id = Column(Integer, primary_key=True)
+    template_stage_id = Column(Integer, ForeignKey("template_stages.id", ondelete="CASCADE"), nullable=False)
+    key = Column(String(128), nullable=False)
+    title = Column(String(512), nullable=False)
+    required = Column(Boolean, default=True, nullable=False)
+    multi = Column(Boolean, default=False, nullable=False)
+    allowed_ext = Column(Text, nullable=False, default="pdf")
+    order_index = Column(Integer, default=0)
+    optional_group = Column(String(128))
+
+    __table_args__ = (
+        UniqueConstraint("template_stage_id", "key", name="uq_template_deliverables_stage_key"),
+    )
+
 class FileRecord(Base):
     __tablename__ = "files"
     id = Column(Integer, primary_key=True)
@@ -113,6 +358,25 @@ class FileRecord(Base):
     version = Column(Integer, nullable=False, server_default="1")
     reason = Column(Text)  # motivo de nueva versión (si aplica)
     supersedes_id = Column(Integer, ForeignKey("files.id"), nullable=True)
+    verified_at = Column(DateTime, nullable=True)     # última verificación de sha256 (scrubber)
+    verify_status = Column(String(16), nullable=True)  # ok | mismatch | missing
+
+# listado por proyecto paginado por cursor (uploaded_at, id)
+Index("ix_files_project_uploaded_id", FileRecord.project_id, FileRecord.uploaded_at.desc(), FileRecord.id.desc())
+# búsqueda entre proyectos, versiones de un entregable y avance por etapa
+Index("ix_files_uploaded_id", FileRecord.uploaded_at.desc(), FileRecord.id.desc())
+Index("ix_files_deliverable_id", FileRecord.deliverable_id)
+Index("ix_files_stage_id", FileRecord.stage_id)
+
+class FileContent(Base):
+    # texto extraído de cada archivo para búsqueda full-text (tsv se añade en las migraciones)
+    __tablename__ = "file_contents"
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = Column(String(16), nullable=False, default="ok")  # ok | empty | unsupported | error
+    content = Column(Text)
+    error = Column(Text)
+    extracted_at = Column(DateTime, default=func.now())
 
 
 class ProjectMember(Base):
@@ -163,15 +427,73 @@ class ProjectDeleteRequest(Base):
     decided_at = Column(DateTime, nullable=True)
     decided_by = Column(Integer, ForeignKey("users.id"), nullable=True)
 
-# ---- Wire del seeder (import tardío para evitar circular) ----
-_seed_project = None
-try:
-    from seed_deliverables import seed_project as _seed_project
-    print("Seeder wired: True")
-except Exception as e:
-    _seed_project = None
-    print("WARN: seed_deliverables no disponible:", e)
+class ProjectPurge(Base):
+    # trabajo de eliminación en segundo plano (sin FK: sobrevive al borrado del proyecto)
+    __tablename__ = "project_purges"
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, nullable=False)
+    code = Column(String(64), nullable=False)
+    status = Column(String(16), nullable=False, default="pending")  # pending|running|done|failed
+    trash_path = Column(Text, nullable=True)
+    files_total = Column(Integer, nullable=True)
+    files_deleted = Column(Integer, nullable=False, default=0)
+    bytes_total = Column(BigInteger, nullable=True)
+    bytes_deleted = Column(BigInteger, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    requested_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class StorageDir(Base):
+    # mtime de cada carpeta en el último escaneo limpio (reconciliación incremental)
+    __tablename__ = "storage_dirs"
+    path = Column(Text, primary_key=True)
+    mtime = Column(Float, nullable=False)
+    scanned_at = Column(DateTime, default=func.now())
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=func.now())
 
+class StorageReport(Base):
+    __tablename__ = "storage_reports"
+    id = Column(Integer, primary_key=True)
+    mode = Column(String(16), nullable=False)  # full | incremental
+    status = Column(String(16), nullable=False, default="running")  # running|done|failed
+    summary = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, default=func.now())
+    finished_at = Column(DateTime, nullable=True)
+
+class SlowQuery(Base):
+    __tablename__ = "slow_queries"
+    id = Column(Integer, primary_key=True)
+    at = Column(DateTime, default=func.now(), nullable=False)
+    duration_ms = Column(Float, nullable=False)
+    route = Column(String(255), nullable=True)     # plantilla de ruta; NULL = tarea de fondo
+    username = Column(String(255), nullable=True)
+    statement = Column(Text, nullable=False)
+    params = Column(Text, nullable=True)           # JSON truncado: tipo/longitud salvo SLOW_QUERY_LOG_PARAMS
+    plan = Column(Text, nullable=True)             # EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), muestreado
+
+Index("ix_slow_queries_route_id", SlowQuery.route, SlowQuery.id)
+
+# colas de administración: filtro por estado + orden por fecha (keyset)
+Index("ix_file_delete_requests_status_requested", FileDeleteRequest.status, FileDeleteRequest.requested_at, FileDeleteRequest.id)
+Index("ix_project_delete_requests_status_requested", ProjectDeleteRequest.status, ProjectDeleteRequest.requested_at, ProjectDeleteRequest.id)
+Index("ix_registration_requests_status_created", RegistrationRequest.status, RegistrationRequest.created_at, RegistrationRequest.id)
+Index("ix_users_created_id", User.created_at, User.id)
+Index("ix_file_delete_requests_file_status", FileDeleteRequest.file_id, FileDeleteRequest.status)
+Index("ix_project_members_user_id", ProjectMember.user_id)
+# una sola solicitud pendiente por archivo (soporta INSERT ... ON CONFLICT DO NOTHING)
+Index(
+    "uq_file_delete_requests_pending", FileDeleteRequest.file_id, unique=True,
+    postgresql_where=FileDeleteRequest.status == "pending",
+    sqlite_where=FileDeleteRequest.status == "pending",
+)
 
 # ----------------- Etapas por tipo (Expediente IMT) -----------------
 STAGE_TEMPLATES = {
@@ -239,38 +561,201 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 oauth2_scheme_opt = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 def create_db():
-    Base.metadata.create_all(engine)
     FILES_ROOT.mkdir(parents=True, exist_ok=True)
 
-def safe_migrate():
-    # crea tablas nuevas (deliverables) si no existen
-    Base.metadata.create_all(engine)
-    # añade columnas a files si faltan (PostgreSQL)
-    with engine.begin() as conn:
-        conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS deliverable_id integer"))
-        conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS is_active boolean DEFAULT true"))
-        conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS version integer DEFAULT 1"))
-        conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS reason text"))
-        conn.execute(text("ALTER TABLE files ADD COLUMN IF NOT EXISTS supersedes_id integer"))
-        conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name varchar(255)"))
-        conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS email varchar(255)"))
-        conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS initials varchar(16)"))
-        conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS can_access_exptec boolean DEFAULT true"))
-        conn.execute(text("ALTER TABLE registration_requests ADD COLUMN IF NOT EXISTS full_name varchar(255)"))
-        conn.execute(text("ALTER TABLE registration_requests ADD COLUMN IF NOT EXISTS email varchar(255)"))
-        conn.execute(text("ALTER TABLE registration_requests ADD COLUMN IF NOT EXISTS initials varchar(16)"))
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS project_delete_requests (
-                id SERIAL PRIMARY KEY,
-                project_id INTEGER NOT NULL REFERENCES projects(id),
-                requested_by INTEGER NOT NULL REFERENCES users(id),
-                reason TEXT NOT NULL,
-                status VARCHAR(16) NOT NULL DEFAULT 'pending',
-                requested_at TIMESTAMP DEFAULT NOW(),
-                decided_at TIMESTAMP NULL,
-                decided_by INTEGER NULL REFERENCES users(id)
-            )
-        """))
+
+# ----------------- Migraciones versionadas -----------------
+# Cada migración corre una sola vez y queda registrada en schema_version; en un arranque
+# en caliente sólo se consulta la versión. Reglas para agregar una:
+#   - nunca editar una ya publicada: se agrega otra con el siguiente número;
+#   - DDL idempotente (IF NOT EXISTS) porque las bases previas al runner ya tienen parte del esquema;
+#   - los índices van en `indexes` para construirse CONCURRENTLY (sin bloquear escrituras).
+class Migration:
+    def __init__(self, version: int, name: str, sql: Tuple[str, ...] = (), indexes: Tuple[Tuple[str, str], ...] = (),
+                 fn=None, postgres_only: bool = True):
+        self.version = version
+        self.name = name
+        self.sql = sql          # en una transacción
+        self.indexes = indexes  # (nombre, "CREATE [UNIQUE] INDEX CONCURRENTLY IF NOT EXISTS ...")
+        self.fn = fn            # fn(conn) con conexión AUTOCOMMIT, para pasos especiales
+        self.postgres_only = postgres_only
+
+def _ix(name: str, definition: str, unique: bool = False) -> Tuple[str, str]:
+    return name, f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"
+
+def _create_tables(conn):
+    Base.metadata.create_all(conn)
+
+_TRGM_INDEXES = (
+    _ix("ix_files_filename_trgm", "ON files USING gin (filename gin_trgm_ops)"),
+    _ix("ix_users_username_trgm", "ON users USING gin (username gin_trgm_ops)"),
+)
+
+def _enable_trgm(conn) -> bool:
+    # CREATE EXTENSION puede requerir permisos de superusuario; sin ella se usa el índice en memoria.
+    # La migración 7 queda registrada igual: run_migrations lo reintenta en cada arranque.
+    try:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as e:
+        print("WARN pg_trgm no disponible, se usa índice en memoria:", e)
+        return False
+    for name, ddl in _TRGM_INDEXES:
+        _create_index_concurrently(conn, name, ddl)
+    return True
+
+def _trgm_ready(conn) -> bool:
+    # extensión instalada y sus índices GIN válidos
+    if conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is None:
+        return False
+    valid = conn.execute(text(
+        "SELECT count(*) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = ANY(:names) AND i.indisvalid"
+    ), {"names": [name for name, _ in _TRGM_INDEXES]}).scalar()
+    return valid == len(_TRGM_INDEXES)
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "tablas base", fn=_create_tables, postgres_only=False),
+    Migration(2, "columnas de expediente en files", sql=(
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS deliverable_id integer",
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS is_active boolean DEFAULT true",
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS version integer DEFAULT 1",
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS reason text",
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS supersedes_id integer",
+    )),
+    Migration(3, "datos de perfil en users y registration_requests", sql=(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS full_name varchar(255)",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS email varchar(255)",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS initials varchar(16)",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS can_access_exptec boolean DEFAULT true",
+        "ALTER TABLE registration_requests ADD COLUMN IF NOT EXISTS full_name varchar(255)",
+        "ALTER TABLE registration_requests ADD COLUMN IF NOT EXISTS email varchar(255)",
+        "ALTER TABLE registration_requests ADD COLUMN IF NOT EXISTS initials varchar(16)",
+    )),
+    Migration(4, "contador de versiones por entregable", sql=(
+        "ALTER TABLE deliverables ADD COLUMN IF NOT EXISTS last_version integer NOT NULL DEFAULT 0",
+        # inicializa el contador con la versión más alta ya registrada
+        """
+        UPDATE deliverables d SET last_version = v.maxv
+        FROM (
+            SELECT deliverable_id, max(version) AS maxv
+            FROM files WHERE deliverable_id IS NOT NULL
+            GROUP BY deliverable_id
+        ) v
+        WHERE v.deliverable_id = d.id AND d.last_version < v.maxv
+        """,
+    )),
+    Migration(5, "índices de listados y colas de aprobación", indexes=(
+        _ix("ix_files_project_uploaded_id", "ON files (project_id, uploaded_at DESC, id DESC)"),
+        _ix("ix_file_delete_requests_status_requested", "ON file_delete_requests (status, requested_at, id)"),
+        _ix("ix_project_delete_requests_status_requested", "ON project_delete_requests (status, requested_at, id)"),
+        _ix("ix_registration_requests_status_created", "ON registration_requests (status, created_at, id)"),
+        _ix("ix_users_created_id", "ON users (created_at, id)"),
+    )),
+    Migration(6, "una solicitud de borrado pendiente por archivo", sql=(
+        # conserva la solicitud pendiente más antigua por archivo antes del índice único parcial
+        """
+        UPDATE file_delete_requests r SET status = 'rejected', decided_at = now()
+        WHERE r.status = 'pending' AND EXISTS (
+            SELECT 1 FROM file_delete_requests o
+            WHERE o.file_id = r.file_id AND o.status = 'pending' AND o.id < r.id
+        )
+        """,
+    ), indexes=(
+        _ix("uq_file_delete_requests_pending", "ON file_delete_requests (file_id) WHERE status = 'pending'", unique=True),
+    )),
+    Migration(7, "búsqueda por subcadena con pg_trgm", fn=_enable_trgm),
+    Migration(8, "full-text del contenido", sql=(
+        """
+        ALTER TABLE file_contents ADD COLUMN IF NOT EXISTS tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(content, ''))) STORED
+        """,
+    ), indexes=(
+        _ix("ix_file_contents_tsv", "ON file_contents USING gin (tsv)"),
+    )),
+    Migration(9, "tombstone de proyectos", sql=(
+        "ALTER TABLE projects ADD COLUMN IF NOT EXISTS deleted_at timestamp",
+    )),
+    Migration(10, "verificación de integridad", sql=(
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS verified_at timestamp",
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS verify_status varchar(16)",
+    ), indexes=(
+        # cola del scrubber: nunca verificados primero, luego los más antiguos
+        _ix("ix_files_verified_at", "ON files (verified_at ASC NULLS FIRST, id)"),
+    )),
+    Migration(11, "plantillas de checklist", sql=(
+        "ALTER TABLE projects ADD COLUMN IF NOT EXISTS template_id integer REFERENCES checklist_templates(id)",
+        "ALTER TABLE deliverables ADD COLUMN IF NOT EXISTS template_deliverable_id integer REFERENCES template_deliverables(id)",
+        "ALTER TABLE deliverables ADD COLUMN IF NOT EXISTS is_override boolean NOT NULL DEFAULT false",
+    )),
+    Migration(12, "índices de rutas calientes", indexes=(
+        _ix("ix_files_uploaded_id", "ON files (uploaded_at DESC, id DESC)"),
+        _ix("ix_files_deliverable_id", "ON files (deliverable_id)"),
+        _ix("ix_files_stage_id", "ON files (stage_id)"),
+        _ix("ix_file_delete_requests_file_status", "ON file_delete_requests (file_id, status)"),
+        _ix("ix_project_members_user_id", "ON project_members (user_id)"),
+    )),
+    # 13 (columnas last_write_* en users) se retiró: read-your-writes vive en memoria del proceso.
+    # Los números no se reutilizan para no saltar migraciones en bases que ya registraron 14 y 15.
+    Migration(14, "registro de consultas lentas", fn=_create_tables, postgres_only=False),
+    # no-op en bases nuevas; limpia las que llegaron a aplicar la 13
+    Migration(15, "read-your-writes fuera de users", sql=(
+        "ALTER TABLE users DROP COLUMN IF EXISTS last_write_at",
+        "ALTER TABLE users DROP COLUMN IF EXISTS last_write_lsn",
+    )),
+]
+
+def _create_index_concurrently(conn, name: str, ddl: str):
+    # un CREATE INDEX CONCURRENTLY interrumpido deja el índice inválido: se descarta y se reconstruye
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :n AND NOT i.indisvalid"
+    ), {"n": name}).first()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(ddl))
+
+def _schema_version(conn) -> int:
+    try:
+        return conn.execute(text("SELECT max(version) FROM schema_version")).scalar() or 0
+    except DBAPIError:
+        return 0  # base anterior al runner: la tabla aún no existe
+
+def _apply_migration(conn, m: Migration):
+    if IS_POSTGRES or not m.postgres_only:
+        if m.sql:
+            with lock_engine.begin() as tx:
+                for stmt in m.sql:
+                    tx.execute(text(stmt))
+        if m.fn is not None:
+            m.fn(conn)
+        for name, ddl in m.indexes:
+            _create_index_concurrently(conn, name, ddl)
+    conn.execute(insert(SchemaVersion).values(version=m.version, name=m.name))
+    print(f"Migración {m.version} aplicada: {m.name}")
+
+def run_migrations():
+    global TRGM_ENABLED
+    latest = MIGRATIONS[-1].version
+    with lock_engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        TRGM_ENABLED = IS_POSTGRES and _trgm_ready(conn)
+        if _schema_version(conn) < latest or (IS_POSTGRES and not TRGM_ENABLED):
+            # un solo worker migra; los demás esperan el lock y encuentran la versión al día
+            if IS_POSTGRES:
+                conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _advisory_key("schema-migrations")})
+            try:
+                current = _schema_version(conn)
+                for m in MIGRATIONS:
+                    if m.version > current:
+                        _apply_migration(conn, m)
+                if IS_POSTGRES:
+                    # pg_trgm pudo faltar cuando corrió la migración 7 (permisos): se reintenta
+                    TRGM_ENABLED = _trgm_ready(conn) or _enable_trgm(conn)
+            finally:
+                if IS_POSTGRES:
+                    conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _advisory_key("schema-migrations")})
+
+def dialect_insert(model):
+    # INSERT con soporte de ON CONFLICT según el motor
+    return (pg_insert if IS_POSTGRES else sqlite_insert)(model)
 
 def get_db():
     db = SessionLocal()
@@ -279,30 +764,131 @@ def get_db():
     finally:
         db.close()
 
+
+# ----------------- Réplica de lectura -----------------
+# Con DATABASE_REPLICA_URL, las rutas de sólo lectura usan get_read_db y van a la réplica.
+# Read-your-writes: tras un commit con INSERT/UPDATE/DELETE de un usuario se guarda en memoria del
+# proceso la hora y el LSN del WAL del primario; mientras la réplica no haya reproducido ese LSN
+# (y dentro de REPLICA_STICKY_SECONDS) sus lecturas siguen yendo al primario. Es por proceso: con
+# varios workers cada uno conoce sólo sus escrituras, y tras arrancar todos leen del primario
+# durante REPLICA_STICKY_SECONDS (las escrituras previas al reinicio no se conocen).
+replica_engine = create_engine(DATABASE_REPLICA_URL, **_pool_kwargs()) if DATABASE_REPLICA_URL else None
+ReplicaSessionLocal = sessionmaker(bind=replica_engine, autoflush=False, autocommit=False) if replica_engine else None
+
+_RECENT_WRITES: Dict[int, Tuple[float, Optional[str]]] = {}  # user_id -> (monotonic, LSN)
+_RECENT_WRITES_LOCK = threading.Lock()
+_RECENT_WRITES_MAX = 10000
+_PROCESS_STARTED = time.monotonic()
+
+def _current_wal_lsn() -> Optional[str]:
+    if not IS_POSTGRES:
+        return None
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()  # ya incluye el commit
+    except DBAPIError as e:
+        print("WARN read-your-writes:", e)
+        return None  # sin LSN rige sólo la ventana de tiempo
+
+def _record_user_write(user_id: int, lsn: Optional[str]):
+    now = time.monotonic()
+    with _RECENT_WRITES_LOCK:
+        _RECENT_WRITES[user_id] = (now, lsn)
+        if len(_RECENT_WRITES) > _RECENT_WRITES_MAX:
+            for uid, (at, _) in list(_RECENT_WRITES.items()):
+                if now - at > REPLICA_STICKY_SECONDS:
+                    del _RECENT_WRITES[uid]
+
+def _flag_write_stmt(state):
+    # SELECT de texto (advisory locks, consultas crudas) no fijan al usuario al primario
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
+def _flag_write_flush(session, flush_context):
+    if session.new or session.dirty or session.deleted:
+        session.info["wrote"] = True
+
+def _after_user_commit(session):
+    user_id = session.info.get("user_id")
+    if session.info.pop("wrote", False) and user_id:
+        _record_user_write(user_id, _current_wal_lsn())
+
+def _after_user_rollback(session):
+    session.info.pop("wrote", None)
+
+_WRITE_TRACKING = (("do_orm_execute", _flag_write_stmt), ("after_flush", _flag_write_flush),
+                   ("after_commit", _after_user_commit), ("after_rollback", _after_user_rollback))
+if replica_engine is not None:
+    for _name, _fn in _WRITE_TRACKING:
+        event.listen(SessionLocal, _name, _fn)
+
+def _replica_caught_up(lsn: str) -> bool:
+    try:
+        with replica_engine.connect() as conn:
+            return bool(conn.execute(
+                text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"), {"lsn": lsn}
+            ).scalar())
+    except DBAPIError:
+        return False
+
+def _reads_from_primary(user_id: int) -> bool:
+    now = time.monotonic()
+    if now - _PROCESS_STARTED < REPLICA_STICKY_SECONDS:
+        return True
+    with _RECENT_WRITES_LOCK:
+        entry = _RECENT_WRITES.get(user_id)
+    if entry is None:
+        return False
+    at, lsn = entry
+    if now - at > REPLICA_STICKY_SECONDS:
+        with _RECENT_WRITES_LOCK:
+            if _RECENT_WRITES.get(user_id) == entry:
+                del _RECENT_WRITES[user_id]
+        return False
+    return not lsn or not _replica_caught_up(lsn)
+
 def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRES_MIN):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALG)
 
-def _decode_user(db: Session, token: Optional[str]) -> Optional[User]:
+def _token_subject(token: Optional[str]) -> Optional[str]:
     if not token:
         return None
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        username: str = payload.get("sub")
-        if not username:
-            return None
     except JWTError:
         return None
+    return payload.get("sub") or None
+
+def _decode_user(db: Session, token: Optional[str]) -> Optional[User]:
+    username = _token_subject(token)
+    if not username:
+        return None
     return db.query(User).filter(User.username == username).first()
 
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> User:
     user = _decode_user(db, token)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+    db.info["user_id"] = user.id  # autor de las escrituras de esta sesión (read-your-writes)
+    stats = _REQUEST_STATS.get()
+    if stats is not None:
+        stats["user"] = user.username  # para el registro de consultas lentas
     return user
 
+def get_read_db(db: Session = Depends(get_db), current: User = Depends(get_current_user)):
+    # sesión para rutas de sólo lectura: réplica si existe y el usuario no acaba de escribir
+    if ReplicaSessionLocal is None or _reads_from_primary(current.id):
+        yield db
+        return
+    rdb = ReplicaSessionLocal()
+    try:
+        yield rdb
+    finally:
+        rdb.close()
+
 def get_current_user_optional(db: Session = Depends(get_db), token: Optional[str] = Depends(oauth2_scheme_opt)) -> Optional[User]:
     return _decode_user(db, token)
 
@@ -325,20 +911,41 @@ def is_auditor(u: User) -> bool:
     return u.role == "auditor"
 
 def ensure_member(db: Session, user: User, project_id: int, need: str = "viewer"):
-    if is_admin(user):
+    if not _needs_membership(user, need):
         return
+    _check_member_role(db.execute(_membership_stmt(project_id, user.id)).scalars().first(), need)
+
+def _needs_membership(user: User, need: str) -> bool:
+    # admin pasa siempre; auditor sólo lee
+    if is_admin(user):
+        return False
     if is_auditor(user):
         if need == "viewer":
-            return
+            return False
         raise HTTPException(403, "Permisos insuficientes")
-    m = db.query(ProjectMember).filter_by(project_id=project_id, user_id=user.id).first()
+    return True
+
+def _check_member_role(m: Optional["ProjectMember"], need: str):
     if not m:
         raise HTTPException(403, "No eres miembro de este proyecto")
     if ROLE_ORDER.get(m.role, 0) < ROLE_ORDER.get(need, 0):
         raise HTTPException(403, "Permisos insuficientes")
 
-def require_owner_or_admin(db: Session, project_id: int, user: User) -> Project:
+def member_project_ids(user: User):
+    # Subconsulta de proyectos visibles según ensure_member; None = todos (admin/auditor)
+    if is_admin(user) or is_auditor(user):
+        return None
+    return select(ProjectMember.project_id).where(ProjectMember.user_id == user.id)
+
+def get_project(db: Session, project_id: int) -> Optional[Project]:
+    # proyecto visible (los marcados para eliminación no existen para la API)
     proj = db.get(Project, project_id)
+    if proj is None or proj.deleted_at is not None:
+        return None
+    return proj
+
+def require_owner_or_admin(db: Session, project_id: int, user: User) -> Project:
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
     if not is_admin(user) and proj.created_by != user.id:
@@ -346,13 +953,19 @@ def require_owner_or_admin(db: Session, project_id: int, user: User) -> Project:
     return proj
 
 
-def delete_project_by_id(db: Session, project_id: int):
-    proj = db.get(Project, project_id)
+def delete_project_by_id(db: Session, project_id: int, requested_by: Optional[int] = None) -> "ProjectPurge":
+    # Marca el proyecto (tombstone) y deja el borrado de filas y carpeta al reaper
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
+    proj.deleted_at = func.now()
+    job = ProjectPurge(project_id=proj.id, code=proj.code, status="pending", requested_by=requested_by)
+    db.add(job)
+    db.commit()
+    PROJECT_REAPER.wake()
+    return job
 
-    folder = FILES_ROOT / "projects" / proj.code
-
+def _purge_project_rows(db: Session, project_id: int):
     db.query(ProjectDeleteRequest).filter(ProjectDeleteRequest.project_id == project_id).delete(synchronize_session=False)
     db.query(FileDeleteRequest).filter(
         FileDeleteRequest.file_id.in_(db.query(FileRecord.id).filter(FileRecord.project_id == project_id))
@@ -360,11 +973,144 @@ def delete_project_by_id(db: Session, project_id: int):
     db.query(ProjectMember).filter(ProjectMember.project_id == project_id).delete(synchronize_session=False)
     db.query(FileRecord).filter(FileRecord.project_id == project_id).delete(synchronize_session=False)
     db.query(Stage).filter(Stage.project_id == project_id).delete(synchronize_session=False)
-    db.delete(proj)
-    db.commit()
+    db.query(Project).filter(Project.id == project_id).delete(synchronize_session=False)
+
+class _Throttle:
+    """Limita el ritmo de E/S a `rate` bytes/s (0 = sin límite)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._start = time.monotonic()
+        self._done = 0
+
+    def consume(self, n: int):
+        if self.rate <= 0:
+            return
+        self._done += n
+        ahead = self._done / self.rate - (time.monotonic() - self._start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+class _ProjectReaper:
+    """Procesa ProjectPurge en segundo plano.
+
+    1) renombra la carpeta del proyecto a FILES_ROOT/.trash (atómico, mismo filesystem),
+    2) elimina las filas del proyecto en una transacción,
+    3) borra los archivos de la papelera poco a poco, limitado a REAPER_MAX_MBPS.
+    Un solo worker procesa la cola a la vez (advisory lock); los trabajos interrumpidos se reanudan.
+    """
 
-    if folder.exists():
-        shutil.rmtree(folder, ignore_errors=True)
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="project-reaper", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                with lock_engine.connect() as lock_conn:
+                    if _try_advisory_lock(lock_conn, "project-reaper"):
+                        while self._reap_next():
+                            pass
+                        if IS_POSTGRES:
+                            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _advisory_key("project-reaper")})
+                    lock_conn.rollback()
+            except Exception as e:
+                print("WARN project-reaper:", e)
+            self._wake.wait(REAPER_POLL_S)
+            self._wake.clear()
+
+    def _reap_next(self) -> bool:
+        with SessionLocal() as db:
+            job = (
+                db.query(ProjectPurge)
+                .filter(ProjectPurge.status.in_(("pending", "running")))
+                .order_by(ProjectPurge.id)
+                .first()
+            )
+            if not job:
+                return False
+            try:
+                self._reap(db, job)
+            except Exception as e:
+                db.rollback()
+                job.status = "failed"
+                job.error = str(e)[:1000]
+                job.finished_at = datetime.utcnow()
+                db.commit()
+                print(f"WARN project-reaper purge={job.id}:", e)
+        return True
+
+    def _reap(self, db: Session, job: "ProjectPurge"):
+        if job.status == "pending":
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            db.commit()
+
+        # 1) fuera del árbol de proyectos (rename atómico)
+        if not job.trash_path:
+            trash = FILES_ROOT / ".trash" / f"{safe_folder(job.code)}__purge{job.id}"
+            src = FILES_ROOT / "projects" / job.code
+            if src.exists():
+                trash.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(src, trash)
+            job.trash_path = str(trash)
+            db.commit()
+
+        # 2) filas (libera el código para proyectos nuevos)
+        if db.get(Project, job.project_id) is not None:
+            _purge_project_rows(db, job.project_id)
+            db.commit()
+
+        # 3) borrado incremental con límite de E/S
+        trash = Path(job.trash_path)
+        if trash.exists():
+            if job.files_total is None:
+                n = size = 0
+                for root, _, names in os.walk(trash):
+                    for name in names:
+                        try:
+                            size += os.lstat(os.path.join(root, name)).st_size
+                        except OSError:
+                            pass
+                        n += 1
+                job.files_total, job.bytes_total = n, size
+                db.commit()
+            throttle = _Throttle(REAPER_MAX_MBPS * 1024 * 1024)
+            last_flush = time.monotonic()
+            for root, dirs, names in os.walk(trash, topdown=False):
+                for name in names:
+                    fp = os.path.join(root, name)
+                    try:
+                        size = os.lstat(fp).st_size
+                        os.unlink(fp)
+                    except FileNotFoundError:
+                        continue
+                    job.files_deleted += 1
+                    job.bytes_deleted += size
+                    throttle.consume(size)
+                    if time.monotonic() - last_flush > 2:
+                        db.commit()
+                        last_flush = time.monotonic()
+                for d in dirs:
+                    try:
+                        os.rmdir(os.path.join(root, d))
+                    except OSError:
+                        pass
+            trash.rmdir()
+
+        job.status = "done"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+
+PROJECT_REAPER = _ProjectReaper()
 
 
 # ----------------- Helpers: code & folders -----------------
@@ -432,6 +1178,1041 @@ def seed_stages_for_project(db: Session, project: "Project"):
     db.commit()
 
 
+# ----------------- Pools de ejecución acotados -----------------
+class BoundedPool:
+    """Pool con nombre para rutas síncronas pesadas: `size` en ejecución y hasta `max_queue` en espera.
+
+    Con la cola llena responde 503 + Retry-After en vez de acumular peticiones, así una ráfaga de
+    cargas o ZIPs no agota el threadpool por defecto que atiende las rutas interactivas.
+    """
+
+    def __init__(self, name: str, size: int, max_queue: int):
+        self.name = name
+        self.size = max(1, size)
+        self.max_queue = max_queue
+        self._limiter = None  # anyio.CapacityLimiter; se crea dentro del event loop
+        self._threads = None
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    def _limiters(self):
+        if self._limiter is None:
+            self._limiter = anyio.CapacityLimiter(self.size)
+            # mismos hilos que cupos: nunca espera aquí, sólo evita usar el limiter por defecto
+            self._threads = anyio.CapacityLimiter(self.size)
+        return self._limiter, self._threads
+
+    async def run(self, fn, *args, **kwargs):
+        limiter, threads = self._limiters()
+        st = limiter.statistics()
+        if st.borrowed_tokens >= self.size and st.tasks_waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(503, f"Servidor ocupado ({self.name}); intenta de nuevo más tarde",
+                                headers={"Retry-After": str(POOL_RETRY_AFTER_S)})
+        t0 = time.monotonic()
+        async with limiter:
+            waited = time.monotonic() - t0
+            self.wait_total_s += waited
+            self.wait_max_s = max(self.wait_max_s, waited)
+            try:
+                return await anyio.to_thread.run_sync(functools.partial(fn, *args, **kwargs), limiter=threads)
+            finally:
+                self.completed += 1
+
+    def stats(self) -> dict:
+        st = self._limiter.statistics() if self._limiter is not None else None
+        return {
+            "name": self.name,
+            "size": self.size,
+            "max_queue": self.max_queue,
+            "in_use": st.borrowed_tokens if st else 0,
+            "waiting": st.tasks_waiting if st else 0,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_avg_ms": round(1000 * self.wait_total_s / self.completed, 2) if self.completed else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max_s, 2),
+        }
+
+def offload(pool: BoundedPool):
+    """Ejecuta un endpoint síncrono en `pool` en lugar del threadpool por defecto (va debajo de @app.*)."""
+    def deco(fn):
+        @functools.wraps(fn)  # FastAPI lee la firma original vía __wrapped__
+        async def wrapper(*args, **kwargs):
+            return await pool.run(_run_profiled, fn, *args, **kwargs)
+        wrapper.__offloaded__ = True  # ProfilingRoute no lo envuelve: el perfil se toma en el hilo del pool
+        return wrapper
+    return deco
+
+def interactive_pool_stats() -> dict:
+    # threadpool por defecto de AnyIO/Starlette: rutas interactivas y dependencias síncronas
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    st = limiter.statistics()
+    return {"name": "interactive", "size": int(limiter.total_tokens), "max_queue": None,
+            "in_use": st.borrowed_tokens, "waiting": st.tasks_waiting}
+
+FILE_IO_POOL = BoundedPool("file-io", POOL_FILE_IO_THREADS, POOL_FILE_IO_QUEUE)
+CPU_POOL = BoundedPool("cpu", POOL_CPU_THREADS, POOL_CPU_QUEUE)
+
+
+# ----------------- Métricas (formato de texto Prometheus) -----------------
+# Registro en memoria del proceso: con varios workers cada uno expone sus propias series.
+METRICS: List["_Metric"] = []
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+def _escape_label(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], le: Optional[str] = None) -> str:
+    pairs = list(zip(names, values)) + ([("le", le)] if le is not None else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape_label(v)}"' for n, v in pairs) + "}"
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, object] = {}
+        METRICS.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def _samples(self, key: tuple, value) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(value)}"]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v) if isinstance(v, list) else v) for k, v in self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            st = self._values.get(key)
+            if st is None:
+                st = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # acumulados por bucket, suma, total
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    st[0][i] += 1
+            st[1] += value
+            st[2] += 1
+
+    def _samples(self, key: tuple, value) -> List[str]:
+        counts, total, n = value
+        lines = [f"{self.name}_bucket{_fmt_labels(self.labels, key, _fmt_value(b))} {c}"
+                 for b, c in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, '+Inf')} {n}")
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(total)}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {n}")
+        return lines
+
+HTTP_REQUESTS = Counter("http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP (hasta el último byte)",
+                         ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Peticiones HTTP en curso", ("method",))
+UPLOAD_BYTES = Counter("upload_bytes_total", "Bytes recibidos en cargas de archivos")
+DOWNLOAD_BYTES = Counter("download_bytes_total", "Bytes enviados en descargas", ("kind",))
+ZIP_BUILD = Histogram("zip_build_duration_seconds", "Tiempo de armado de ZIPs de descarga masiva",
+                      buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+DB_QUERIES = Counter("db_queries_total", "Sentencias SQL ejecutadas por ruta", ("route",))
+DB_QUERY_SECONDS = Counter("db_query_seconds_total", "Tiempo en sentencias SQL por ruta", ("route",))
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Conexiones del pool de la base", ("engine", "state"))
+EXEC_POOL_TASKS = Gauge("exec_pool_tasks", "Tareas en los pools de hilos", ("pool", "state"))
+DB_REPEATED_STATEMENTS = Counter("db_repeated_statements_total",
+                                 "Peticiones con una misma sentencia repetida (posible N+1)", ("route",))
+DB_BUDGET_EXCEEDED = Counter("db_query_budget_exceeded_total",
+                             "Peticiones que superaron su presupuesto de consultas", ("route",))
+
+# estadísticas SQL de la petición en curso; las rutas síncronas corren en hilos con una copia
+# del contexto que apunta al mismo dict
+_REQUEST_STATS: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_stats", default=None)
+
+def _new_request_stats(scope=None) -> dict:
+    # statements: SQL con placeholders -> veces; la misma sentencia con otros parámetros cuenta igual
+    return {"sql_count": 0, "sql_s": 0.0, "statements": {}, "scope": scope}
+
+def _request_budget(stats: dict) -> Optional[int]:
+    scope = stats.get("scope")
+    endpoint = scope.get("endpoint") if scope is not None else None  # lo fija el router al resolver la ruta
+    return getattr(endpoint, "__query_budget__", None)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_timer_start(conn, cursor, statement, parameters, context, executemany):
+    # sólo mide: el presupuesto se aplica en MetricsMiddleware al terminar el endpoint, nunca
+    # a mitad de una unidad de trabajo
+    if context is not None:
+        context._metrics_t0 = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_timer_end(conn, cursor, statement, parameters, context, executemany):
+    t0 = getattr(context, "_metrics_t0", None)
+    if t0 is None:
+        return
+    elapsed = time.perf_counter() - t0
+    stats = _REQUEST_STATS.get()
+    if stats is not None:
+        stats["sql_count"] += 1
+        stats["sql_s"] += elapsed
+        stats["statements"][statement] = stats["statements"].get(statement, 0) + 1
+    if 0 < SLOW_QUERY_MS <= 1000 * elapsed and context.execution_options.get("slow_log", True):
+        SLOW_QUERY_LOG.record(conn.engine, statement, parameters, executemany, elapsed, stats)
+
+def _collect_pool_gauges():
+    engines = [("primary", engine)]
+    if async_engine is not None:
+        engines.append(("async", async_engine.sync_engine))
+    if replica_engine is not None:
+        engines.append(("replica", replica_engine))
+    if lock_engine is not engine:
+        engines.append(("lock", lock_engine))
+    for name, eng in engines:
+        st = pool_stats_of(eng)
+        for state in ("in_use", "idle", "overflow"):
+            if state in st:
+                DB_POOL_CONNECTIONS.set(st[state], engine=name, state=state)
+    for st in (interactive_pool_stats(), FILE_IO_POOL.stats(), CPU_POOL.stats()):
+        EXEC_POOL_TASKS.set(st["in_use"], pool=st["name"], state="in_use")
+        EXEC_POOL_TASKS.set(st["waiting"], pool=st["name"], state="waiting")
+
+def render_metrics() -> str:
+    # corre en el event loop (lee el limiter del threadpool por defecto)
+    _collect_pool_gauges()
+    lines = []
+    for m in METRICS:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ----------------- Presupuesto de consultas y detector de N+1 -----------------
+_N1_REPORTED: set = set()             # (ruta, sentencia) ya avisadas: un WARN por patrón y proceso
+_QUERY_CAPTURES: List[List[dict]] = []  # capturas activas de assert_max_queries
+
+def query_budget(n: int):
+    """Declara el máximo de sentencias SQL de un endpoint (incluye dependencias y autenticación).
+
+    Al excederlo se avisa por log y métrica; con QUERY_BUDGET_ENFORCE=true (pruebas/CI) la
+    respuesta del endpoint se sustituye por un 500 (si aún no empezó a enviarse).
+    """
+    def deco(fn):
+        fn.__query_budget__ = n  # functools.wraps de @offload lo copia al wrapper
+        return fn
+    return deco
+
+def _budget_overrun(stats: dict) -> Optional[str]:
+    budget = _request_budget(stats)
+    if budget is not None and stats["sql_count"] > budget:
+        return f"Presupuesto de consultas excedido: {stats['sql_count']} (máx. {budget})"
+    return None
+
+def _check_request_queries(stats: dict, route: str):
+    budget = _request_budget(stats)
+    if _budget_overrun(stats):
+        DB_BUDGET_EXCEEDED.inc(route=route)
+        print(f"WARN presupuesto de consultas: {route} ejecutó {stats['sql_count']} (máx. {budget})")
+    repeated = False
+    for statement, n in stats["statements"].items():
+        if n < QUERY_N1_THRESHOLD:
+            continue
+        repeated = True
+        if (route, statement) not in _N1_REPORTED:
+            _N1_REPORTED.add((route, statement))
+            print(f"WARN posible N+1 en {route}: {n} veces -> {' '.join(statement.split())[:300]}")
+    if repeated:
+        DB_REPEATED_STATEMENTS.inc(route=route)
+    for capture in list(_QUERY_CAPTURES):
+        capture.append({"route": route, "sql_count": stats["sql_count"], "statements": dict(stats["statements"])})
+
+def _server_timing(stats: dict, elapsed_s: float) -> str:
+    return (f'db;dur={1000 * stats["sql_s"]:.1f};desc="{stats["sql_count"]} consultas", '
+            f"app;dur={1000 * elapsed_s:.1f}")
+
+@contextmanager
+def assert_max_queries(n: int):
+    """Falla (AssertionError) si el bloque ejecuta más de `n` sentencias SQL.
+
+    Cuenta tanto las peticiones atendidas durante el bloque (p. ej. con TestClient) como las
+    consultas hechas directamente en el hilo actual:
+
+        with assert_max_queries(12):
+            client.get("/projects/1/expediente", headers=auth)
+    """
+    capture: List[dict] = []
+    direct = _new_request_stats()
+    token = _REQUEST_STATS.set(direct)
+    _QUERY_CAPTURES.append(capture)
+    try:
+        yield capture
+    finally:
+        _QUERY_CAPTURES.remove(capture)
+        _REQUEST_STATS.reset(token)
+    total = direct["sql_count"] + sum(c["sql_count"] for c in capture)
+    if total > n:
+        top = sorted(((k, v) for c in capture + [direct] for k, v in c["statements"].items()),
+                     key=lambda kv: -kv[1])[:5]
+        detail = "; ".join(f"{v}x {' '.join(k.split())[:120]}" for k, v in top)
+        raise AssertionError(f"{total} consultas SQL (máx. {n}): {detail}")
+
+
+# ----------------- Registro de consultas lentas -----------------
+class _SlowQueryLog:
+    """Guarda en slow_queries las sentencias que superan SLOW_QUERY_MS, desde un hilo de fondo.
+
+    El hook del engine sólo encola (cola acotada: si se llena se descarta). Para una muestra en
+    PostgreSQL el hilo captura el plan con los mismos parámetros: EXPLAIN (ANALYZE, BUFFERS) sólo
+    para lecturas puras, EXPLAIN simple (no ejecuta) para el resto. Los parámetros se guardan como
+    tipo/longitud salvo con SLOW_QUERY_LOG_PARAMS. Sus propias sentencias no se registran.
+    """
+
+    PARAMS_MAX_CHARS = 2000
+    PRUNE_EVERY = 100
+
+    def __init__(self, max_queue: int = 1000):
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._last_plan: Dict[str, float] = {}  # sentencia -> último EXPLAIN (monotonic)
+        self._since_prune = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None and SLOW_QUERY_MS > 0:
+            self._thread = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+            self._thread.start()
+
+    def record(self, eng, statement: str, parameters, executemany: bool, elapsed_s: float, stats: Optional[dict]):
+        if self._thread is None:
+            return
+        scope = stats.get("scope") if stats else None
+        item = {
+            "engine": eng, "statement": statement, "parameters": parameters, "executemany": executemany,
+            "duration_ms": round(1000 * elapsed_s, 3),
+            "route": _route_template(scope) if scope is not None else None,
+            "username": stats.get("user") if stats else None,
+        }
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._store(item)
+            except Exception as e:
+                print("WARN slow-query-log:", e)
+
+    # ANALYZE vuelve a ejecutar la sentencia: bloqueos de fila, advisory locks (de sesión: el
+    # rollback no los libera y la conexión volvería al pool con el lock) o funciones volátiles
+    _SIDE_EFFECTS = re.compile(
+        r"\bfor\s+(no\s+key\s+)?(update|share)\b|\bfor\s+key\s+share\b|pg_(try_)?advisory|"
+        r"nextval|setval|pg_notify|set_config|txid_current|pg_sleep|\binto\b",
+        re.IGNORECASE,
+    )
+    _NO_PLAN = re.compile(r"pg_(try_)?advisory|pg_sleep", re.IGNORECASE)  # el plan no aporta nada
+
+    def _explain_mode(self, statement: str) -> Optional[str]:
+        # "analyze" sólo para SELECT sin efectos; "plain" para lo demás (EXPLAIN sin ANALYZE no ejecuta)
+        if self._NO_PLAN.search(statement):
+            return None
+        if statement.lstrip().lower().startswith("select") and not self._SIDE_EFFECTS.search(statement):
+            return "analyze"
+        return "plain"
+
+    def _should_explain(self, item: dict) -> bool:
+        eng = item["engine"]
+        if item["executemany"] or eng.dialect.name != "postgresql" or eng.dialect.is_async:
+            return False
+        if self._explain_mode(item["statement"]) is None:
+            return False
+        now = time.monotonic()
+        if now - self._last_plan.get(item["statement"], -SLOW_QUERY_EXPLAIN_INTERVAL_S) < SLOW_QUERY_EXPLAIN_INTERVAL_S:
+            return False
+        if random.random() >= SLOW_QUERY_EXPLAIN_RATE:
+            return False
+        self._last_plan[item["statement"]] = now
+        return True
+
+    def _explain(self, item: dict) -> Optional[str]:
+        timeout_ms = max(int(10 * item["duration_ms"]), 1000)
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if self._explain_mode(item["statement"]) == "analyze" else "FORMAT JSON"
+        with item["engine"].connect() as conn:
+            conn = conn.execution_options(slow_log=False)
+            try:
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+                plan = conn.exec_driver_sql(f"EXPLAIN ({options}) " + item["statement"],
+                                            item["parameters"]).scalar()
+            except DBAPIError as e:
+                return json.dumps({"error": str(e.orig)[:500]})
+            finally:
+                conn.rollback()
+        return plan if isinstance(plan, str) else json.dumps(plan)
+
+    def _store(self, item: dict):
+        plan = self._explain(item) if self._should_explain(item) else None
+        params = item["parameters"]
+        if params and not SLOW_QUERY_LOG_PARAMS:
+            params = _param_shapes(params)
+        params = json.dumps(params, default=str)[:self.PARAMS_MAX_CHARS] if params else None
+        with engine.begin() as conn:
+            conn = conn.execution_options(slow_log=False)
+            conn.execute(insert(SlowQuery).values(
+                duration_ms=item["duration_ms"], route=item["route"], username=item["username"],
+                statement=item["statement"], params=params, plan=plan,
+            ))
+            self._since_prune += 1
+            if self._since_prune >= self.PRUNE_EVERY:
+                self._since_prune = 0
+                newest = conn.execute(select(func.max(SlowQuery.id))).scalar() or 0
+                conn.execute(delete(SlowQuery).where(SlowQuery.id <= newest - SLOW_QUERY_KEEP))
+
+def _param_shapes(params):
+    # tipo y longitud de cada parámetro, sin el valor
+    def shape(v):
+        if v is None:
+            return None
+        if isinstance(v, (str, bytes, bytearray, list, tuple)):
+            return f"{type(v).__name__}({len(v)})"
+        return type(v).__name__
+    if isinstance(params, dict):
+        return {k: shape(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if params and isinstance(params[0], (dict, list, tuple)):  # executemany
+            return {"rows": len(params), "first": _param_shapes(params[0])}
+        return [shape(v) for v in params]
+    return shape(params)
+
+SLOW_QUERY_LOG = _SlowQueryLog()
+
+
+# ----------------- Paginación por cursor (keyset) -----------------
+def _encode_cursor(*values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, kinds: Tuple[type, ...]) -> tuple:
+    # kinds indica el tipo de cada posición (datetime, int, float, str)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(kinds):
+            raise ValueError(cursor)
+        return tuple(datetime.fromisoformat(v) if k is datetime else k(v) for v, k in zip(values, kinds))
+    except Exception:
+        raise HTTPException(400, "Cursor inválido")
+
+def _keyset_page(qset, keys: list, kinds: Tuple[type, ...], cursor: Optional[str], limit: int,
+                 row_key, descending: bool = True, offset: int = 0):
+    # Ordena por `keys`, continúa después del cursor y devuelve (filas, next_cursor)
+    qset = _keyset_stmt(qset, keys, kinds, cursor, limit, descending, offset)
+    return _keyset_result(qset.all(), limit, row_key)
+
+def _keyset_stmt(qset, keys: list, kinds: Tuple[type, ...], cursor: Optional[str], limit: int,
+                 descending: bool = True, offset: int = 0):
+    # igual para Query y select(): la ruta /async ejecuta el mismo statement con await
+    if cursor:
+        after = tuple_(*_decode_cursor(cursor, kinds))
+        qset = qset.filter(tuple_(*keys) < after if descending else tuple_(*keys) > after)
+    qset = qset.order_by(*[desc(k) if descending else k for k in keys]).limit(limit + 1)
+    if offset and not cursor:
+        qset = qset.offset(offset)
+    return qset
+
+def _keyset_result(rows: list, limit: int, row_key):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(*row_key(rows[-1]))
+    return rows, next_cursor
+
+
+# ----------------- Búsqueda por subcadena (trigramas) -----------------
+def _trigrams(s: str) -> set:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def _trgm_similarity(a: str, b: str) -> float:
+    # misma definición que pg_trgm: palabras con relleno "  w ", Jaccard de trigramas
+    def grams(s: str) -> set:
+        out = set()
+        for w in re.findall(r"[0-9a-záéíóúñü]+", s.lower()):
+            out |= _trigrams(f"  {w} ")
+        return out
+    ga, gb = grams(a), grams(b)
+    if not ga or not gb:
+        return 0.0
+    return len(ga & gb) / len(ga | gb)
+
+class _NgramIndex:
+    """Índice de trigramas en memoria para bases sin pg_trgm (p. ej. SQLite de pruebas).
+
+    Se reconstruye cuando cambia la firma (count, max(id)) de la tabla o cuando una sesión de este
+    proceso renombra, crea o borra filas (un renombre no cambia la firma).
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self.model = column.class_
+        self.pk = self.model.id
+        self._lock = threading.Lock()
+        self._signature = None
+        self._names: Dict[int, str] = {}
+        self._postings: Dict[str, set] = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def _refresh(self, db: Session):
+        signature = tuple(db.query(func.count(self.pk), func.max(self.pk)).one())
+        with self._lock:
+            if signature == self._signature:
+                return
+            names: Dict[int, str] = {}
+            postings: Dict[str, set] = {}
+            for rid, name in db.query(self.pk, self.column).yield_per(10000):
+                low = (name or "").lower()
+                names[rid] = low
+                for g in _trigrams(low):
+                    postings.setdefault(g, set()).add(rid)
+            self._names, self._postings, self._signature = names, postings, signature
+
+    def search(self, db: Session, q: str) -> Dict[int, float]:
+        self._refresh(db)
+        names, postings = self._names, self._postings
+        needle = q.lower()
+        grams = _trigrams(needle)
+        if grams:
+            lists = sorted((postings.get(g, set()) for g in grams), key=len)
+            candidates = set(lists[0]).intersection(*lists[1:])
+        else:
+            candidates = names.keys()
+        return {rid: _trgm_similarity(needle, names[rid]) for rid in candidates if needle in names[rid]}
+
+_FILENAME_INDEX = _NgramIndex(FileRecord.filename)
+_USERNAME_INDEX = _NgramIndex(User.username)
+
+def _ngram_after_flush(session, flush_context):
+    for index in (_FILENAME_INDEX, _USERNAME_INDEX):
+        key = index.column.key
+        if any(isinstance(o, index.model) for o in (*session.new, *session.deleted)) or any(
+            isinstance(o, index.model) and get_history(o, key).has_changes() for o in session.dirty
+        ):
+            index.invalidate()
+
+def _ngram_orm_execute(state):
+    # UPDATE/DELETE masivos (query.update, update(FileRecord)...) no pasan por el flush
+    if state.is_update or state.is_delete:
+        touched = {m.class_ for m in state.all_mappers}
+        for index in (_FILENAME_INDEX, _USERNAME_INDEX):
+            if index.model in touched:
+                index.invalidate()
+
+event.listen(SessionLocal, "after_flush", _ngram_after_flush)
+event.listen(SessionLocal, "do_orm_execute", _ngram_orm_execute)
+
+# La relevancia se pagina como entero (similitud * _RANK_SCALE): similarity() es float4 y un cursor
+# float8 no compara igual contra ella, así que la fila frontera y sus empates se saltaban o repetían.
+_RANK_SCALE = 1_000_000
+
+def _name_search(db: Session, index: _NgramIndex, q: str):
+    # Devuelve (filtro, expresión de ranking entera) para una búsqueda por subcadena
+    q = q.strip()
+    if TRGM_ENABLED:
+        # ILIKE '%q%' usa el índice GIN gin_trgm_ops; similarity() ordena por relevancia
+        rank = cast(func.round(cast(func.similarity(index.column, q), Numeric) * _RANK_SCALE), Integer)
+        return index.column.ilike(f"%{q}%"), rank
+    scores = index.search(db, q)
+    if not scores:
+        return false(), literal(0)
+    ranks = {rid: round(score * _RANK_SCALE) for rid, score in scores.items()}
+    return index.pk.in_(list(ranks)), case(ranks, value=index.pk, else_=0)
+
+
+# ----------------- Indexado de contenido (full-text) -----------------
+def _extract_plain(path: Path) -> str:
+    with path.open("rb") as f:
+        raw = f.read(CONTENT_INDEX_MAX_CHARS * 4)
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+def _xml_texts(zf: zipfile.ZipFile, member: str, tag: str, para_tag: Optional[str] = None) -> List[str]:
+    out: List[str] = []
+    with zf.open(member) as fh:
+        for _, el in ET.iterparse(fh):
+            name = el.tag.rsplit("}", 1)[-1]
+            if name == tag and el.text:
+                out.append(el.text)
+            elif para_tag and name == para_tag:
+                out.append("\n")
+            el.clear()
+    return out
+
+def _extract_docx(path: Path) -> str:
+    with zipfile.ZipFile(path) as zf:
+        return "".join(_xml_texts(zf, "word/document.xml", "t", para_tag="p"))
+
+def _extract_xlsx(path: Path) -> str:
+    parts: List[str] = []
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        if "xl/sharedStrings.xml" in names:
+            parts += _xml_texts(zf, "xl/sharedStrings.xml", "t")
+        for member in names:
+            # celdas con texto en línea (inlineStr)
+            if member.startswith("xl/worksheets/") and member.endswith(".xml"):
+                parts += _xml_texts(zf, member, "t")
+    return "\n".join(parts)
+
+def _extract_pdf(path: Path) -> Optional[str]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    reader = PdfReader(str(path))
+    parts: List[str] = []
+    size = 0
+    for page in reader.pages:
+        chunk = page.extract_text() or ""
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= CONTENT_INDEX_MAX_CHARS:
+            break
+    return "\n".join(parts)
+
+_EXTRACTORS = {
+    "txt": _extract_plain,
+    "csv": _extract_plain,
+    "docx": _extract_docx,
+    "xlsx": _extract_xlsx,
+    "pdf": _extract_pdf,
+}
+
+def _advisory_key(name: str) -> int:
+    return zlib.crc32(name.encode())
+
+def _try_advisory_lock(conn, name: str) -> bool:
+    # lock de sesión en PostgreSQL; en otras bases siempre se concede. El commit cierra la
+    # transacción del SELECT (el lock de sesión sigue tomado): la conexión del lock no queda
+    # "idle in transaction" reteniendo el xmin mientras dura el trabajo.
+    if not IS_POSTGRES:
+        return True
+    got = bool(conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _advisory_key(name)}).scalar())
+    conn.commit()
+    return got
+
+class _ContentIndexer:
+    """Extrae el texto de los archivos en un hilo de fondo y lo guarda en file_contents.
+
+    Las cargas nuevas se encolan tras el commit; al arrancar se recorren los archivos
+    sin contenido indexado (un solo worker a la vez, vía advisory lock).
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[int]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="content-indexer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, file_id: int):
+        if self._thread is not None:
+            self._queue.put(file_id)
+
+    def _run(self):
+        try:
+            self._catch_up()
+        except Exception as e:
+            print("WARN content-indexer (catch-up):", e)
+        while True:
+            file_id = self._queue.get()
+            try:
+                self.index_file(file_id)
+            except Exception as e:
+                print(f"WARN content-indexer file={file_id}:", e)
+
+    def _catch_up(self, batch: int = 500):
+        with lock_engine.connect() as lock_conn:
+            if not _try_advisory_lock(lock_conn, "content-indexer"):
+                return
+            last_id = 0
+            while True:
+                with SessionLocal() as db:
+                    ids = [
+                        fid for (fid,) in db.query(FileRecord.id)
+                        .outerjoin(FileContent, FileContent.file_id == FileRecord.id)
+                        .filter(FileContent.file_id.is_(None), FileRecord.id > last_id)
+                        .order_by(FileRecord.id)
+                        .limit(batch)
+                    ]
+                if not ids:
+                    break
+                for fid in ids:
+                    self.index_file(fid)
+                last_id = ids[-1]
+
+    def index_file(self, file_id: int):
+        with SessionLocal() as db:
+            rec = db.get(FileRecord, file_id)
+            if not rec:
+                return  # borrado antes de indexar
+            path, project_id = Path(rec.path), rec.project_id
+            ext = Path(rec.filename).suffix.lower().lstrip(".")
+
+        content, error, state = None, None, "ok"
+        extractor = _EXTRACTORS.get(ext) if ext in CONTENT_INDEX_EXT else None
+        if extractor is None:
+            state = "unsupported"
+        else:
+            try:
+                content = extractor(path)
+                if content is None:
+                    state = "unsupported"
+                else:
+                    content = content.replace("\x00", "")[:CONTENT_INDEX_MAX_CHARS]
+                    if not content.strip():
+                        content, state = None, "empty"
+            except Exception as e:
+                content, error, state = None, str(e)[:500], "error"
+
+        with SessionLocal() as db:
+            db.merge(FileContent(
+                file_id=file_id, project_id=project_id, status=state,
+                content=content, error=error, extracted_at=datetime.utcnow(),
+            ))
+            try:
+                db.commit()
+            except Exception:
+                db.rollback()  # el archivo se borró mientras se extraía
+
+CONTENT_INDEXER = _ContentIndexer()
+
+def _snippet(content: str, q: str, width: int = 80) -> str:
+    # fallback sin ts_headline: fragmento alrededor de la primera coincidencia
+    pos = content.lower().find(q.lower())
+    if pos < 0:
+        return content[: 2 * width].strip()
+    start = max(0, pos - width)
+    end = min(len(content), pos + len(q) + width)
+    return ("…" if start else "") + content[start:pos] + "«" + content[pos:pos + len(q)] + "»" + content[pos + len(q):end] + ("…" if end < len(content) else "")
+
+
+# ----------------- Reconciliación almacenamiento <-> base de datos -----------------
+def _scan_dir(path: str, known_mtime: Optional[float], full: bool):
+    # (mtime, archivos {ruta: tamaño} o None si la carpeta no cambió, subcarpetas)
+    st = os.stat(path)
+    changed = full or known_mtime != st.st_mtime
+    files: Optional[Dict[str, int]] = {} if changed else None
+    subdirs: List[str] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif changed and entry.is_file(follow_symlinks=False):
+                files[entry.path] = entry.stat(follow_symlinks=False).st_size
+    return st.st_mtime, files, subdirs
+
+def _mark_storage_dirs_dirty(db: Session, paths: Iterable[str]):
+    # Borrar una fila de files no cambia el mtime de la carpeta si el unlink falla;
+    # se olvida su estado para que la próxima reconciliación incremental la revise.
+    parents = list({os.path.dirname(p) for p in paths if p})
+    for i in range(0, len(parents), 1000):
+        db.query(StorageDir).filter(StorageDir.path.in_(parents[i:i + 1000])).delete(synchronize_session=False)
+
+def _stale_uploads(max_age_s: int) -> List[Tuple[str, int]]:
+    # archivos de staging (.uploads) abandonados: una subida en curso los renombra o borra
+    cutoff = time.time() - max_age_s
+    stale: List[Tuple[str, int]] = []
+    try:
+        with os.scandir(UPLOAD_TMP) as it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if entry.is_file(follow_symlinks=False) and st.st_mtime < cutoff:
+                    stale.append((entry.path, st.st_size))
+    except FileNotFoundError:
+        pass
+    return sorted(stale)
+
+def reconcile_storage(full: bool = False, workers: int = RECONCILE_WORKERS, sample: int = 200) -> dict:
+    """Compara FILES_ROOT/projects con la tabla files.
+
+    Reporta huérfanos (en disco sin registro), faltantes (registro sin archivo) y tamaños distintos.
+    En modo incremental sólo se revisan las carpetas cuyo mtime cambió desde el último escaneo
+    limpio (los borrados de registros marcan su carpeta para revisión); los cambios de tamaño
+    in situ (sobrescrituras) sólo se detectan en modo completo. Siempre se revisa FILES_ROOT/.uploads
+    en busca de archivos de staging abandonados.
+    """
+    root = str(FILES_ROOT / "projects")
+    with SessionLocal() as db:
+        known: Dict[str, float] = {} if full else dict(db.query(StorageDir.path, StorageDir.mtime).all())
+
+    # 1) recorrido paralelo con os.scandir
+    dir_mtimes: Dict[str, float] = {}
+    disk: Dict[str, int] = {}
+    changed_dirs: set = set()
+    if os.path.isdir(root):
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = {pool.submit(_scan_dir, root, known.get(root), full): root}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    path = pending.pop(fut)
+                    try:
+                        mtime, files, subdirs = fut.result()
+                    except FileNotFoundError:
+                        continue
+                    dir_mtimes[path] = mtime
+                    if files is not None:
+                        changed_dirs.add(path)
+                        disk.update(files)
+                    for sub in subdirs:
+                        pending[pool.submit(_scan_dir, sub, known.get(sub), full)] = sub
+
+    # 2) registros de la base con cursor del lado del servidor
+    missing: List[dict] = []
+    mismatched: List[dict] = []
+    n_missing = n_mismatch = n_checked = 0
+    dirty_dirs: set = set()
+    with SessionLocal() as db:
+        stmt = (
+            select(FileRecord.id, FileRecord.path, FileRecord.size_bytes)
+            .join(Project, Project.id == FileRecord.project_id)
+            .where(Project.deleted_at.is_(None))
+            .execution_options(stream_results=True, yield_per=5000)
+        )
+        for fid, path, size in db.execute(stmt):
+            parent = os.path.dirname(path)
+            if parent in dir_mtimes and parent not in changed_dirs:
+                continue  # carpeta sin cambios desde el último escaneo limpio
+            n_checked += 1
+            if parent in changed_dirs:
+                disk_size = disk.pop(path, None)
+            else:
+                # fuera del árbol escaneado o carpeta inexistente
+                try:
+                    disk_size = os.stat(path).st_size
+                except OSError:
+                    disk_size = None
+            if disk_size is None:
+                n_missing += 1
+                dirty_dirs.add(parent)
+                if len(missing) < sample:
+                    missing.append({"file_id": fid, "path": path})
+            elif disk_size != size:
+                n_mismatch += 1
+                dirty_dirs.add(parent)
+                if len(mismatched) < sample:
+                    mismatched.append({"file_id": fid, "path": path, "db_size": size, "disk_size": disk_size})
+
+    orphans = sorted(disk.items())
+    for path, _ in orphans:
+        dirty_dirs.add(os.path.dirname(path))
+    stale_uploads = _stale_uploads(RECONCILE_STAGING_MAX_AGE_S)
+
+    # 3) guarda el estado de las carpetas limpias; las sucias se revisan de nuevo la próxima vez
+    with SessionLocal() as db:
+        clean = [{"path": p, "mtime": m} for p, m in dir_mtimes.items() if p not in dirty_dirs]
+        for i in range(0, len(clean), 1000):
+            stmt = dialect_insert(StorageDir).values(clean[i:i + 1000])
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[StorageDir.path],
+                set_={"mtime": stmt.excluded.mtime, "scanned_at": func.now()},
+            ))
+        if dirty_dirs:
+            db.query(StorageDir).filter(StorageDir.path.in_(list(dirty_dirs))).delete(synchronize_session=False)
+        if full:
+            gone = [p for (p,) in db.query(StorageDir.path) if p not in dir_mtimes]
+            for i in range(0, len(gone), 1000):
+                db.query(StorageDir).filter(StorageDir.path.in_(gone[i:i + 1000])).delete(synchronize_session=False)
+        db.commit()
+
+    return {
+        "mode": "full" if full else "incremental",
+        "dirs_total": len(dir_mtimes),
+        "dirs_scanned": len(changed_dirs),
+        "records_checked": n_checked,
+        "orphans": len(orphans),
+        "missing": n_missing,
+        "size_mismatch": n_mismatch,
+        "stale_uploads": len(stale_uploads),
+        "orphan_samples": [{"path": p, "size": sz} for p, sz in orphans[:sample]],
+        "missing_samples": missing,
+        "size_mismatch_samples": mismatched,
+        "stale_upload_samples": [{"path": p, "size": sz} for p, sz in stale_uploads[:sample]],
+    }
+
+def run_reconcile_report(report_id: int, full: bool, workers: int = RECONCILE_WORKERS):
+    # ejecuta reconcile_storage y guarda el resultado en storage_reports
+    with lock_engine.connect() as lock_conn:
+        if not _try_advisory_lock(lock_conn, "storage-reconcile"):
+            with SessionLocal() as db:
+                rep = db.get(StorageReport, report_id)
+                rep.status, rep.error, rep.finished_at = "failed", "Otra reconciliación está en curso", datetime.utcnow()
+                db.commit()
+            return
+        try:
+            summary = reconcile_storage(full=full, workers=workers)
+            status_, error = "done", None
+        except Exception as e:
+            summary, status_, error = None, "failed", str(e)[:1000]
+        finally:
+            if IS_POSTGRES:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _advisory_key("storage-reconcile")})
+    with SessionLocal() as db:
+        rep = db.get(StorageReport, report_id)
+        rep.status = status_
+        rep.error = error
+        rep.summary = json.dumps(summary) if summary is not None else None
+        rep.finished_at = datetime.utcnow()
+        db.commit()
+
+
+# ----------------- Verificación de integridad (scrubber) -----------------
+class _ThrottledReader(io.RawIOBase):
+    # lector que respeta un _Throttle; compatible con hashlib.file_digest (readinto)
+    def __init__(self, raw, throttle: "_Throttle"):
+        self._raw = raw
+        self._throttle = throttle
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self._raw.readinto(b)
+        self._throttle.consume(n or 0)
+        return n
+
+def _hash_file(path: Path, throttle: Optional["_Throttle"] = None) -> str:
+    with path.open("rb") as f:
+        src = _ThrottledReader(f, throttle) if throttle else f
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(src, "sha256").hexdigest()
+        hasher = hashlib.sha256()
+        buf = bytearray(1024 * 1024)
+        while True:
+            n = src.readinto(buf)
+            if not n:
+                break
+            hasher.update(memoryview(buf)[:n])
+        return hasher.hexdigest()
+
+def verify_file_record(file_id: int, path: str, expected: Optional[str],
+                       throttle: Optional["_Throttle"] = None) -> Tuple[str, datetime]:
+    # Recalcula el sha256 sin transacción abierta (puede tardar minutos con el throttle) y
+    # registra el resultado en una transacción corta aparte
+    values = {}
+    try:
+        digest = _hash_file(Path(path), throttle)
+    except FileNotFoundError:
+        result = "missing"
+    else:
+        if expected is None:
+            values["sha256"] = func.coalesce(FileRecord.sha256, digest)
+        result = "ok" if expected is None or digest == expected else "mismatch"
+    values.update(verify_status=result, verified_at=datetime.utcnow())
+    with SessionLocal() as db:
+        db.execute(update(FileRecord).where(FileRecord.id == file_id).values(**values))
+        db.commit()
+    return result, values["verified_at"]
+
+class _IntegrityScrubber:
+    """Re-hashea archivos en segundo plano con un presupuesto de SCRUB_MAX_MBPS.
+
+    Prioriza los nunca verificados y luego los verificados hace más tiempo (más de
+    SCRUB_REVERIFY_DAYS). Un solo worker a la vez vía advisory lock.
+    """
+
+    def __init__(self, batch: int = 50):
+        self.batch = batch
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="integrity-scrubber", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            worked = False
+            try:
+                with lock_engine.connect() as lock_conn:
+                    if _try_advisory_lock(lock_conn, "integrity-scrubber"):
+                        worked = self._scrub_batch()
+                        if IS_POSTGRES:
+                            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _advisory_key("integrity-scrubber")})
+                    lock_conn.rollback()
+            except Exception as e:
+                print("WARN integrity-scrubber:", e)
+            if not worked:
+                time.sleep(SCRUB_IDLE_S)
+
+    def _scrub_batch(self) -> bool:
+        cutoff = datetime.utcnow() - timedelta(days=SCRUB_REVERIFY_DAYS)
+        throttle = _Throttle(SCRUB_MAX_MBPS * 1024 * 1024)
+        with SessionLocal() as db:
+            rows = db.execute(
+                select(FileRecord.id, FileRecord.path, FileRecord.sha256)
+                .where(or_(FileRecord.verified_at.is_(None), FileRecord.verified_at < cutoff))
+                .order_by(FileRecord.verified_at.asc().nulls_first(), FileRecord.id)
+                .limit(self.batch)
+            ).all()
+        # la sesión ya se cerró: el hash de cada archivo corre sin conexión tomada
+        for file_id, path, sha256 in rows:
+            result, _ = verify_file_record(file_id, path, sha256, throttle)
+            if result != "ok":
+                print(f"WARN integrity-scrubber file={file_id}: {result} ({path})")
+        return bool(rows)
+
+INTEGRITY_SCRUBBER = _IntegrityScrubber()
+
+
 # ----------------- Expediente IMT (helpers) -----------------
 
 def _parse_allowed_ext_csv(csv: str) -> set[str]:
@@ -443,29 +2224,190 @@ def _build_expediente_path(proj_code: str, stage_code: str, deliverable_key: str
             / stage_code / deliverable_key / f"v{version}")
 
 def _next_version_for_deliverable(db: Session, deliverable_id: int) -> int:
-    # Siguiente versión secuencial (sirve tanto para single como multi)
-    q = db.query(func.max(FileRecord.version)).filter(FileRecord.deliverable_id == deliverable_id)
-    maxv = q.scalar() or 0
-    return maxv + 1
+    # Siguiente versión secuencial (sirve tanto para single como multi).
+    # El UPDATE ... RETURNING toma el lock de la fila del entregable hasta el commit:
+    # dos cargas concurrentes no pueden obtener la misma versión y un rollback no deja huecos.
+    return db.execute(
+        update(DeliverableSpec)
+        .where(DeliverableSpec.id == deliverable_id)
+        .values(last_version=DeliverableSpec.last_version + 1)
+        .returning(DeliverableSpec.last_version)
+    ).scalar_one()
+
+def _stream_upload(file: UploadFile, dest_path: Path) -> Tuple[int, str]:
+    # Copia por chunks validando MAX_FILE_MB; devuelve (bytes, sha256)
+    hasher = hashlib.sha256()
+    total = 0
+    with dest_path.open("wb") as f:
+        while True:
+            chunk = file.file.read(1024 * 1024)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > MAX_FILE_MB * 1024 * 1024:
+                f.close()
+                try:
+                    dest_path.unlink()
+                except Exception:
+                    pass
+                raise HTTPException(413, f"Archivo supera {MAX_FILE_MB} MB")
+            hasher.update(chunk)
+            f.write(chunk)
+            UPLOAD_BYTES.inc(len(chunk))
+    return total, hasher.hexdigest()
+
+# ----------------- Plantillas de checklist -----------------
+SPEC_FIELDS = ("title", "required", "multi", "allowed_ext", "order_index", "optional_group")
+TEMPLATE_CACHE: Dict[int, dict] = {}  # template_id -> árbol; las versiones no cambian, no hay invalidación
+
+# Las consultas se arman como select() y la construcción de resultados es pura, de modo que la
+# ruta síncrona (Session) y la asíncrona (AsyncSession, rutas /async) comparten todo salvo el await.
+def _template_stages_stmt(template_id: int):
+    return select(TemplateStage).where(TemplateStage.template_id == template_id)\
+        .order_by(TemplateStage.order_index, TemplateStage.id)
+
+def _template_deliverables_stmt(template_stage_ids: List[int]):
+    return select(TemplateDeliverable).where(TemplateDeliverable.template_stage_id.in_(template_stage_ids))\
+        .order_by(TemplateDeliverable.order_index, TemplateDeliverable.id)
+
+def _build_template_tree(template_id: int, stages: List[TemplateStage], delivs: List[TemplateDeliverable]) -> dict:
+    by_stage: Dict[int, list] = {st.id: [] for st in stages}
+    for d in delivs:
+        by_stage[d.template_stage_id].append({"id": d.id, "key": d.key, **{f: getattr(d, f) for f in SPEC_FIELDS}})
+    tree = {"stages": [
+        {"code": st.code, "name": st.name, "order_index": st.order_index, "deliverables": by_stage[st.id]}
+        for st in stages
+    ]}
+    tree["by_key"] = {(st["code"], d["key"]): d for st in tree["stages"] for d in st["deliverables"]}
+    TEMPLATE_CACHE[template_id] = tree
+    return tree
+
+def template_tree(db: Session, template_id: int) -> dict:
+    """Etapas y entregables de una versión de plantilla (cacheado en proceso)."""
+    tree = TEMPLATE_CACHE.get(template_id)
+    if tree is not None:
+        return tree
+    stages = db.execute(_template_stages_stmt(template_id)).scalars().all()
+    delivs = db.execute(_template_deliverables_stmt([st.id for st in stages])).scalars().all() if stages else []
+    return _build_template_tree(template_id, stages, delivs)
+
+class EffectiveSpec:
+    """Entregable tal como lo ve un proyecto: plantilla fijada salvo override. id es None mientras no se materialice."""
+    __slots__ = ("id", "key", "template_deliverable_id") + SPEC_FIELDS
+
+    def __init__(self, id: Optional[int], key: str, template_deliverable_id: Optional[int], fields: Dict[str, object]):
+        self.id = id
+        self.key = key
+        self.template_deliverable_id = template_deliverable_id
+        for f in SPEC_FIELDS:
+            setattr(self, f, fields[f])
+
+def _spec_rows_stmt(stage_ids: List[int]):
+    return select(DeliverableSpec).where(DeliverableSpec.stage_id.in_(stage_ids))
+
+def _merge_specs(tree: dict, stages: List[Stage], rows: List[DeliverableSpec]) -> Dict[int, List[EffectiveSpec]]:
+    tstages = {st["code"]: st for st in tree["stages"]}
+    own: Dict[int, Dict[str, DeliverableSpec]] = {}
+    for r in rows:
+        own.setdefault(r.stage_id, {})[r.key] = r
+
+    out: Dict[int, List[EffectiveSpec]] = {}
+    for s in stages:
+        mine = dict(own.get(s.id, {}))
+        specs = []
+        tst = tstages.get(s.code)
+        for d in (tst["deliverables"] if tst else []):
+            r = mine.pop(d["key"], None)
+            fields = {f: getattr(r, f) for f in SPEC_FIELDS} if r is not None and r.is_override else d
+            specs.append(EffectiveSpec(r.id if r is not None else None, d["key"], d["id"], fields))
+        for r in mine.values():
+            specs.append(EffectiveSpec(r.id, r.key, r.template_deliverable_id, {f: getattr(r, f) for f in SPEC_FIELDS}))
+        specs.sort(key=lambda e: e.order_index or 0)
+        out[s.id] = specs
+    return out
+
+def project_specs(db: Session, project: Project, stages: List[Stage]) -> Dict[int, List[EffectiveSpec]]:
+    """Entregables efectivos por stage_id: los de la plantilla + las filas propias del proyecto
+    (anclas con contador/archivos, overrides y entregables agregados sólo a este proyecto)."""
+    tree = template_tree(db, project.template_id) if project.template_id else {"stages": []}
+    rows = db.execute(_spec_rows_stmt([s.id for s in stages])).scalars().all() if stages else []
+    return _merge_specs(tree, stages, rows)
+
+def _materialize_spec(db: Session, stage: Stage, spec: EffectiveSpec) -> DeliverableSpec:
+    """Crea la fila ancla del entregable en el proyecto si aún no existe (idempotente y segura en concurrencia)."""
+    if spec.id is None:
+        db.execute(
+            dialect_insert(DeliverableSpec).values(
+                stage_id=stage.id, key=spec.key, template_deliverable_id=spec.template_deliverable_id,
+                is_override=False, **{f: getattr(spec, f) for f in SPEC_FIELDS},
+            ).on_conflict_do_nothing(index_elements=["stage_id", "key"])
+        )
+        db.commit()  # transacción corta: no retener la llave única durante la subida
+    row = db.query(DeliverableSpec).filter(
+        DeliverableSpec.stage_id == stage.id, DeliverableSpec.key == spec.key
+    ).one()
+    spec.id = row.id
+    return row
+
+def _template_for_new_project(db: Session, ptype: str) -> Tuple[Optional[int], List[Tuple[str, str, int]]]:
+    """Plantilla vigente del tipo y sus etapas (code, name, order); sin plantillas registradas, STAGE_TEMPLATES."""
+    template_id = db.query(ChecklistTemplate.id).filter(ChecklistTemplate.kind == ptype)\
+        .order_by(ChecklistTemplate.version.desc()).limit(1).scalar()
+    if template_id is not None:
+        return template_id, [(st["code"], st["name"], st["order_index"]) for st in template_tree(db, template_id)["stages"]]
+    return None, [(code, name, idx) for idx, (code, name) in enumerate(STAGE_TEMPLATES.get(ptype, []), start=1)]
+
+def _active_version_stmt(deliverable_id: int):
+    # versión vigente de un entregable de archivo único
+    return select(FileRecord).where(FileRecord.deliverable_id == deliverable_id, FileRecord.is_active == True)\
+        .order_by(FileRecord.version.desc()).limit(1)
+
+def _membership_stmt(project_id: int, user_id: int):
+    return select(ProjectMember).where(ProjectMember.project_id == project_id, ProjectMember.user_id == user_id)
+
+def _stages_stmt(project_id: int):
+    return select(Stage).where(Stage.project_id == project_id).order_by(Stage.order_index)
+
+def _snapshot_files_stmt(project_id: int):
+    return select(FileRecord).where(
+        FileRecord.project_id == project_id, FileRecord.deliverable_id.isnot(None)
+    ).order_by(FileRecord.uploaded_at.desc(), FileRecord.id.desc())
+
+def _snapshot_pending_stmt(project_id: int):
+    return select(FileDeleteRequest.file_id)\
+        .join(FileRecord, FileRecord.id == FileDeleteRequest.file_id)\
+        .where(FileRecord.project_id == project_id, FileDeleteRequest.status == "pending")
 
 def _expediente_snapshot(project_id: int, db: Session) -> dict:
-    proj = db.query(Project).get(project_id)
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
 
-    stages = db.query(Stage).filter(Stage.project_id == project_id).order_by(Stage.order_index).all()
+    stages = db.execute(_stages_stmt(project_id)).scalars().all()
+    # archivos y solicitudes pendientes del proyecto en dos consultas (no una por entregable/archivo)
+    return _build_snapshot(
+        proj, stages, project_specs(db, proj, stages),
+        db.execute(_snapshot_files_stmt(project_id)).scalars().all(),
+        set(db.execute(_snapshot_pending_stmt(project_id)).scalars()),
+    )
+
+def _build_snapshot(proj: Project, stages: List[Stage], specs_by_stage: Dict[int, List[EffectiveSpec]],
+                    files: List[FileRecord], pending: set) -> dict:
+    files_by_spec: Dict[int, List[FileRecord]] = {}
+    for f in files:
+        files_by_spec.setdefault(f.deliverable_id, []).append(f)
+
     out_stages = []
     total_req = 0
     done_req = 0
 
     for st in stages:
-        specs = db.query(DeliverableSpec).filter(DeliverableSpec.stage_id == st.id).order_by(DeliverableSpec.order_index).all()
         items = []
         stage_req = 0
         stage_done = 0
 
-        for spec in specs:
-            files = db.query(FileRecord).filter(FileRecord.deliverable_id == spec.id).order_by(FileRecord.uploaded_at.desc()).all()
+        for spec in specs_by_stage[st.id]:
+            files = files_by_spec.get(spec.id, []) if spec.id is not None else []
 
             # estado de cumplimiento
             if spec.multi:
@@ -482,12 +2424,6 @@ def _expediente_snapshot(project_id: int, db: Session) -> dict:
 
             out_files = []
             for f in files:
-                has_req = (
-                    db.query(FileDeleteRequest)
-                    .filter_by(file_id=f.id, status="pending")
-                    .first()
-                    is not None
-                )
                 out_files.append(
                     {
                         "id": f.id,
@@ -499,7 +2435,7 @@ def _expediente_snapshot(project_id: int, db: Session) -> dict:
                         "version": f.version,
                         "is_active": f.is_active,
                         "reason": f.reason,
-                        "pending_delete": has_req,
+                        "pending_delete": f.id in pending,
                     }
                 )
 
@@ -532,8 +2468,131 @@ def _expediente_snapshot(project_id: int, db: Session) -> dict:
             "required_total": total_req, "required_done": done_req,
             "progress_percent": global_pct, "stages": out_stages}
 
+# ---- Wire del seeder (import tardío: usa modelos y helpers de plantillas ya definidos) ----
+_ensure_templates = None
+try:
+    from seed_deliverables import ensure_templates as _ensure_templates
+    print("Seeder wired: True")
+except Exception as e:
+    _ensure_templates = None
+    print("WARN: seed_deliverables no disponible:", e)
+
+
+# ----------------- Perfilado bajo demanda (admin) -----------------
+# Sólo la petición marcada corre bajo cProfile, en el hilo donde se ejecuta el endpoint (threadpool
+# o pool acotado); el resto no paga nada. Los endpoints async se perfilan en el event loop y pueden
+# incluir trabajo de otras tareas concurrentes. Las dependencias (auth, sesión) no se perfilan.
+_PROFILE: contextvars.ContextVar[Optional[List[cProfile.Profile]]] = contextvars.ContextVar("profile", default=None)
+PROFILES: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+_profile_ids = itertools.count(1)
+
+def _run_profiled(fn, *args, **kwargs):
+    session = _PROFILE.get()
+    if session is None:
+        return fn(*args, **kwargs)
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        prof.disable()
+        session.append(prof)
+
+def _profiled_endpoint(fn):
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            session = _PROFILE.get()
+            if session is None:
+                return await fn(*args, **kwargs)
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                prof.disable()
+                session.append(prof)
+        return wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return _run_profiled(fn, *args, **kwargs)
+    return wrapper
+
+def _profile_requested(request: Request) -> bool:
+    return PROFILE_ENABLE and (request.headers.get("x-profile") == "1" or request.query_params.get("__profile") == "1")
+
+def _profile_admin(request: Request) -> Optional[str]:
+    auth = request.headers.get("authorization") or ""
+    token = auth.split(" ", 1)[1].strip() if auth.lower().startswith("bearer ") else None
+    with SessionLocal() as db:
+        user = _decode_user(db, token)
+        return user.username if user and user.role == "admin" else None
+
+def _store_profile(request: Request, username: str, profiles: List[cProfile.Profile], elapsed_s: float,
+                   status_code: Optional[int]) -> Optional[int]:
+    if not profiles:
+        return None
+    stats = pstats.Stats(profiles[0])
+    for prof in profiles[1:]:
+        stats.add(prof)
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+    sql = _REQUEST_STATS.get() or {}
+    entry = {
+        "id": next(_profile_ids),
+        "at": datetime.utcnow().isoformat(),
+        "method": request.method,
+        "path": request.url.path,
+        "route": _route_template(request.scope),
+        "user": username,
+        "status": status_code,
+        "elapsed_ms": round(1000 * elapsed_s, 2),
+        "sql_count": sql.get("sql_count"),
+        "sql_ms": round(1000 * sql["sql_s"], 2) if "sql_s" in sql else None,
+        "text": out.getvalue(),
+        "pstats": marshal.dumps(stats.stats),  # mismo formato que Stats.dump_stats (snakeviz, flameprof)
+    }
+    PROFILES.append(entry)
+    return entry["id"]
+
+class ProfilingRoute(APIRoute):
+    """APIRoute que perfila la petición cuando un admin lo pide; sin la marca no añade trabajo."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not getattr(endpoint, "__offloaded__", False):
+            endpoint = _profiled_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request):
+            if not _profile_requested(request):
+                return await handler(request)
+            username = await run_in_threadpool(_profile_admin, request)
+            if username is None:
+                return await handler(request)  # no admin: se ignora la marca
+            session: List[cProfile.Profile] = []
+            token = _PROFILE.set(session)
+            t0 = time.perf_counter()
+            response = None
+            try:
+                response = await handler(request)
+            finally:
+                _PROFILE.reset(token)
+                profile_id = _store_profile(request, username, session, time.perf_counter() - t0,
+                                            response.status_code if response is not None else None)
+            if profile_id is not None:
+                response.headers["X-Profile-Id"] = str(profile_id)
+            return response
+
+        return profiled_handler
+
 # ----------------- App -----------------
 app = FastAPI(title="Files Platform API", version="0.4.0")
+app.router.route_class = ProfilingRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -544,13 +2603,233 @@ app.add_middleware(
         "Authorization", "Content-Type", "Accept", "Origin", "User-Agent",
         "DNT", "Cache-Control", "X-Requested-With"
     ],
-    expose_headers=["Content-Disposition"],
+    expose_headers=["Content-Disposition", "X-Next-Cursor", "Server-Timing", "X-Profile-Id"],
 )
 
+_ROUTE_PATHS: Dict[object, str] = {}
+
+def _route_template(scope) -> str:
+    # etiqueta por plantilla de ruta (/projects/{project_id}/files), no por URL: cardinalidad acotada
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "<unmatched>"
+    if not _ROUTE_PATHS:
+        _ROUTE_PATHS.update({getattr(r, "endpoint", None): r.path for r in app.routes})
+    return _ROUTE_PATHS.get(endpoint, "<unmatched>")
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (sin BaseHTTPMiddleware): conserva el contexto hacia los endpoints.
+
+    Cuenta las consultas de cada petición (métricas, Server-Timing, presupuesto y N+1).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status_code = 500
+        stats = _new_request_stats(scope)
+        token = _REQUEST_STATS.set(stats)
+        replaced = False
+
+        async def send_wrapper(message):
+            nonlocal status_code, replaced
+            if replaced:
+                return  # cuerpo de la respuesta sustituida por el 500 de presupuesto
+            if message["type"] == "http.response.start":
+                overrun = _budget_overrun(stats) if QUERY_BUDGET_ENFORCE else None
+                if overrun:
+                    # el endpoint ya terminó (y su sesión hizo commit/rollback): sólo cambia la respuesta
+                    replaced = True
+                    message = {"type": "http.response.start", "status": 500, "headers": [
+                        (b"content-type", b"application/json")]}
+                    body = json.dumps({"detail": overrun}, ensure_ascii=False).encode("utf-8")
+                    message["headers"].append((b"content-length", str(len(body)).encode()))
+                    status_code = 500
+                    await send(message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                status_code = message["status"]
+                if SERVER_TIMING_ENABLE:
+                    timing = _server_timing(stats, time.perf_counter() - t0).encode("latin-1")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing)]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method=method)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            HTTP_IN_FLIGHT.dec(method=method)
+            _REQUEST_STATS.reset(token)
+            route = _route_template(scope)
+            if METRICS_ENABLE:
+                HTTP_REQUESTS.inc(method=method, route=route, status=str(status_code))
+                HTTP_LATENCY.observe(elapsed, method=method, route=route)
+                if stats["sql_count"]:
+                    DB_QUERIES.inc(stats["sql_count"], route=route)
+                    DB_QUERY_SECONDS.inc(stats["sql_s"], route=route)
+            _check_request_queries(stats, route)
+
+# ----------------- Compresión y JSON rápido -----------------
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+_COMPRESS_OFFLOAD_BYTES = 256 * 1024  # cuerpos mayores se comprimen fuera del event loop
+
+def _negotiate_encoding(accept: str) -> Optional[str]:
+    prefs: Dict[str, float] = {}
+    for part in accept.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        prefs[name.strip().lower()] = q
+    for enc in (("br",) if brotli is not None else ()) + ("gzip",):
+        if prefs.get(enc, prefs.get("*", 0.0)) > 0:
+            return enc
+    return None
+
+def _compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    c = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    return c.compress(data) + c.flush()
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        self.br = encoding == "br"
+        self._c = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY) if self.br else \
+            zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data) if self.br else self._c.compress(data)
+
+    def finish(self) -> bytes:
+        return self._c.finish() if self.br else self._c.flush()
+
+def _should_compress(start: dict, headers: MutableHeaders) -> bool:
+    if start["status"] in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    if "content-disposition" in headers:
+        return False  # descargas (FileResponse/ZIP): ya comprimidas o binarias, y deben admitir Range
+    ctype = headers.get("content-type", "").lower()
+    return any(ctype.startswith(t) for t in _COMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    """gzip/brotli negociado por Accept-Encoding para JSON y texto desde COMPRESS_MIN_BYTES."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), "")
+        encoding = _negotiate_encoding(accept) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start: Optional[dict] = None
+        stream: Optional[_StreamCompressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, stream, passthrough
+            if message["type"] == "http.response.start":
+                start = message  # se decide con el primer bloque del cuerpo
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if stream is not None:
+                data = stream.compress(body) + (b"" if more else stream.finish())
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            if not _should_compress(start, headers) or (not more and len(body) < COMPRESS_MIN_BYTES):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more:
+                del headers["Content-Length"]
+                stream = _StreamCompressor(encoding)
+                await send(start)
+                await send({"type": "http.response.body", "body": stream.compress(body), "more_body": True})
+                return
+            if len(body) > _COMPRESS_OFFLOAD_BYTES:
+                data = await anyio.to_thread.run_sync(_compress, encoding, body)
+            else:
+                data = _compress(encoding, body)
+            headers["Content-Length"] = str(len(data))
+            await send(start)
+            await send({"type": "http.response.body", "body": data})
+
+        await self.app(scope, receive, send_wrapper)
+
+def _json_default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(o).__name__}")
+
+class FastJSONResponse(JSONResponse):
+    """JSON para respuestas grandes: las rutas la devuelven ya armada y FastAPI se salta jsonable_encoder.
+
+    Usa orjson si está instalado (datetime sale igual que isoformat()); si no, json estándar.
+    """
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                          default=_json_default).encode("utf-8")
+
+if COMPRESS_ENABLE:
+    app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+def _sync_checklist_templates():
+    # registra una versión nueva de plantilla si cambió el SEED y fija la vigente en proyectos sin plantilla;
+    # con varios workers sólo uno trabaja y los demás esperan el lock y no encuentran nada pendiente
+    if _ensure_templates is None:
+        return
+    with lock_engine.connect() as lock_conn:
+        if IS_POSTGRES:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _advisory_key("checklist-templates")})
+        try:
+            with SessionLocal() as db:
+                _ensure_templates(db)
+        except Exception as e:
+            print("WARN plantillas de checklist:", e)
+        finally:
+            if IS_POSTGRES:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _advisory_key("checklist-templates")})
+
 @app.on_event("startup")
 def on_startup():
+    # corre en el event loop: ajusta el threadpool por defecto (rutas interactivas)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = POOL_INTERACTIVE_THREADS
     create_db()
-    safe_migrate()
+    run_migrations()
+    _sync_checklist_templates()
+    if CONTENT_INDEX_ENABLE:
+        CONTENT_INDEXER.start()
+    PROJECT_REAPER.start()
+    SLOW_QUERY_LOG.start()
+    if SCRUB_ENABLE:
+        INTEGRITY_SCRUBBER.start()
 
 # -------- Auth --------
 @app.post("/auth/register")
@@ -643,14 +2922,22 @@ def request_register(
 
 @app.get("/admin/registrations")
 def list_registrations(
+    response: Response,
     status_filter: Optional[str] = Query(None, pattern="^(pending|approved|rejected)$"),
-    db: Session = Depends(get_db),
+    limit: int = Query(200, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: Session = Depends(get_read_db),
     current: User = Depends(require_admin)
 ):
     q = db.query(RegistrationRequest)
     if status_filter:
         q = q.filter(RegistrationRequest.status == status_filter)
-    rows = q.order_by(desc(RegistrationRequest.created_at)).limit(200).all()
+    rows, next_cursor = _keyset_page(
+        q, [RegistrationRequest.created_at, RegistrationRequest.id], (datetime, int), cursor, limit,
+        lambda r: (r.created_at, r.id),
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [
         {
             "id": r.id,
@@ -742,68 +3029,54 @@ def create_project(
     prefix = "EE" if type == "externo" else "EI"
     final_code = f"{prefix}{code.strip()} {current.initials.upper()}"
     validate_project_code(final_code, type)
-    if db.query(Project).filter(Project.code == final_code).first():
+    existing = db.query(Project).filter(Project.code == final_code).first()
+    if existing:
+        if existing.deleted_at is not None:
+            raise HTTPException(409, "Un proyecto con ese código se está eliminando; intenta más tarde")
         raise HTTPException(400, "Código de proyecto ya existe")
-    p = Project(code=final_code, name=name, type=type, created_by=current.id)
+    # proyecto, membresía del dueño y etapas en una sola transacción
+    template_id, stage_rows = _template_for_new_project(db, type)
+    p = Project(code=final_code, name=name, type=type, created_by=current.id, template_id=template_id)
     db.add(p)
-    db.commit()
-    db.refresh(p)
-
-    db.add(ProjectMember(project_id=p.id, user_id=current.id, role="manager"))
-    db.commit()
-
-    (FILES_ROOT / "projects" / p.code / "Información técnica").mkdir(parents=True, exist_ok=True)
-    (FILES_ROOT / "projects" / p.code / "Expediente IMT").mkdir(parents=True, exist_ok=True)
-
-# --- AUTO-SIEMBRA: etapas + (si hay script) entregables ---
-# --- AUTO-SIEMBRA: etapas + entregables (si hay script) ---
     try:
-        # ¿ya hay deliverables? (idempotencia)
-        has_delivs = db.query(DeliverableSpec)\
-            .join(Stage, DeliverableSpec.stage_id == Stage.id)\
-            .filter(Stage.project_id == p.id).count() > 0
-
-        if not has_delivs:
-            if _seed_project is not None:
-                _seed_project(db, p)   # siembra etapas + checklist
-            else:
-                # fallback: intenta importar directo (evita importlib.util)
-                try:
-                    import seed_deliverables as _sd
-                    _sd.seed_project(db, p)
-                except Exception as e:
-                    print("WARN auto-seed (fallback):", e)
-
-        # Si por lo que sea sigue sin checklist, al menos siembra etapas
-        post_delivs = db.query(DeliverableSpec)\
-            .join(Stage, DeliverableSpec.stage_id == Stage.id)\
-            .filter(Stage.project_id == p.id).count() > 0
-        if not post_delivs:
-            seed_stages_for_project(db, p)
+        db.flush()  # id del proyecto para las filas dependientes
+        db.add(ProjectMember(project_id=p.id, user_id=current.id, role="manager"))
+        if stage_rows:
+            db.execute(insert(Stage).values([
+                {"project_id": p.id, "code": c, "name": n, "order_index": o} for c, n, o in stage_rows
+            ]))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(400, "Código de proyecto ya existe")
 
-    except Exception as e:
-        print("WARN auto-seed:", e)
+    # carpetas después del commit: si falla, las rutas se vuelven a crear al subir archivos
+    try:
+        (FILES_ROOT / "projects" / p.code / "Información técnica").mkdir(parents=True, exist_ok=True)
+        (FILES_ROOT / "projects" / p.code / "Expediente IMT").mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        print("WARN carpetas del proyecto:", e)
 
     return {"id": p.id, "code": p.code, "name": p.name, "type": p.type}
 
 
 @app.get("/projects")
-def list_projects(db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    if is_admin(current) or is_auditor(current):
-        rows = (
-            db.query(Project, ProjectMember.role)
-            .outerjoin(ProjectMember, (ProjectMember.project_id == Project.id) & (ProjectMember.user_id == current.id))
-            .order_by(Project.created_at.desc())
-            .all()
-        )
-    else:
-        rows = (
-            db.query(Project, ProjectMember.role)
-            .outerjoin(ProjectMember, (ProjectMember.project_id == Project.id) & (ProjectMember.user_id == current.id))
-            .filter(or_(ProjectMember.user_id == current.id, Project.created_by == current.id))
-            .order_by(Project.created_at.desc())
-            .all()
-        )
+@query_budget(4)
+def list_projects(db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    return _project_items(db.execute(_projects_stmt(current)).all(), current)
+
+def _projects_stmt(current: User):
+    stmt = (
+        select(Project, ProjectMember.role)
+        .outerjoin(ProjectMember, (ProjectMember.project_id == Project.id) & (ProjectMember.user_id == current.id))
+        .where(Project.deleted_at.is_(None))
+        .order_by(Project.created_at.desc())
+    )
+    if not (is_admin(current) or is_auditor(current)):
+        stmt = stmt.where(or_(ProjectMember.user_id == current.id, Project.created_by == current.id))
+    return stmt
+
+def _project_items(rows, current: User) -> List[dict]:
     out = []
     for p, role in rows:
         is_owner = p.created_by == current.id
@@ -827,58 +3100,318 @@ def update_project(
     return {"ok": True, "project": {"id": proj.id, "code": proj.code, "name": proj.name, "type": proj.type}}
 
 
-@app.delete("/projects/{project_id}")
+@app.delete("/projects/{project_id}", status_code=202)
 def delete_project(
     project_id: int,
     db: Session = Depends(get_db),
     current: User = Depends(require_admin),
 ):
-    delete_project_by_id(db, project_id)
-    return {"ok": True}
+    job = delete_project_by_id(db, project_id, requested_by=current.id)
+    return {"ok": True, "purge_id": job.id, "status": job.status}
 
 
-@app.post("/projects/{project_id}/request-delete")
-def request_project_delete(
-    project_id: int,
-    reason: str = Form(...),
-    db: Session = Depends(get_db),
-    current: User = Depends(get_current_user),
-):
-    if is_admin(current):
-        raise HTTPException(400, "Admins pueden eliminar directamente el proyecto")
-
-    ensure_member(db, current, project_id, "uploader")
-    clean_reason = (reason or "").strip()
-    if not clean_reason:
-        raise HTTPException(400, "Motivo requerido")
+def _purge_out(job: ProjectPurge) -> dict:
+    pct = None
+    if job.status == "done":
+        pct = 100.0
+    elif job.bytes_total:
+        pct = round(100 * job.bytes_deleted / job.bytes_total, 1)
+    return {
+        "id": job.id,
+        "project_id": job.project_id,
+        "code": job.code,
+        "status": job.status,
+        "files_total": job.files_total,
+        "files_deleted": job.files_deleted,
+        "bytes_total": job.bytes_total,
+        "bytes_deleted": job.bytes_deleted,
+        "progress_percent": pct,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
 
-    exists = db.query(ProjectDeleteRequest).filter(
-        ProjectDeleteRequest.project_id == project_id,
-        ProjectDeleteRequest.status == "pending",
-    ).first()
-    if exists:
-        raise HTTPException(400, "Ya existe una solicitud pendiente para este proyecto")
 
-    req = ProjectDeleteRequest(project_id=project_id, requested_by=current.id, reason=clean_reason, status="pending")
-    db.add(req)
+@app.post("/admin/storage/reconcile", status_code=202)
+def start_storage_reconcile(
+    full: bool = Query(False, description="Revisa todas las carpetas, no sólo las modificadas"),
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    rep = StorageReport(mode="full" if full else "incremental", status="running")
+    db.add(rep)
     db.commit()
-    return {"ok": True, "request_id": req.id}
+    threading.Thread(target=run_reconcile_report, args=(rep.id, full), name="storage-reconcile", daemon=True).start()
+    return {"ok": True, "report_id": rep.id}
 
 
-@app.get("/project-delete-requests")
-def list_project_delete_requests(
+@app.get("/admin/storage/reconcile")
+def list_storage_reports(
+    limit: int = Query(10, ge=1, le=100),
     db: Session = Depends(get_db),
     current: User = Depends(require_admin),
 ):
-    rows = (
-        db.query(ProjectDeleteRequest, Project, User)
-        .join(Project, Project.id == ProjectDeleteRequest.project_id)
-        .join(User, User.id == ProjectDeleteRequest.requested_by)
-        .filter(ProjectDeleteRequest.status == "pending")
-        .order_by(ProjectDeleteRequest.requested_at.desc())
-        .all()
-    )
+    rows = db.query(StorageReport).order_by(StorageReport.id.desc()).limit(limit).all()
     return {
+        "items": [
+            {
+                "id": r.id,
+                "mode": r.mode,
+                "status": r.status,
+                "error": r.error,
+                "started_at": r.started_at,
+                "finished_at": r.finished_at,
+                "summary": json.loads(r.summary) if r.summary else None,
+            }
+            for r in rows
+        ]
+    }
+
+
+@app.get("/admin/integrity")
+def integrity_report(
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    counts = dict(
+        db.query(func.coalesce(FileRecord.verify_status, "never"), func.count(FileRecord.id))
+        .group_by(func.coalesce(FileRecord.verify_status, "never"))
+        .all()
+    )
+    oldest = db.query(func.min(FileRecord.verified_at)).scalar()
+    qset = (
+        db.query(FileRecord, Project)
+        .join(Project, Project.id == FileRecord.project_id)
+        .filter(FileRecord.verify_status.in_(("mismatch", "missing")))
+    )
+    rows, next_cursor = _keyset_page(qset, [FileRecord.id], (int,), cursor, limit, lambda row: (row[0].id,))
+    return {
+        "summary": {
+            "never_verified": counts.get("never", 0),
+            "ok": counts.get("ok", 0),
+            "mismatch": counts.get("mismatch", 0),
+            "missing": counts.get("missing", 0),
+            "oldest_verified_at": oldest,
+        },
+        "items": [
+            {
+                "file_id": f.id,
+                "filename": f.filename,
+                "path": f.path,
+                "sha256": f.sha256,
+                "status": f.verify_status,
+                "verified_at": f.verified_at,
+                "project": {"id": p.id, "code": p.code},
+            }
+            for f, p in rows
+        ],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.get("/admin/db-pool")
+def db_pool_stats(current: User = Depends(require_admin)):
+    out = {"mode": DB_POOL_MODE, "pre_ping": DB_POOL_PRE_PING, "recycle_s": DB_POOL_RECYCLE,
+           "pools": {"primary": pool_stats_of(engine)}}
+    if async_engine is not None:
+        out["pools"]["async"] = pool_stats_of(async_engine.sync_engine)
+    return out
+
+
+def _is_admin_token(token: str) -> bool:
+    with SessionLocal() as db:
+        user = _decode_user(db, token)
+        return user is not None and user.role == "admin"
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    # rutas, usuarios y tamaños de pool no son públicos: Bearer METRICS_TOKEN o JWT de admin
+    auth = request.headers.get("authorization") or ""
+    token = auth[7:] if auth.startswith("Bearer ") else ""
+    scraper = bool(METRICS_TOKEN) and hmac.compare_digest(token, METRICS_TOKEN)
+    if not scraper and not (token and await anyio.to_thread.run_sync(_is_admin_token, token)):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/admin/profiles")
+def list_profiles(current: User = Depends(require_admin)):
+    return {"capacity": PROFILES.maxlen, "items": [
+        {k: v for k, v in e.items() if k not in ("text", "pstats")} for e in reversed(PROFILES)
+    ]}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(
+    profile_id: int,
+    format: str = Query("text", pattern="^(text|pstats)$"),
+    current: User = Depends(require_admin),
+):
+    entry = next((e for e in PROFILES if e["id"] == profile_id), None)
+    if entry is None:
+        raise HTTPException(404, "Perfil no existe (o ya salió del buffer)")
+    if format == "pstats":
+        return Response(entry["pstats"], media_type="application/octet-stream", headers={
+            "Content-Disposition": f"attachment; filename=profile_{profile_id}.pstats"})
+    return Response(entry["text"], media_type="text/plain; charset=utf-8")
+
+
+@app.get("/admin/slow-queries")
+def list_slow_queries(
+    route: Optional[str] = Query(None, description="Plantilla de ruta, p. ej. /projects/{project_id}/files"),
+    min_ms: Optional[float] = Query(None, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    qset = db.query(SlowQuery)
+    if route:
+        qset = qset.filter(SlowQuery.route == route)
+    if min_ms is not None:
+        qset = qset.filter(SlowQuery.duration_ms >= min_ms)
+    rows, next_cursor = _keyset_page(qset, [SlowQuery.id], (int,), cursor, limit, lambda r: (r.id,))
+    return {"threshold_ms": SLOW_QUERY_MS, "dropped": SLOW_QUERY_LOG.dropped, "next_cursor": next_cursor, "items": [{
+        "id": r.id, "at": r.at.isoformat() if r.at else None, "duration_ms": r.duration_ms, "route": r.route,
+        "user": r.username, "statement": r.statement, "has_plan": r.plan is not None,
+    } for r in rows]}
+
+
+@app.get("/admin/slow-queries/top")
+def top_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    # sentencias más costosas en la ventana guardada (tiempo total)
+    total = func.sum(SlowQuery.duration_ms)
+    rows = (
+        db.query(SlowQuery.route, SlowQuery.statement, func.count(SlowQuery.id), total,
+                 func.max(SlowQuery.duration_ms), func.max(SlowQuery.at))
+        .group_by(SlowQuery.route, SlowQuery.statement)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    return [{"route": route, "statement": stmt, "count": n, "total_ms": round(tot, 1),
+             "avg_ms": round(tot / n, 1), "max_ms": round(mx, 1), "last_at": last.isoformat() if last else None}
+            for route, stmt, n, tot, mx, last in rows]
+
+
+def _json_or_text(raw: Optional[str]):
+    # los parámetros se guardan truncados: pueden no ser JSON válido
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+@app.get("/admin/slow-queries/{query_id}")
+def get_slow_query(query_id: int, db: Session = Depends(get_db), current: User = Depends(require_admin)):
+    r = db.get(SlowQuery, query_id)
+    if not r:
+        raise HTTPException(404, "Registro no existe")
+    return {"id": r.id, "at": r.at.isoformat() if r.at else None, "duration_ms": r.duration_ms, "route": r.route,
+            "user": r.username, "statement": r.statement,
+            "params": _json_or_text(r.params),
+            "plan": json.loads(r.plan) if r.plan else None}
+
+
+@app.get("/admin/pools")
+async def pool_stats(current: User = Depends(require_admin)):
+    return {"pools": [interactive_pool_stats(), FILE_IO_POOL.stats(), CPU_POOL.stats()]}
+
+
+@app.post("/admin/integrity/{file_id}/verify")
+@offload(FILE_IO_POOL)
+def verify_file_now(
+    file_id: int,
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    rec = db.get(FileRecord, file_id)
+    if not rec:
+        raise HTTPException(404, "Archivo no encontrado")
+    path, sha256 = rec.path, rec.sha256
+    db.close()  # libera la conexión antes de leer el archivo
+    result, verified_at = verify_file_record(file_id, path, sha256)
+    return {"ok": result == "ok", "status": result, "verified_at": verified_at}
+
+
+@app.get("/project-purges")
+def list_project_purges(
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    rows = db.query(ProjectPurge).order_by(ProjectPurge.id.desc()).limit(limit).all()
+    return {"items": [_purge_out(j) for j in rows]}
+
+
+@app.get("/project-purges/{purge_id}")
+def get_project_purge(
+    purge_id: int,
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    job = db.get(ProjectPurge, purge_id)
+    if not job:
+        raise HTTPException(404, "Eliminación no encontrada")
+    return _purge_out(job)
+
+
+@app.post("/projects/{project_id}/request-delete")
+def request_project_delete(
+    project_id: int,
+    reason: str = Form(...),
+    db: Session = Depends(get_db),
+    current: User = Depends(get_current_user),
+):
+    if is_admin(current):
+        raise HTTPException(400, "Admins pueden eliminar directamente el proyecto")
+
+    ensure_member(db, current, project_id, "uploader")
+    clean_reason = (reason or "").strip()
+    if not clean_reason:
+        raise HTTPException(400, "Motivo requerido")
+
+    exists = db.query(ProjectDeleteRequest).filter(
+        ProjectDeleteRequest.project_id == project_id,
+        ProjectDeleteRequest.status == "pending",
+    ).first()
+    if exists:
+        raise HTTPException(400, "Ya existe una solicitud pendiente para este proyecto")
+
+    req = ProjectDeleteRequest(project_id=project_id, requested_by=current.id, reason=clean_reason, status="pending")
+    db.add(req)
+    db.commit()
+    return {"ok": True, "request_id": req.id}
+
+
+@app.get("/project-delete-requests")
+def list_project_delete_requests(
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+    current: User = Depends(require_admin),
+):
+    qset = (
+        db.query(ProjectDeleteRequest, Project, User)
+        .join(Project, Project.id == ProjectDeleteRequest.project_id)
+        .join(User, User.id == ProjectDeleteRequest.requested_by)
+        .filter(ProjectDeleteRequest.status == "pending", Project.deleted_at.is_(None))
+    )
+    rows, next_cursor = _keyset_page(
+        qset, [ProjectDeleteRequest.requested_at, ProjectDeleteRequest.id], (datetime, int), cursor, limit,
+        lambda row: (row[0].requested_at, row[0].id),
+    )
+    return {
+        "next_cursor": next_cursor,
         "items": [
             {
                 "id": r.id,
@@ -903,13 +3436,15 @@ def approve_project_delete_request(
     if not req or req.status != "pending":
         raise HTTPException(404, "Solicitud no encontrada")
 
+    # aprobación, tombstone y trabajo de purga en una sola transacción (el helper hace el commit):
+    # si el proyecto ya no existe, el 404 deja la solicitud pendiente y sin cambios
     req.status = "approved"
     req.decided_at = func.now()
     req.decided_by = current.id
-    db.commit()
+    db.flush()
 
-    delete_project_by_id(db, req.project_id)
-    return {"ok": True}
+    job = delete_project_by_id(db, req.project_id, requested_by=current.id)
+    return {"ok": True, "purge_id": job.id, "status": job.status}
 
 
 @app.post("/project-delete-requests/{req_id}/reject")
@@ -938,7 +3473,7 @@ def add_stage(
     db: Session = Depends(get_db),
     current: User = Depends(require_admin)
 ):
-    proj = db.get(Project, project_id)
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
     st = Stage(project_id=project_id, code=code, name=name, order_index=order_index)
@@ -946,8 +3481,9 @@ def add_stage(
     return {"id": st.id, "code": st.code, "name": st.name, "order": st.order_index}
 
 @app.get("/projects/{project_id}/stages")
-def list_stages(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    proj = db.get(Project, project_id)
+@query_budget(4)
+def list_stages(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
     ensure_member(db, current, project_id, "viewer")
@@ -955,15 +3491,25 @@ def list_stages(project_id: int, db: Session = Depends(get_db), current: User =
     return [{"id": s.id, "code": s.code, "name": s.name, "order": s.order_index} for s in rows]
 
 @app.get("/projects/{project_id}/progress")
-def project_progress(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    proj = db.get(Project, project_id)
+@query_budget(6)
+def project_progress(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
     ensure_member(db, current, project_id, "viewer")
-    stages = db.query(Stage).filter(Stage.project_id == project_id).order_by(Stage.order_index).all()
+    stages = db.execute(_stages_stmt(project_id)).scalars().all()
+    return _build_progress(proj, stages, dict(db.execute(_stage_file_counts_stmt(project_id)).all()))
+
+def _stage_file_counts_stmt(project_id: int):
+    # archivos por etapa en una sola consulta agrupada
+    return select(FileRecord.stage_id, func.count(FileRecord.id))\
+        .where(FileRecord.project_id == project_id, FileRecord.stage_id.isnot(None))\
+        .group_by(FileRecord.stage_id)
+
+def _build_progress(proj: Project, stages: List[Stage], counts: Dict[int, int]) -> dict:
     rows = []
     for s in stages:
-        count = db.query(FileRecord).filter(FileRecord.project_id == project_id, FileRecord.stage_id == s.id).count()
+        count = counts.get(s.id, 0)
         rows.append({"stage_id": s.id, "stage_code": s.code, "stage_name": s.name, "files": count, "done": count > 0})
     total = len(stages)
     done = sum(1 for r in rows if r["done"])
@@ -971,8 +3517,11 @@ def project_progress(project_id: int, db: Session = Depends(get_db), current: Us
     return {"project": proj.code, "stages": rows, "completed_percent": pct}
 
 @app.get("/projects/{project_id}/progress-expediente")
-def progress_expediente(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    snap = _expediente_snapshot(project_id, db)
+@query_budget(8)
+def progress_expediente(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    return _progress_from_snapshot(_expediente_snapshot(project_id, db))
+
+def _progress_from_snapshot(snap: dict) -> dict:
     return {
         "project": snap["project"],
         "required_total": snap["required_total"],
@@ -1004,7 +3553,8 @@ def add_member(
     return {"ok": True}
 
 @app.get("/projects/{project_id}/members")
-def list_members(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
+@query_budget(4)
+def list_members(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
     require_owner_or_admin(db, project_id, current)
     rows = (
         db.query(ProjectMember, User)
@@ -1028,12 +3578,29 @@ def remove_member(project_id: int, user_id: int = Query(...), db: Session = Depe
     return {"ok": True}
 
 @app.get("/users")
-def list_users(q: Optional[str] = Query(None), db: Session = Depends(get_db), current: User = Depends(get_current_user)):
+def list_users(
+    response: Response,
+    q: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="Valor de X-Next-Cursor de la página anterior"),
+    db: Session = Depends(get_db),
+    current: User = Depends(get_current_user),
+):
     qry = db.query(User)
-    if q:
-        like = f"%{q.strip()}%"
-        qry = qry.filter(User.username.ilike(like))
-    rows = qry.order_by(User.created_at.desc()).limit(50).all()
+    if q and q.strip():
+        match, rank = _name_search(db, _USERNAME_INDEX, q)
+        rows, next_cursor = _keyset_page(
+            qry.add_columns(rank).filter(match), [rank, User.id], (int, int), cursor, limit,
+            lambda row: (int(row[1]), row[0].id),
+        )
+        rows = [u for u, _ in rows]
+    else:
+        rows, next_cursor = _keyset_page(
+            qry, [User.created_at, User.id], (datetime, int), cursor, limit,
+            lambda u: (u.created_at, u.id),
+        )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [
         {
             "id": u.id,
@@ -1130,8 +3697,8 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current: User = Dep
     return {"ok": True}
 
 @app.get("/projects/{project_id}/categories")
-def categories_tree(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    proj = db.get(Project, project_id)
+def categories_tree(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
     ensure_member(db, current, project_id, "viewer")
@@ -1139,12 +3706,16 @@ def categories_tree(project_id: int, db: Session = Depends(get_db), current: Use
         raise HTTPException(403, "Sin acceso a expediente técnico")
     return {"project": proj.code, "type": proj.type, "tree": get_project_schema(proj.type)}
 
-@app.get("/projects/{project_id}/deliverables")
-def list_project_deliverables(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
+@app.get("/projects/{project_id}/deliverables", response_class=FastJSONResponse)
+@query_budget(8)
+def list_project_deliverables(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    proj = get_project(db, project_id)
+    if not proj:
+        raise HTTPException(404, "Proyecto no existe")
     stages = db.query(Stage).filter(Stage.project_id == project_id).order_by(Stage.order_index).all()
+    specs_by_stage = project_specs(db, proj, stages)
     out = []
     for s in stages:
-        dels = db.query(DeliverableSpec).filter(DeliverableSpec.stage_id == s.id).order_by(DeliverableSpec.order_index).all()
         out.append({
             "stage": {"id": s.id, "code": s.code, "name": s.name},
             "deliverables": [{
@@ -1152,13 +3723,69 @@ def list_project_deliverables(project_id: int, db: Session = Depends(get_db), cu
                 "required": d.required, "multi": d.multi,
                 "allowed_ext": d.allowed_ext, "order": d.order_index,
                 "optional_group": d.optional_group
-            } for d in dels]
+            } for d in specs_by_stage[s.id]]
         })
-    return out
+    return FastJSONResponse(out)
 
-@app.get("/projects/{project_id}/expediente")
-def get_expediente(project_id: int, db: Session = Depends(get_db), current: User = Depends(get_current_user)):
-    return _expediente_snapshot(project_id, db)
+@app.put("/projects/{project_id}/stages/{stage_id}/deliverables/{key}")
+def override_deliverable(
+    project_id: int,
+    stage_id: int,
+    key: str,
+    title: Optional[str] = Form(None),
+    required: Optional[bool] = Form(None),
+    multi: Optional[bool] = Form(None),
+    allowed_ext: Optional[str] = Form(None),  # csv: "pdf,docx"
+    order_index: Optional[int] = Form(None),
+    optional_group: Optional[str] = Form(None),
+    reset: bool = Form(False),  # vuelve a seguir la plantilla
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    proj = get_project(db, project_id)
+    if not proj:
+        raise HTTPException(404, "Proyecto no existe")
+    stage = db.get(Stage, stage_id)
+    if not stage or stage.project_id != project_id:
+        raise HTTPException(400, "Etapa inválida para el proyecto")
+    spec = next((s for s in project_specs(db, proj, [stage])[stage.id] if s.key == key), None)
+    if spec is None:
+        raise HTTPException(404, "Entregable no encontrado en la etapa")
+    row = _materialize_spec(db, stage, spec)
+
+    if reset:
+        tpl = template_tree(db, proj.template_id)["by_key"].get((stage.code, key)) if proj.template_id else None
+        if tpl is None:
+            raise HTTPException(400, "El entregable no proviene de una plantilla")
+        for f in SPEC_FIELDS:
+            setattr(row, f, tpl[f])
+        row.template_deliverable_id = tpl["id"]
+        row.is_override = False
+    else:
+        changes = {"title": title, "required": required, "multi": multi, "order_index": order_index,
+                   "optional_group": optional_group}
+        if allowed_ext is not None:
+            exts = sorted({e.strip().lower().lstrip(".") for e in allowed_ext.split(",") if e.strip()})
+            if not exts:
+                raise HTTPException(400, "allowed_ext no puede quedar vacío")
+            changes["allowed_ext"] = ",".join(exts)
+        # el override parte de los valores efectivos actuales
+        for f in SPEC_FIELDS:
+            setattr(row, f, changes[f] if changes.get(f) is not None else getattr(spec, f))
+        row.is_override = True
+    db.commit()
+
+    eff = next(s for s in project_specs(db, proj, [stage])[stage.id] if s.key == key)
+    return {"ok": True, "deliverable": {
+        "id": eff.id, "key": eff.key, "title": eff.title, "required": eff.required, "multi": eff.multi,
+        "allowed_ext": eff.allowed_ext, "order": eff.order_index, "optional_group": eff.optional_group,
+        "is_override": row.is_override,
+    }}
+
+@app.get("/projects/{project_id}/expediente", response_class=FastJSONResponse)
+@query_budget(8)
+def get_expediente(project_id: int, db: Session = Depends(get_read_db), current: User = Depends(get_current_user)):
+    return FastJSONResponse(_expediente_snapshot(project_id, db))
 
 # -------- Descarga & listado de archivos --------
 @app.get("/download/{file_id}")
@@ -1167,6 +3794,19 @@ def download_file(
     request: Request,
     db: Session = Depends(get_db),
 ):
+    current = _decode_user(db, _download_token(request))
+    if not current:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    rec = db.get(FileRecord, file_id)
+    if not rec or not get_project(db, rec.project_id) or not Path(rec.path).exists():
+        raise HTTPException(404, "Archivo no encontrado")
+
+    # permisos mínimos: viewer del proyecto (o admin)
+    ensure_member(db, current, rec.project_id, "viewer")
+    return _download_response(rec, request)
+
+def _download_token(request: Request) -> str:
     # 1) token por Authorization: Bearer ...
     auth = request.headers.get("authorization") or request.headers.get("Authorization")
     token = None
@@ -1177,21 +3817,21 @@ def download_file(
     token = token or request.query_params.get("access_token") or request.query_params.get("token")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-
-    current = _decode_user(db, token)
-    if not current:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    rec = db.get(FileRecord, file_id)
-    if not rec or not Path(rec.path).exists():
-        raise HTTPException(404, "Archivo no encontrado")
-
-    # permisos mínimos: viewer del proyecto (o admin)
-    ensure_member(db, current, rec.project_id, "viewer")
-
+    return token
+
+class MeteredFileResponse(FileResponse):
+    # cuenta los bytes efectivamente enviados (incluye respuestas parciales y descargas cortadas)
+    async def __call__(self, scope, receive, send):
+        async def counting_send(message):
+            if message["type"] == "http.response.body":
+                DOWNLOAD_BYTES.inc(len(message.get("body", b"")), kind="file")
+            await send(message)
+        await super().__call__(scope, receive, counting_send)
+
+def _download_response(rec: FileRecord, request: Request) -> FileResponse:
     inline = request.query_params.get("inline")
     disposition = "inline" if inline else "attachment"
-    return FileResponse(
+    return MeteredFileResponse(
         path=rec.path,
         filename=rec.filename,
         media_type=rec.content_type or "application/octet-stream",
@@ -1215,11 +3855,16 @@ def delete_file(
     except Exception:
         # si falla borrar el archivo, seguimos con el registro para no bloquear
         pass
+    _mark_storage_dirs_dirty(db, [rec.path])
     db.delete(rec)
     db.commit()
     return {"ok": True}
 
 
+def _pending_delete_stmt(file_id: int):
+    return select(FileDeleteRequest.id).where(FileDeleteRequest.file_id == file_id,
+                                              FileDeleteRequest.status == "pending").limit(1)
+
 @app.post("/files/{file_id}/request-delete")
 def request_delete_file(
     file_id: int,
@@ -1231,26 +3876,43 @@ def request_delete_file(
     if not rec:
         raise HTTPException(404, "Archivo no encontrado")
     ensure_member(db, current, rec.project_id, "manager")
-    if db.query(FileDeleteRequest).filter_by(file_id=file_id, status="pending").first():
+    if db.execute(_pending_delete_stmt(file_id)).first():
         raise HTTPException(400, "Ya existe una solicitud pendiente")
     req = FileDeleteRequest(file_id=file_id, requested_by=current.id, reason=reason.strip())
     db.add(req)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # otra solicitud concurrente ganó el índice único parcial
+        db.rollback()
+        raise HTTPException(400, "Ya existe una solicitud pendiente")
     db.refresh(req)
     return {"ok": True, "request_id": req.id}
 
 
+def _delete_queue_stmt():
+    return (
+        select(FileDeleteRequest, FileRecord, Project, User)
+        .outerjoin(FileRecord, FileRecord.id == FileDeleteRequest.file_id)
+        .outerjoin(Project, Project.id == FileRecord.project_id)
+        .outerjoin(User, User.id == FileDeleteRequest.requested_by)
+        .where(FileDeleteRequest.status == "pending")
+    )
+
 @app.get("/file-delete-requests")
+@query_budget(4)
 def list_delete_requests(
-    db: Session = Depends(get_db),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
     current: User = Depends(require_admin),
 ):
-    q = db.query(FileDeleteRequest).filter(FileDeleteRequest.status == "pending").order_by(FileDeleteRequest.requested_at)
+    # la cola se atiende de la más antigua a la más reciente
+    stmt = _keyset_stmt(_delete_queue_stmt(), [FileDeleteRequest.requested_at, FileDeleteRequest.id],
+                        (datetime, int), cursor, limit, descending=False)
+    rows, next_cursor = _keyset_result(db.execute(stmt).all(), limit, lambda row: (row[0].requested_at, row[0].id))
     items = []
-    for r in q.all():
-        f = db.get(FileRecord, r.file_id)
-        proj = db.get(Project, f.project_id) if f else None
-        u = db.get(User, r.requested_by)
+    for r, f, proj, u in rows:
         items.append(
             {
                 "id": r.id,
@@ -1261,7 +3923,70 @@ def list_delete_requests(
                 "requested_at": r.requested_at.isoformat(),
             }
         )
-    return {"items": items}
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _payload_ids(payload: Dict) -> List[int]:
+    try:
+        return sorted({int(i) for i in (payload.get("ids") or [])})
+    except (TypeError, ValueError):
+        raise HTTPException(400, "ids debe ser una lista de enteros")
+
+
+@app.post("/file-delete-requests/bulk")
+def bulk_decide_delete_requests(
+    payload: Dict = Body(...),
+    db: Session = Depends(get_db),
+    current: User = Depends(require_admin),
+):
+    ids = _payload_ids(payload)
+    action = payload.get("action")
+    if not ids or action not in ("approve", "reject"):
+        raise HTTPException(400, "ids y action (approve|reject) requeridos")
+
+    if action == "reject":
+        done = db.execute(
+            update(FileDeleteRequest)
+            .where(FileDeleteRequest.id.in_(ids), FileDeleteRequest.status == "pending")
+            .values(status="rejected", decided_at=func.now(), decided_by=current.id)
+            .returning(FileDeleteRequest.id),
+            execution_options={"synchronize_session": False},
+        ).scalars().all()
+        db.commit()
+        paths = []
+    else:
+        pending = db.execute(
+            select(FileDeleteRequest.id, FileDeleteRequest.file_id)
+            .where(FileDeleteRequest.id.in_(ids), FileDeleteRequest.status == "pending")
+            .with_for_update()
+        ).all()
+        done = [rid for rid, _ in pending]
+        file_ids = [fid for _, fid in pending]
+        paths = []
+        if file_ids:
+            opts = {"synchronize_session": False}
+            # igual que approve_delete_request: las solicitudes se eliminan junto con el archivo
+            db.execute(delete(FileDeleteRequest).where(FileDeleteRequest.file_id.in_(file_ids)), execution_options=opts)
+            db.execute(
+                update(FileRecord).where(FileRecord.supersedes_id.in_(file_ids)).values(supersedes_id=None),
+                execution_options=opts,
+            )
+            paths = db.execute(
+                delete(FileRecord).where(FileRecord.id.in_(file_ids)).returning(FileRecord.path),
+                execution_options=opts,
+            ).scalars().all()
+            _mark_storage_dirs_dirty(db, paths)
+        db.commit()
+
+    for path in paths:
+        try:
+            p = Path(path)
+            if p.exists():
+                p.unlink()
+        except Exception:
+            pass
+    done_set = set(done)
+    return {"ok": True, "processed": sorted(done_set), "skipped": [i for i in ids if i not in done_set]}
 
 
 @app.post("/file-delete-requests/{req_id}/approve")
@@ -1281,6 +4006,7 @@ def approve_delete_request(
                 p.unlink()
         except Exception:
             pass
+        _mark_storage_dirs_dirty(db, [rec.path])
         db.delete(rec)
     db.delete(req)
     db.commit()
@@ -1303,28 +4029,43 @@ def reject_delete_request(
     return {"ok": True}
 
 
-@app.get("/projects/{project_id}/files")
+@app.get("/projects/{project_id}/files", response_class=FastJSONResponse)
+@query_budget(6)
 def list_files(
     project_id: int,
     stage_id: Optional[int] = Query(None),
-    q: Optional[str] = Query(None, description="Búsqueda por nombre (ILIKE)"),
+    q: Optional[str] = Query(None, description="Búsqueda por nombre (subcadena, índice de trigramas)"),
+    sort: str = Query("recent", pattern="^(recent|relevance)$"),
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto como next_cursor; sustituye a offset"),
+    with_total: bool = Query(False, description="Incluye el total de coincidencias (consulta extra)"),
+    db: Session = Depends(get_read_db),
     current: User = Depends(get_current_user),
 ):
-    proj = db.get(Project, project_id)
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
     ensure_member(db, current, project_id, "viewer")
 
-    from sqlalchemy import or_, and_
-    from sqlalchemy.orm import aliased
+    match = rank = None
+    if q and q.strip():
+        match, rank = _name_search(db, _FILENAME_INDEX, q)
+    stmt, filters = _files_list_stmt(project_id, stage_id, match)
+
+    total = None
+    if with_total:
+        total = db.execute(select(func.count(FileRecord.id)).where(*filters)).scalar()
+
+    stmt, by_relevance = _files_page_stmt(stmt, rank, sort, cursor, limit, offset)
+    rows, next_cursor = _files_page_result(db.execute(stmt).all(), limit, by_relevance)
+    return FastJSONResponse(_files_page_out(proj, rows, limit, offset, next_cursor, total))
+
+def _files_list_stmt(project_id: int, stage_id: Optional[int], match=None):
     U = aliased(User)
     FDR = aliased(FileDeleteRequest)
-
-    qset = (
-        db.query(FileRecord, Stage, U, FDR)
+    stmt = (
+        select(FileRecord, Stage, U, FDR)
         .join(Stage, Stage.id == FileRecord.stage_id, isouter=True)
         .join(U, U.id == FileRecord.uploaded_by, isouter=True)
         .join(
@@ -1332,18 +4073,29 @@ def list_files(
             and_(FDR.file_id == FileRecord.id, FDR.status == "pending"),
             isouter=True,
         )
-        .filter(FileRecord.project_id == project_id)
     )
+    filters = [FileRecord.project_id == project_id]
     if stage_id:
-        qset = qset.filter(FileRecord.stage_id == stage_id)
-    if q:
-        like = f"%{q.strip()}%"
-        qset = qset.filter(FileRecord.filename.ilike(like))
-
-    qset = qset.order_by(desc(FileRecord.uploaded_at)).limit(limit).offset(offset)
-
+        filters.append(FileRecord.stage_id == stage_id)
+    if match is not None:
+        filters.append(match)
+    return stmt.where(*filters), filters
+
+def _files_page_stmt(stmt, rank, sort: str, cursor: Optional[str], limit: int, offset: int):
+    if sort == "relevance" and rank is not None:
+        # keyset sobre (similitud entera, id): el cursor sale de la misma columna seleccionada
+        return _keyset_stmt(stmt.add_columns(rank), [rank, FileRecord.id], (int, int), cursor, limit, offset=offset), True
+    # keyset sobre (uploaded_at, id): cada página usa el índice sin descartar filas previas
+    return _keyset_stmt(stmt, [FileRecord.uploaded_at, FileRecord.id], (datetime, int), cursor, limit, offset=offset), False
+
+def _files_page_result(rows: list, limit: int, by_relevance: bool):
+    if by_relevance:
+        return _keyset_result(rows, limit, lambda row: (int(row[4]), row[0].id))
+    return _keyset_result(rows, limit, lambda row: (row[0].uploaded_at, row[0].id))
+
+def _files_page_out(proj: Project, rows: list, limit: int, offset: int, next_cursor: Optional[str], total: Optional[int]) -> dict:
     items = []
-    for fr, st, u, dr in qset.all():
+    for fr, st, u, dr, *_ in rows:
         rel_path = Path(fr.path).relative_to(FILES_ROOT / "projects" / proj.code)
         items.append({
             "id": fr.id,
@@ -1357,16 +4109,179 @@ def list_files(
             "path": str(rel_path),
             "pending_delete": dr is not None,
         })
-    return {"items": items, "limit": limit, "offset": offset}
+    out = {"items": items, "limit": limit, "offset": offset, "next_cursor": next_cursor}
+    if total is not None:
+        out["total"] = total
+    return out
+
+
+def _category_path_filter(category_key: str):
+    # carpeta de la categoría (Información técnica) por tipo de proyecto
+    conds = []
+    for ptype, sch in FOLDER_SCHEMAS.items():
+        for section in sch["sections"]:
+            for cat in section["categories"]:
+                if cat["key"] == category_key:
+                    conds.append(and_(
+                        Project.type == ptype,
+                        FileRecord.path.like(f"%/{section['folder']}/{cat['folder']}/%"),
+                    ))
+    if not conds:
+        raise HTTPException(400, "Categoría inválida")
+    return or_(*conds)
+
+
+def _search_files_stmt(current: User, match=None, ext: Optional[str] = None, project_type: Optional[str] = None,
+                       stage_code: Optional[str] = None, category_key: Optional[str] = None,
+                       date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                       uploaded_by: Optional[int] = None):
+    U = aliased(User)
+    FDR = aliased(FileDeleteRequest)
+    stmt = (
+        select(FileRecord, Project, Stage, U, FDR)
+        .join(Project, and_(Project.id == FileRecord.project_id, Project.deleted_at.is_(None)))
+        .join(Stage, Stage.id == FileRecord.stage_id, isouter=True)
+        .join(U, U.id == FileRecord.uploaded_by, isouter=True)
+        .join(FDR, and_(FDR.file_id == FileRecord.id, FDR.status == "pending"), isouter=True)
+    )
+    # mismas reglas de visibilidad que list_projects
+    visible = member_project_ids(current)
+    if visible is not None:
+        stmt = stmt.where(or_(FileRecord.project_id.in_(visible), Project.created_by == current.id))
+    if match is not None:
+        stmt = stmt.where(match)
+    if ext:
+        exts = [e.strip().lower().lstrip(".") for e in ext.split(",") if e.strip()]
+        if exts:
+            stmt = stmt.where(or_(*[FileRecord.filename.ilike(f"%.{e}") for e in exts]))
+    if project_type:
+        stmt = stmt.where(Project.type == project_type)
+    if stage_code:
+        stmt = stmt.where(Stage.code == stage_code.strip().upper())
+    if category_key:
+        stmt = stmt.where(_category_path_filter(category_key.strip()))
+    if date_from:
+        stmt = stmt.where(FileRecord.uploaded_at >= date_from)
+    if date_to:
+        stmt = stmt.where(FileRecord.uploaded_at < date_to)
+    if uploaded_by:
+        stmt = stmt.where(FileRecord.uploaded_by == uploaded_by)
+    return stmt
+
+@app.get("/files/search", response_class=FastJSONResponse)
+@query_budget(4)
+def search_files(
+    q: Optional[str] = Query(None, description="Búsqueda por nombre (subcadena)"),
+    ext: Optional[str] = Query(None, description="Tipo de archivo por extensión, csv: pdf,docx"),
+    project_type: Optional[str] = Query(None, pattern="^(externo|interno)$"),
+    stage_code: Optional[str] = Query(None, description="Código de etapa (E1, I2, ...)"),
+    category_key: Optional[str] = Query(None, description="Categoría de Información técnica"),
+    date_from: Optional[datetime] = Query(None),
+    date_to: Optional[datetime] = Query(None),
+    uploaded_by: Optional[int] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_read_db),
+    current: User = Depends(get_current_user),
+):
+    match = None
+    if q and q.strip():
+        match, _ = _name_search(db, _FILENAME_INDEX, q)
+    stmt = _search_files_stmt(current, match, ext, project_type, stage_code, category_key,
+                              date_from, date_to, uploaded_by)
+    stmt = _keyset_stmt(stmt, [FileRecord.uploaded_at, FileRecord.id], (datetime, int), cursor, limit)
+    rows, next_cursor = _keyset_result(db.execute(stmt).all(), limit, lambda row: (row[0].uploaded_at, row[0].id))
+
+    items = []
+    for fr, p, st, u, dr in rows:
+        items.append({
+            "id": fr.id,
+            "filename": fr.filename,
+            "size_bytes": fr.size_bytes,
+            "content_type": fr.content_type,
+            "project": {"id": p.id, "code": p.code, "name": p.name, "type": p.type},
+            "stage": ({"id": st.id, "code": st.code, "name": st.name} if st else None),
+            "uploaded_at": fr.uploaded_at,
+            "uploaded_by": (u.username if u else None),
+            "version": fr.version,
+            "is_active": fr.is_active,
+            "download_url": f"http://localhost:8000/download/{fr.id}",
+            "pending_delete": dr is not None,
+        })
+    return FastJSONResponse({"items": items, "limit": limit, "next_cursor": next_cursor})
+
+
+@app.get("/search/content", response_class=FastJSONResponse)
+def search_content(
+    q: str = Query(..., min_length=2, description="Texto a buscar dentro de los documentos"),
+    project_id: Optional[int] = Query(None),
+    active_only: bool = Query(False, description="Solo versiones activas"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db),
+    current: User = Depends(get_current_user),
+):
+    q = q.strip()
+    filters = []
+    if project_id is not None:
+        ensure_member(db, current, project_id, "viewer")
+        filters.append(FileContent.project_id == project_id)
+    else:
+        visible = member_project_ids(current)
+        if visible is not None:
+            filters.append(FileContent.project_id.in_(visible))
+    if active_only:
+        filters.append(FileRecord.is_active == True)
+
+    if IS_POSTGRES:
+        tsq = func.websearch_to_tsquery("spanish", q)
+        tsv = literal_column("file_contents.tsv")
+        rank = func.ts_rank_cd(tsv, tsq)
+        snippet = func.ts_headline(
+            "spanish", FileContent.content, tsq,
+            "MaxFragments=2, MaxWords=25, MinWords=8, StartSel=«, StopSel=»",
+        )
+        filters.append(tsv.op("@@")(tsq))
+    else:
+        rank = literal(0.0)
+        snippet = FileContent.content
+        filters.append(FileContent.content.ilike(f"%{q}%"))
+
+    rows = (
+        db.query(FileRecord, Project, rank.label("rank"), snippet.label("snippet"))
+        .join(FileContent, FileContent.file_id == FileRecord.id)
+        .join(Project, and_(Project.id == FileRecord.project_id, Project.deleted_at.is_(None)))
+        .filter(*filters)
+        .order_by(desc("rank"), desc(FileRecord.id))
+        .limit(limit)
+        .offset(offset)
+        .all()
+    )
+    items = []
+    for fr, p, r, snip in rows:
+        items.append({
+            "file": {
+                "id": fr.id, "filename": fr.filename, "version": fr.version,
+                "is_active": fr.is_active, "uploaded_at": fr.uploaded_at,
+                "stage_id": fr.stage_id, "deliverable_id": fr.deliverable_id,
+            },
+            "project": {"id": p.id, "code": p.code, "name": p.name},
+            "rank": float(r or 0.0),
+            "snippet": snip if IS_POSTGRES else _snippet(snip or "", q),
+        })
+    return FastJSONResponse({"items": items, "limit": limit, "offset": offset})
 
 
 @app.post("/projects/{project_id}/files/bulk-download")
+@offload(CPU_POOL)
 def bulk_download_files(
     project_id: int,
     ids: List[int] = Body(..., embed=True),
     db: Session = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
+    if not get_project(db, project_id):
+        raise HTTPException(404, "Proyecto no existe")
     ensure_member(db, current, project_id, "viewer")
     files = (
         db.query(FileRecord)
@@ -1376,11 +4291,14 @@ def bulk_download_files(
     if not files:
         raise HTTPException(404, "No se encontraron archivos")
     mem = io.BytesIO()
+    t0 = time.perf_counter()
     with zipfile.ZipFile(mem, "w", zipfile.ZIP_DEFLATED) as zf:
         for f in files:
             p = Path(f.path)
             if p.exists():
                 zf.write(p, arcname=f.filename)
+    ZIP_BUILD.observe(time.perf_counter() - t0)
+    DOWNLOAD_BYTES.inc(mem.getbuffer().nbytes, kind="zip")
     mem.seek(0)
     headers = {
         "Content-Disposition": f"attachment; filename=project_{project_id}_files.zip"
@@ -1389,36 +4307,46 @@ def bulk_download_files(
 
 
 @app.post("/projects/{project_id}/files/bulk-delete")
+@query_budget(6)
 def bulk_request_delete(
     project_id: int,
     payload: Dict = Body(...),
     db: Session = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
-    ids = payload.get("ids") or []
+    ids = _payload_ids(payload)
     reason = (payload.get("reason") or "").strip()
     if not ids or not reason:
         raise HTTPException(400, "ids y reason requeridos")
     ensure_member(db, current, project_id, "manager")
-    created = []
-    for fid in ids:
-        rec = db.get(FileRecord, fid)
-        if not rec or rec.project_id != project_id:
-            continue
-        if db.query(FileDeleteRequest).filter_by(file_id=fid, status="pending").first():
-            continue
-        req = FileDeleteRequest(
-            file_id=fid, requested_by=current.id, reason=reason
+    # un solo INSERT ... SELECT: valida pertenencia al proyecto y omite los que ya tienen solicitud pendiente
+    stmt = (
+        dialect_insert(FileDeleteRequest)
+        .from_select(
+            ["file_id", "requested_by", "reason", "status", "requested_at"],
+            select(FileRecord.id, literal(current.id), literal(reason), literal("pending"), func.now())
+            .where(FileRecord.project_id == project_id, FileRecord.id.in_(ids)),
         )
-        db.add(req)
-        db.flush()
-        created.append(req.id)
+        .on_conflict_do_nothing(
+            index_elements=[FileDeleteRequest.file_id],
+            index_where=FileDeleteRequest.status == "pending",
+        )
+        .returning(FileDeleteRequest.id, FileDeleteRequest.file_id)
+    )
+    rows = db.execute(stmt).all()
     db.commit()
-    return {"ok": True, "request_ids": created}
+    created_files = {fid for _, fid in rows}
+    return {
+        "ok": True,
+        "request_ids": [rid for rid, _ in rows],
+        "created_file_ids": sorted(created_files),
+        "skipped_file_ids": [fid for fid in ids if fid not in created_files],
+    }
 
 
 # -------- Upload de archivos --------
 @app.post("/upload")
+@offload(FILE_IO_POOL)
 def upload_file(
     project_id: int = Form(...),
     # EXPEDIENTE IMT (usa etapas)
@@ -1433,7 +4361,7 @@ def upload_file(
     db: Session = Depends(get_db),
     current: User = Depends(get_current_user),
 ):
-    proj = db.get(Project, project_id)
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
 
@@ -1473,20 +4401,7 @@ def upload_file(
         raise HTTPException(415, f"Extensión no permitida: .{ext}")
 
     dest_path = dest_dir / file.filename
-    hasher = hashlib.sha256()
-    total = 0
-    with dest_path.open("wb") as f:
-        while True:
-            chunk = file.file.read(1024 * 1024)
-            if not chunk:
-                break
-            total += len(chunk)
-            if total > MAX_FILE_MB * 1024 * 1024:
-                try: dest_path.unlink()
-                except Exception: pass
-                raise HTTPException(413, f"Archivo supera {MAX_FILE_MB} MB")
-            hasher.update(chunk)
-            f.write(chunk)
+    total, digest = _stream_upload(file, dest_path)
 
     rec = FileRecord(
         project_id=project_id,
@@ -1495,10 +4410,11 @@ def upload_file(
         path=str(dest_path),
         size_bytes=total,
         content_type=file.content_type,
-        sha256=hasher.hexdigest(),
+        sha256=digest,
         uploaded_by=current.id
     )
     db.add(rec); db.commit()
+    CONTENT_INDEXER.enqueue(rec.id)
 
     return {
         "ok": True,
@@ -1511,6 +4427,7 @@ def upload_file(
     }
 
 @app.post("/upload/expediente")
+@offload(FILE_IO_POOL)
 def upload_expediente(
     project_id: int = Form(...),
     stage_id: int = Form(...),
@@ -1520,7 +4437,7 @@ def upload_expediente(
     db: Session = Depends(get_db),
     current: User = Depends(get_current_user)
 ):
-    proj = db.query(Project).get(project_id)
+    proj = get_project(db, project_id)
     if not proj:
         raise HTTPException(404, "Proyecto no existe")
 
@@ -1530,10 +4447,7 @@ def upload_expediente(
     if not stage or stage.project_id != project_id:
         raise HTTPException(400, "Etapa inválida para el proyecto")
 
-    spec = db.query(DeliverableSpec).filter(
-        DeliverableSpec.stage_id == stage.id,
-        DeliverableSpec.key == deliverable_key
-    ).first()
+    spec = next((s for s in project_specs(db, proj, [stage])[stage.id] if s.key == deliverable_key), None)
     if not spec:
         raise HTTPException(404, "Entregable no encontrado en la etapa")
 
@@ -1547,62 +4461,73 @@ def upload_expediente(
     if ALLOWED_EXT and ext not in ALLOWED_EXT:
         raise HTTPException(415, f"Extensión no permitida por la política global: .{ext}. Globalmente permitidas: {sorted(ALLOWED_EXT)}")
 
-    # Versionado / política single vs multi
-    existing_active: Optional[FileRecord] = None
-    if not spec.multi:
-        existing_active = db.query(FileRecord).filter(
+    # Pre-chequeo sin lock para fallar antes de recibir el archivo
+    if not spec.multi and not reason and spec.id is not None:
+        has_active = db.query(FileRecord.id).filter(
             FileRecord.deliverable_id == spec.id,
             FileRecord.is_active == True
-        ).order_by(FileRecord.version.desc()).first()
-        if existing_active and not reason:
+        ).first()
+        if has_active:
             raise HTTPException(400, "Debes indicar 'reason' para crear una nueva versión de un entregable de archivo único.")
 
-    version = _next_version_for_deliverable(db, spec.id)
-    dest_dir = _build_expediente_path(proj.code, stage.code, spec.key, version)
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    dest_path = dest_dir / file.filename
-
-    # Guardado con límites
-    hasher = hashlib.sha256()
-    total = 0
-    with dest_path.open("wb") as f:
-        while True:
-            chunk = file.file.read(1024 * 1024)
-            if not chunk:
-                break
-            total += len(chunk)
-            if total > MAX_FILE_MB * 1024 * 1024:
-                try:
-                    dest_path.unlink()
-                except Exception:
-                    pass
-                raise HTTPException(413, f"Archivo supera {MAX_FILE_MB} MB")
-            hasher.update(chunk)
-            f.write(chunk)
-
-    # Si single y había activo, lo desactivamos (queda como versión previa)
-    supersedes_id = None
-    if existing_active:
-        existing_active.is_active = False
-        supersedes_id = existing_active.id
-        db.add(existing_active)
-
-    rec = FileRecord(
-        project_id=project_id,
-        stage_id=stage_id,
-        deliverable_id=spec.id,
-        filename=file.filename,
-        path=str(dest_path),
-        size_bytes=total,
-        content_type=file.content_type,
-        sha256=hasher.hexdigest(),
-        uploaded_by=current.id,
-        is_active=True,
-        version=version,
-        reason=reason,
-        supersedes_id=supersedes_id
-    )
-    db.add(rec); db.commit()
+    # El archivo se recibe primero en staging; la versión se reserva después, de modo que
+    # el lock del contador sólo cubre el rename + INSERT y no la transferencia completa.
+    UPLOAD_TMP.mkdir(parents=True, exist_ok=True)
+    tmp_path = UPLOAD_TMP / f"{uuid.uuid4().hex}.part"
+    dest_path: Optional[Path] = None
+    try:
+        total, digest = _stream_upload(file, tmp_path)
+
+        # primer archivo del entregable: se crea su fila ancla (contador de versiones)
+        if spec.id is None:
+            _materialize_spec(db, stage, spec)
+        version = _next_version_for_deliverable(db, spec.id)
+
+        # Versionado / política single vs multi (ya serializado por el lock del contador)
+        existing_active: Optional[FileRecord] = None
+        if not spec.multi:
+            existing_active = db.execute(_active_version_stmt(spec.id)).scalars().first()
+            if existing_active and not reason:
+                raise HTTPException(400, "Debes indicar 'reason' para crear una nueva versión de un entregable de archivo único.")
+
+        dest_dir = _build_expediente_path(proj.code, stage.code, spec.key, version)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        dest_path = dest_dir / file.filename
+        os.replace(tmp_path, dest_path)
+
+        # Si single y había activo, lo desactivamos (queda como versión previa)
+        supersedes_id = None
+        if existing_active:
+            existing_active.is_active = False
+            supersedes_id = existing_active.id
+            db.add(existing_active)
+
+        rec = FileRecord(
+            project_id=project_id,
+            stage_id=stage_id,
+            deliverable_id=spec.id,
+            filename=file.filename,
+            path=str(dest_path),
+            size_bytes=total,
+            content_type=file.content_type,
+            sha256=digest,
+            uploaded_by=current.id,
+            is_active=True,
+            version=version,
+            reason=reason,
+            supersedes_id=supersedes_id
+        )
+        db.add(rec); db.commit()
+    except Exception:
+        db.rollback()
+        for leftover in (tmp_path, dest_path):
+            try:
+                if leftover is not None and leftover.exists():
+                    leftover.unlink()
+            except Exception:
+                pass
+        raise
+    CONTENT_INDEXER.enqueue(rec.id)
 
     # Respuesta compacta + snapshot opcional
     return {
@@ -1616,3 +4541,137 @@ def upload_expediente(
             "reason": rec.reason
         }
     }
+
+
+# ----------------- Lectura asíncrona (/async) -----------------
+# Versiones async de las rutas de lectura más usadas. Reutilizan los mismos statements y
+# constructores de respuesta que las síncronas; sólo cambia la ejecución (await sobre AsyncSession),
+# así que no ocupan un hilo del threadpool mientras esperan a la base o a un cliente lento.
+async_router = APIRouter(prefix="/async", route_class=ProfilingRoute)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def _decode_user_async(db: AsyncSession, token: Optional[str]) -> Optional[User]:
+    username = _token_subject(token)
+    if not username:
+        return None
+    return (await db.execute(select(User).where(User.username == username))).scalars().first()
+
+async def get_current_user_async(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)) -> User:
+    user = await _decode_user_async(db, token)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+    stats = _REQUEST_STATS.get()
+    if stats is not None:
+        stats["user"] = user.username
+    return user
+
+async def _get_project_async(db: AsyncSession, project_id: int) -> Optional[Project]:
+    proj = await db.get(Project, project_id)
+    if proj is None or proj.deleted_at is not None:
+        return None
+    return proj
+
+async def _ensure_member_async(db: AsyncSession, user: User, project_id: int, need: str = "viewer"):
+    if not _needs_membership(user, need):
+        return
+    m = (await db.execute(_membership_stmt(project_id, user.id))).scalars().first()
+    _check_member_role(m, need)
+
+async def _project_specs_async(db: AsyncSession, project: Project, stages: List[Stage]) -> Dict[int, List[EffectiveSpec]]:
+    tree = {"stages": []}
+    if project.template_id:
+        tree = TEMPLATE_CACHE.get(project.template_id)
+        if tree is None:
+            tstages = (await db.execute(_template_stages_stmt(project.template_id))).scalars().all()
+            tdelivs = (await db.execute(_template_deliverables_stmt([st.id for st in tstages]))).scalars().all() if tstages else []
+            tree = _build_template_tree(project.template_id, tstages, tdelivs)
+    rows = (await db.execute(_spec_rows_stmt([s.id for s in stages]))).scalars().all() if stages else []
+    return _merge_specs(tree, stages, rows)
+
+async def _expediente_snapshot_async(project_id: int, db: AsyncSession) -> dict:
+    proj = await _get_project_async(db, project_id)
+    if not proj:
+        raise HTTPException(404, "Proyecto no existe")
+    stages = (await db.execute(_stages_stmt(project_id))).scalars().all()
+    return _build_snapshot(
+        proj, stages, await _project_specs_async(db, proj, stages),
+        (await db.execute(_snapshot_files_stmt(project_id))).scalars().all(),
+        set((await db.execute(_snapshot_pending_stmt(project_id))).scalars()),
+    )
+
+def _filename_search_threaded(q: str):
+    # sin pg_trgm el filtro sale del índice en memoria, que se refresca con la sesión síncrona
+    with SessionLocal() as db:
+        return _name_search(db, _FILENAME_INDEX, q)
+
+@async_router.get("/projects")
+async def list_projects_async(db: AsyncSession = Depends(get_async_db), current: User = Depends(get_current_user_async)):
+    return _project_items((await db.execute(_projects_stmt(current))).all(), current)
+
+@async_router.get("/projects/{project_id}/expediente", response_class=FastJSONResponse)
+async def get_expediente_async(project_id: int, db: AsyncSession = Depends(get_async_db), current: User = Depends(get_current_user_async)):
+    return FastJSONResponse(await _expediente_snapshot_async(project_id, db))
+
+@async_router.get("/projects/{project_id}/progress-expediente")
+async def progress_expediente_async(project_id: int, db: AsyncSession = Depends(get_async_db), current: User = Depends(get_current_user_async)):
+    return _progress_from_snapshot(await _expediente_snapshot_async(project_id, db))
+
+@async_router.get("/projects/{project_id}/progress")
+async def project_progress_async(project_id: int, db: AsyncSession = Depends(get_async_db), current: User = Depends(get_current_user_async)):
+    proj = await _get_project_async(db, project_id)
+    if not proj:
+        raise HTTPException(404, "Proyecto no existe")
+    await _ensure_member_async(db, current, project_id, "viewer")
+    stages = (await db.execute(_stages_stmt(project_id))).scalars().all()
+    counts = dict((await db.execute(_stage_file_counts_stmt(project_id))).all())
+    return _build_progress(proj, stages, counts)
+
+@async_router.get("/projects/{project_id}/files", response_class=FastJSONResponse)
+async def list_files_async(
+    project_id: int,
+    stage_id: Optional[int] = Query(None),
+    q: Optional[str] = Query(None, description="Búsqueda por nombre (subcadena, índice de trigramas)"),
+    sort: str = Query("recent", pattern="^(recent|relevance)$"),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto como next_cursor; sustituye a offset"),
+    with_total: bool = Query(False, description="Incluye el total de coincidencias (consulta extra)"),
+    db: AsyncSession = Depends(get_async_db),
+    current: User = Depends(get_current_user_async),
+):
+    proj = await _get_project_async(db, project_id)
+    if not proj:
+        raise HTTPException(404, "Proyecto no existe")
+    await _ensure_member_async(db, current, project_id, "viewer")
+
+    match = rank = None
+    if q and q.strip():
+        match, rank = await run_in_threadpool(_filename_search_threaded, q)
+    stmt, filters = _files_list_stmt(project_id, stage_id, match)
+
+    total = None
+    if with_total:
+        total = (await db.execute(select(func.count(FileRecord.id)).where(*filters))).scalar()
+
+    stmt, by_relevance = _files_page_stmt(stmt, rank, sort, cursor, limit, offset)
+    rows, next_cursor = _files_page_result((await db.execute(stmt)).all(), limit, by_relevance)
+    return FastJSONResponse(_files_page_out(proj, rows, limit, offset, next_cursor, total))
+
+@async_router.get("/download/{file_id}")
+async def download_file_async(file_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    current = await _decode_user_async(db, _download_token(request))
+    if not current:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    rec = await db.get(FileRecord, file_id)
+    if not rec or not await _get_project_async(db, rec.project_id) or not os.path.exists(rec.path):
+        raise HTTPException(404, "Archivo no encontrado")
+
+    await _ensure_member_async(db, current, rec.project_id, "viewer")
+    return _download_response(rec, request)
+
+if AsyncSessionLocal is not None:
+    app.include_router(async_router)
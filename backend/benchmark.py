@@ -0,0 +1,778 @@
+# backend/benchmark.py
+# Benchmark reproducible de la API completa.
+#
+#   generate  carga datos sintéticos en la base (PostgreSQL recomendado) y en FILES_ROOT
+#   run       corre escenarios HTTP concurrentes contra un servidor en marcha e imprime JSON
+#             (throughput y percentiles por endpoint) para comparar entre commits
+#   compare   compara dos resultados de `run`
+#   payload   bytes en el cable por Accept-Encoding y CPU de serialización JSON (estándar vs rápida)
+#   cleanup   borra los datos sintéticos (proyectos "[bench] ..." y usuarios bench_*)
+#
+# Ejemplo:
+#   python benchmark.py generate --projects 200 --versions 4 --users 50
+#   uvicorn app:app --workers 4 &
+#   python benchmark.py run --scenarios expediente:3,files:2,upload:1 --concurrency 50 --duration 60 --out a.json
+#   python benchmark.py compare a.json b.json
+#   python benchmark.py payload --projects 5
+import os, sys, io, json, time, uuid, zlib, random, hashlib, argparse, threading, subprocess, shutil
+import http.client
+import urllib.parse
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+BENCH_PREFIX = "[bench]"      # nombre de los proyectos sintéticos
+BENCH_USER = "bench_u"        # bench_u1..N (colaboradores)
+BENCH_ADMIN = "bench_admin"
+BENCH_INITIALS = "BCH"
+BENCH_PASSWORD = "bench-pass-123"
+
+WORDS = (
+    "ensayo muestra resistencia concreto asfalto pavimento puente carga deformación laboratorio "
+    "granulometría densidad compactación humedad tensión módulo fatiga tránsito aforo señalamiento "
+    "drenaje talud cimentación acero corrosión informe campo resultados norma especificación calibración"
+).split()
+
+
+# ================= Generador de datos =================
+def _app():
+    # import tardío: `run` y `compare` no necesitan la base ni las dependencias del backend
+    import app
+    return app
+
+def _ensure_users(db, n_users: int, pw_hash: str) -> Tuple[int, List[int]]:
+    A = _app()
+    rows = [{"username": BENCH_ADMIN, "password_hash": pw_hash, "full_name": "Bench Admin",
+             "email": "bench_admin@example.com", "initials": BENCH_INITIALS, "role": "admin",
+             "can_create_projects": True, "can_access_exptec": True}]
+    rows += [{"username": f"{BENCH_USER}{i}", "password_hash": pw_hash, "full_name": f"Bench Usuario {i}",
+              "email": f"bench_u{i}@example.com", "initials": BENCH_INITIALS, "role": "colaborador",
+              "can_create_projects": False, "can_access_exptec": True} for i in range(1, n_users + 1)]
+    db.execute(A.dialect_insert(A.User).values(rows).on_conflict_do_nothing(index_elements=["username"]))
+    db.commit()
+    ids = dict(db.query(A.User.username, A.User.id).filter(A.User.username.in_([r["username"] for r in rows])))
+    return ids[BENCH_ADMIN], [ids[r["username"]] for r in rows[1:]]
+
+def _text(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def _info_targets(ptype: str) -> List[Tuple[str, str, Optional[str]]]:
+    # (section, category, subcategory) de Información técnica según el esquema del tipo
+    A = _app()
+    out = []
+    for sec in A.get_project_schema(ptype)["sections"]:
+        for cat in sec["categories"]:
+            out.append((sec["key"], cat["key"], None))
+            for sub in cat.get("children") or []:
+                out.append((sec["key"], cat["key"], sub["key"]))
+    return out
+
+class _Blob:
+    """Contenido de los archivos en disco: un bloque pseudoaleatorio compartido (sha256 conocido)."""
+
+    def __init__(self, rng: random.Random, size: int, write: bool):
+        self.data = rng.randbytes(size)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+        self.write = write
+
+    def put(self, path: Path):
+        if self.write:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(self.data)
+
+def _create_project(db, n: int, ptype: str, admin_id: int) -> Optional[Any]:
+    A = _app()
+    code = f"{'EE' if ptype == 'externo' else 'EI'}{n:04d} {BENCH_INITIALS}"
+    if db.query(A.Project.id).filter(A.Project.code == code).first():
+        return None
+    template_id, stage_rows = A._template_for_new_project(db, ptype)
+    proj = A.Project(code=code, name=f"{BENCH_PREFIX} Proyecto {n:04d}", type=ptype, created_by=admin_id,
+                     template_id=template_id, created_at=datetime.utcnow() - timedelta(hours=n))
+    db.add(proj)
+    db.flush()
+    db.add(A.ProjectMember(project_id=proj.id, user_id=admin_id, role="manager"))
+    if stage_rows:
+        db.execute(A.insert(A.Stage).values([
+            {"project_id": proj.id, "code": c, "name": nm, "order_index": o} for c, nm, o in stage_rows
+        ]))
+    return proj
+
+def _populate_project(db, proj, args, rng: random.Random, user_ids: List[int], blob: _Blob) -> Dict[str, int]:
+    A = _app()
+    counts = defaultdict(int)
+    members = rng.sample(user_ids, min(args.members, len(user_ids)))
+    if members:
+        db.execute(A.insert(A.ProjectMember).values([
+            {"project_id": proj.id, "user_id": uid, "role": rng.choice(("viewer", "uploader", "uploader", "manager"))}
+            for uid in members
+        ]))
+    uploaders = members or [proj.created_by]
+    stages = {st.code: st for st in db.query(A.Stage).filter(A.Stage.project_id == proj.id)}
+    tree = A.template_tree(db, proj.template_id) if proj.template_id else {"stages": []}
+    t0 = proj.created_at
+
+    # Expediente IMT: anclas materializadas y N versiones por entregable
+    plan = []  # (etapa, spec de plantilla, versiones)
+    for tst in tree["stages"]:
+        st = stages.get(tst["code"])
+        for d in tst["deliverables"]:
+            if st is None or rng.random() >= args.fill:
+                continue
+            plan.append((st, d, rng.randint(1, args.versions)))
+    if plan:
+        anchor_ids = db.execute(
+            A.insert(A.DeliverableSpec).returning(A.DeliverableSpec.id, sort_by_parameter_order=True),
+            [{"stage_id": st.id, "key": d["key"], "template_deliverable_id": d["id"], "is_override": False,
+              "last_version": n, **{f: d[f] for f in A.SPEC_FIELDS}} for st, d, n in plan],
+        ).scalars().all()
+        prev: Dict[int, int] = {}
+        for v in range(1, max(n for _, _, n in plan) + 1):
+            rows = []
+            for anchor_id, (st, d, n) in zip(anchor_ids, plan):
+                if v > n:
+                    continue
+                ext = (d["allowed_ext"] or "pdf").split(",")[0]
+                filename = f"{d['key']}_v{v}.{ext}"
+                path = A._build_expediente_path(proj.code, st.code, d["key"], v) / filename
+                blob.put(path)
+                rows.append({
+                    "project_id": proj.id, "stage_id": st.id, "deliverable_id": anchor_id,
+                    "filename": filename, "path": str(path), "size_bytes": len(blob.data),
+                    "content_type": "application/octet-stream", "sha256": blob.sha256,
+                    "uploaded_by": rng.choice(uploaders), "uploaded_at": t0 + timedelta(minutes=rng.randint(1, 60 * 24 * 365)),
+                    "is_active": d["multi"] or v == n, "version": v,
+                    "reason": f"versión {v}" if v > 1 else None,
+                    "supersedes_id": None if d["multi"] else prev.get(anchor_id),
+                })
+            ids = db.execute(A.insert(A.FileRecord).returning(A.FileRecord.id, sort_by_parameter_order=True),
+                             rows).scalars().all()
+            for row, fid in zip(rows, ids):
+                prev[row["deliverable_id"]] = fid
+                row["id"] = fid
+            counts["expediente_files"] += len(rows)
+            _content_and_requests(db, proj, rows, args, rng, uploaders, counts)
+
+    # Información técnica: archivos sueltos en el árbol de categorías
+    targets = _info_targets(proj.type)
+    rows = []
+    for i in range(args.info_files):
+        sec, cat, sub = rng.choice(targets)
+        ext = rng.choice(("pdf", "xlsx", "docx", "csv", "png"))
+        filename = f"{cat}_{sub + '_' if sub else ''}{i:05d}.{ext}"
+        path = A.resolve_folder_path(proj, sec, cat, sub) / filename
+        blob.put(path)
+        rows.append({
+            "project_id": proj.id, "stage_id": None, "deliverable_id": None, "filename": filename,
+            "path": str(path), "size_bytes": len(blob.data), "content_type": "application/octet-stream",
+            "sha256": blob.sha256, "uploaded_by": rng.choice(uploaders),
+            "uploaded_at": t0 + timedelta(minutes=rng.randint(1, 60 * 24 * 365)),
+            "is_active": True, "version": 1, "reason": None, "supersedes_id": None,
+        })
+    if rows:
+        ids = db.execute(A.insert(A.FileRecord).returning(A.FileRecord.id, sort_by_parameter_order=True),
+                         rows).scalars().all()
+        for row, fid in zip(rows, ids):
+            row["id"] = fid
+        counts["info_files"] += len(rows)
+        _content_and_requests(db, proj, rows, args, rng, uploaders, counts)
+    return counts
+
+def _content_and_requests(db, proj, rows: List[dict], args, rng: random.Random, uploaders: List[int], counts):
+    A = _app()
+    # texto "extraído": así el indexador no los reprocesa y /search/content tiene material
+    db.execute(A.insert(A.FileContent), [
+        {"file_id": r["id"], "project_id": proj.id, "status": "ok", "content": _text(rng, args.words)}
+        for r in rows
+    ])
+    pending = [r for r in rows if r["is_active"] and rng.random() < args.delete_requests]
+    if pending:
+        db.execute(A.insert(A.FileDeleteRequest), [
+            {"file_id": r["id"], "requested_by": rng.choice(uploaders), "reason": "sintética",
+             "status": "pending", "requested_at": r["uploaded_at"] + timedelta(days=1)}
+            for r in pending
+        ])
+        counts["delete_requests"] += len(pending)
+
+def generate(args):
+    A = _app()
+    from passlib.hash import bcrypt
+    rng = random.Random(args.rng_seed)
+    A.create_db()
+    A.run_migrations()
+    A._sync_checklist_templates()
+    blob = _Blob(rng, args.file_kb * 1024, write=not args.no_disk)
+    pw_hash = bcrypt.hash(args.password)
+    totals = defaultdict(int)
+    t0 = time.monotonic()
+    with A.SessionLocal() as db:
+        admin_id, user_ids = _ensure_users(db, args.users, pw_hash)
+        for n in range(1, args.projects + 1):
+            ptype = "externo" if n % 2 else "interno"  # ambos tipos del SEED
+            proj = _create_project(db, (n + 1) // 2, ptype, admin_id)
+            if proj is None:
+                totals["skipped_projects"] += 1
+                db.rollback()
+                continue
+            for k, v in _populate_project(db, proj, args, rng, user_ids, blob).items():
+                totals[k] += v
+            db.commit()
+            totals["projects"] += 1
+            if n % 10 == 0:
+                print(f"[INFO] {n}/{args.projects} proyectos ({time.monotonic() - t0:.0f}s)", file=sys.stderr)
+    if A.IS_POSTGRES:
+        with A.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(A.text("ANALYZE"))
+    print(json.dumps({"generated": dict(totals), "users": args.users + 1, "seconds": round(time.monotonic() - t0, 1)}))
+
+def cleanup(args):
+    A = _app()
+    bench = "SELECT id FROM projects WHERE name LIKE :p"
+    stmts = [
+        f"DELETE FROM file_contents WHERE project_id IN ({bench})",
+        f"DELETE FROM file_delete_requests WHERE file_id IN (SELECT id FROM files WHERE project_id IN ({bench}))",
+        f"UPDATE files SET supersedes_id = NULL WHERE project_id IN ({bench})",
+        f"DELETE FROM files WHERE project_id IN ({bench})",
+        f"DELETE FROM deliverables WHERE stage_id IN (SELECT id FROM stages WHERE project_id IN ({bench}))",
+        f"DELETE FROM stages WHERE project_id IN ({bench})",
+        f"DELETE FROM project_members WHERE project_id IN ({bench})",
+        "DELETE FROM projects WHERE name LIKE :p",
+        "DELETE FROM project_members WHERE user_id IN (SELECT id FROM users WHERE username = :a OR username LIKE :u)",
+        "DELETE FROM users WHERE username = :a OR username LIKE :u",
+    ]
+    with A.engine.begin() as conn:
+        codes = [c for (c,) in conn.execute(A.text("SELECT code FROM projects WHERE name LIKE :p"),
+                                            {"p": BENCH_PREFIX + "%"})]
+        for stmt in stmts:
+            conn.execute(A.text(stmt), {"p": BENCH_PREFIX + "%", "a": BENCH_ADMIN, "u": BENCH_USER + "%"})
+    for code in codes:
+        shutil.rmtree(A.FILES_ROOT / "projects" / code, ignore_errors=True)
+    print(json.dumps({"removed_projects": len(codes)}))
+
+
+# ================= Cliente HTTP y escenarios =================
+class Client:
+    """Conexión keep-alive por worker (http.client, sin dependencias)."""
+
+    def __init__(self, base_url: str, timeout: float, accept_encoding: Optional[str]):
+        u = urllib.parse.urlsplit(base_url)
+        self.https = u.scheme == "https"
+        self.host = u.hostname
+        self.port = u.port or (443 if self.https else 80)
+        self.prefix = u.path.rstrip("/")
+        self.timeout = timeout
+        self.accept_encoding = accept_encoding
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes, Dict[str, str]]:
+        headers = dict(headers or {})
+        if self.accept_encoding:
+            headers["Accept-Encoding"] = self.accept_encoding
+        for attempt in (1, 2):  # un reintento si el servidor cerró la conexión keep-alive
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request(method, self.prefix + path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()  # bytes en el cable: sin descomprimir
+                return resp.status, data, {k.lower(): v for k, v in resp.getheaders()}
+            except (http.client.HTTPException, ConnectionError, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+def _form(fields: Dict[str, Any]) -> Tuple[bytes, Dict[str, str]]:
+    return urllib.parse.urlencode(fields).encode(), {"Content-Type": "application/x-www-form-urlencoded"}
+
+def _multipart(fields: Dict[str, Any], filename: str, content: bytes) -> Tuple[bytes, Dict[str, str]]:
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for k, v in fields.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+    out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+              f"Content-Type: application/octet-stream\r\n\r\n".encode())
+    out.write(content)
+    out.write(f"\r\n--{boundary}--\r\n".encode())
+    return out.getvalue(), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+class Context:
+    """Datos descubiertos vía API antes de medir (tokens, proyectos, entregables y archivos)."""
+
+    def __init__(self):
+        self.users: List[Tuple[str, str]] = []        # (username, token)
+        self.visible: Dict[str, List[int]] = {}        # token -> proyectos visibles
+        self.admin_token: Optional[str] = None
+        self.deliverables: Dict[int, List[dict]] = {}  # proyecto -> [{stage_id, key, multi, ext}]
+        self.files: Dict[int, List[int]] = {}          # proyecto -> ids de archivos
+        self.race: Optional[dict] = None               # entregable single compartido por upload-race
+        self.free_codes: Iterator[Tuple[str, str]] = iter(())  # (tipo, clave) sin proyecto, desde un offset aleatorio
+        self.lock = threading.Lock()
+        self.checks: Dict[str, Any] = defaultdict(int)
+
+class Worker:
+    def __init__(self, wid: int, args, ctx: Context, warmup_until: float):
+        self.rng = random.Random(args.rng_seed * 1000 + wid)
+        self.client = Client(args.base_url, args.timeout, args.accept_encoding)
+        self.ctx = ctx
+        self.args = args
+        self.warmup_until = warmup_until
+        self.samples: Dict[str, List[Tuple[float, int, int]]] = defaultdict(list)  # nombre -> (s, status, bytes)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.user, self.token = self.rng.choice(ctx.users) if ctx.users else (None, ctx.admin_token)
+
+    def auth(self, token: Optional[str] = None) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token or self.token}"}
+
+    def call(self, name: str, method: str, path: str, body: Optional[bytes] = None,
+             headers: Optional[Dict[str, str]] = None, token: Optional[str] = None,
+             setup_errors: Tuple[int, ...] = ()) -> Tuple[int, bytes, Dict[str, str]]:
+        # setup_errors: estados que delatan datos de prueba inválidos; no cuentan como muestra
+        t0 = time.perf_counter()
+        try:
+            status, data, resp_headers = self.client.request(method, path, body, {**self.auth(token), **(headers or {})})
+        except Exception as e:
+            if time.monotonic() >= self.warmup_until:
+                self.errors[name][type(e).__name__] += 1
+            return 0, b"", {}
+        if status in setup_errors:
+            with self.ctx.lock:
+                self.ctx.checks[f"setup_error {name} {status}"] += 1
+            return status, data, resp_headers
+        if time.monotonic() >= self.warmup_until:
+            self.samples[name].append((time.perf_counter() - t0, status, len(data)))
+            if status >= 400:
+                self.errors[name][str(status)] += 1
+        return status, data, resp_headers
+
+    def project(self) -> Optional[int]:
+        visible = [p for p in self.ctx.visible.get(self.token, []) if p in self.ctx.deliverables]
+        return self.rng.choice(visible) if visible else None
+
+
+def sc_login(w: Worker):
+    user = w.rng.choice(w.ctx.users)[0] if w.ctx.users else BENCH_ADMIN
+    body, headers = _form({"username": user, "password": w.args.password})
+    w.call("POST /auth/login", "POST", "/auth/login", body, headers, token="-")
+
+def _browse(w: Worker, prefix: str):
+    w.call(f"GET {prefix}/projects", "GET", f"{prefix}/projects")
+    pid = w.project()
+    if pid is None:
+        return
+    w.call(f"GET {prefix}/projects/{{id}}/expediente", "GET", f"{prefix}/projects/{pid}/expediente")
+    w.call(f"GET {prefix}/projects/{{id}}/progress-expediente", "GET", f"{prefix}/projects/{pid}/progress-expediente")
+
+def sc_expediente(w: Worker):
+    _browse(w, "")
+
+def sc_expediente_async(w: Worker):
+    _browse(w, "/async")
+
+def sc_files(w: Worker):
+    pid = w.project()
+    if pid is None:
+        return
+    qs = {"limit": w.args.page_size}
+    if w.rng.random() < 0.3:
+        qs["q"] = w.rng.choice(WORDS[:8])[:4]
+    status, data, _ = w.call("GET /projects/{id}/files", "GET", f"/projects/{pid}/files?{urllib.parse.urlencode(qs)}")
+    if status == 200:
+        cursor = json.loads(data).get("next_cursor")
+        if cursor:
+            qs["cursor"] = cursor
+            w.call("GET /projects/{id}/files (cursor)", "GET", f"/projects/{pid}/files?{urllib.parse.urlencode(qs)}")
+
+def sc_search(w: Worker):
+    term = w.rng.choice(("ensayo", "informe", "solicitud", "propuesta", "v2", "datos", "acta"))
+    w.call("GET /files/search", "GET", "/files/search?" + urllib.parse.urlencode({"q": term, "limit": 50}))
+    w.call("GET /search/content", "GET", "/search/content?" + urllib.parse.urlencode({"q": w.rng.choice(WORDS)}))
+    w.call("GET /users", "GET", "/users?" + urllib.parse.urlencode({"q": "bench"}), token=w.ctx.admin_token)
+
+def _upload(w: Worker, pid: int, d: dict, name: str) -> Tuple[int, bytes]:
+    fields = {"project_id": pid, "stage_id": d["stage_id"], "deliverable_key": d["key"], "reason": "benchmark"}
+    body, headers = _multipart(fields, f"bench_{uuid.uuid4().hex[:8]}.{d['ext']}", os.urandom(w.args.upload_kb * 1024))
+    status, data, _ = w.call(name, "POST", "/upload/expediente", body, headers, token=w.ctx.admin_token)
+    return status, data
+
+def sc_upload(w: Worker):
+    pid = w.rng.choice(list(w.ctx.deliverables)) if w.ctx.deliverables else None
+    if pid is None or not w.ctx.deliverables[pid]:
+        return
+    _upload(w, pid, w.rng.choice(w.ctx.deliverables[pid]), "POST /upload/expediente")
+
+def sc_upload_race(w: Worker):
+    # todos los workers versionan el mismo entregable single: las versiones deben quedar únicas y sin huecos
+    if w.ctx.race:
+        _upload(w, w.ctx.race["project_id"], w.ctx.race, "POST /upload/expediente (race)")
+
+def sc_read_your_writes(w: Worker):
+    pid = w.rng.choice(list(w.ctx.deliverables)) if w.ctx.deliverables else None
+    if pid is None or not w.ctx.deliverables[pid]:
+        return
+    status, data = _upload(w, pid, w.rng.choice(w.ctx.deliverables[pid]), "POST /upload/expediente (ryw)")
+    if status != 200:
+        return
+    fid = json.loads(data)["file"]["id"]
+    status, data, _ = w.call("GET /projects/{id}/expediente (ryw)", "GET", f"/projects/{pid}/expediente",
+                             token=w.ctx.admin_token)
+    if status == 200:
+        seen = any(f["id"] == fid for st in json.loads(data)["stages"] for it in st["deliverables"] for f in it["files"])
+        with w.ctx.lock:
+            w.ctx.checks["read_your_writes_ok" if seen else "read_your_writes_stale"] += 1
+
+def sc_download(w: Worker):
+    pid = w.project()
+    if pid is None or not w.ctx.files.get(pid):
+        return
+    fid = w.rng.choice(w.ctx.files[pid])
+    w.call("GET /download/{id}", "GET", f"/download/{fid}")
+
+def sc_zip(w: Worker):
+    pid = w.project()
+    if pid is None or not w.ctx.files.get(pid):
+        return
+    ids = w.rng.sample(w.ctx.files[pid], min(w.args.zip_files, len(w.ctx.files[pid])))
+    w.call("POST /projects/{id}/files/bulk-download", "POST", f"/projects/{pid}/files/bulk-download",
+           json.dumps({"ids": ids}).encode(), {"Content-Type": "application/json"})
+
+def sc_create_project(w: Worker):
+    with w.ctx.lock:
+        ptype, code = next(w.ctx.free_codes, (None, None))
+        if code is None:
+            w.ctx.checks["setup_error create-project codes_exhausted"] += 1
+    if code is None:
+        return  # 10000 claves por tipo: correr `cleanup` entre corridas
+    body, headers = _form({"code": code, "name": f"{BENCH_PREFIX} run {code}", "type": ptype})
+    # 400/409: la clave ya existe (p. ej. proyecto en eliminación), no es latencia de creación
+    w.call("POST /projects", "POST", "/projects", body, headers, token=w.ctx.admin_token, setup_errors=(400, 409))
+
+def _free_codes(existing: set, initials: str, seed: int) -> Iterator[Tuple[str, str]]:
+    # recorre las 10000 claves desde un offset aleatorio por corrida, saltando las ocupadas
+    offset = random.Random(seed).randrange(10000)
+    for i in range(10000):
+        code = f"{(offset + i) % 10000:04d}"
+        for ptype, prefix in (("externo", "EE"), ("interno", "EI")):
+            if f"{prefix}{code} {initials}" not in existing:
+                yield ptype, code
+
+SCENARIOS: Dict[str, Callable[[Worker], None]] = {
+    "login": sc_login,
+    "expediente": sc_expediente,
+    "expediente-async": sc_expediente_async,
+    "files": sc_files,
+    "search": sc_search,
+    "upload": sc_upload,
+    "upload-race": sc_upload_race,
+    "read-your-writes": sc_read_your_writes,
+    "download": sc_download,
+    "zip": sc_zip,
+    "create-project": sc_create_project,
+}
+
+
+# ================= Preparación, ejecución y reporte =================
+def _login(client: Client, username: str, password: str) -> Optional[str]:
+    body, headers = _form({"username": username, "password": password})
+    status, data, _ = client.request("POST", "/auth/login", body, headers)
+    return json.loads(data)["access_token"] if status == 200 else None
+
+def prepare(args) -> Context:
+    ctx = Context()
+    client = Client(args.base_url, args.timeout, None)
+    ctx.admin_token = _login(client, args.admin_user, args.password)
+    if not ctx.admin_token:
+        raise SystemExit(f"[ERROR] no se pudo iniciar sesión como {args.admin_user} (¿corriste `generate`?)")
+    for i in range(1, args.login_users + 1):
+        token = _login(client, f"{BENCH_USER}{i}", args.password)
+        if token:
+            ctx.users.append((f"{BENCH_USER}{i}", token))
+    if not ctx.users:
+        ctx.users.append((args.admin_user, ctx.admin_token))
+
+    def get(path: str, token: str):
+        status, data, _ = client.request("GET", path, headers={"Authorization": f"Bearer {token}"})
+        return json.loads(data) if status == 200 else None
+
+    bench = [p["id"] for p in get("/projects", ctx.admin_token) or [] if p["name"].startswith(BENCH_PREFIX)]
+    for pid in bench[:args.sample_projects]:
+        exp = get(f"/projects/{pid}/expediente", ctx.admin_token)
+        if not exp:
+            continue
+        delivs, files = [], []
+        for st in exp["stages"]:
+            for it in st["deliverables"]:
+                delivs.append({"project_id": pid, "stage_id": st["stage"]["id"], "key": it["key"], "multi": it["multi"],
+                               "ext": (it["allowed_ext"] or ["pdf"])[0]})
+                files.extend(f["id"] for f in it["files"])
+        ctx.deliverables[pid] = delivs
+        ctx.files[pid] = files
+        if ctx.race is None:
+            ctx.race = next((d for d in delivs if not d["multi"]), None)
+    for _, token in ctx.users:
+        ctx.visible[token] = [p["id"] for p in get("/projects", token) or []]
+    if "create-project" in args.scenarios:
+        existing = {p["code"] for p in get("/projects", ctx.admin_token) or []}
+        initials = ((get("/me", ctx.admin_token) or {}).get("initials") or BENCH_INITIALS).upper()
+        ctx.free_codes = _free_codes(existing, initials, time.time_ns())
+    ctx.visible[ctx.admin_token] = list(ctx.deliverables)
+    return ctx
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def _summarize(samples: List[Tuple[float, int, int]], errors: Dict[str, int], seconds: float) -> dict:
+    lat = sorted(s for s, _, _ in samples)
+    ok = sum(1 for _, st, _ in samples if st < 400)
+    return {
+        "count": len(samples),
+        "ok": ok,
+        "errors": dict(errors),
+        "throughput_rps": round(len(samples) / seconds, 2) if seconds else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * sum(lat) / len(lat), 2) if lat else 0.0,
+            **{f"p{q}": round(1000 * _percentile(lat, q), 2) for q in (50, 90, 95, 99)},
+            "max": round(1000 * lat[-1], 2) if lat else 0.0,
+        },
+        "bytes_avg": round(sum(b for _, _, b in samples) / len(samples)) if samples else 0,
+    }
+
+def _parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if name not in SCENARIOS:
+            raise SystemExit(f"[ERROR] escenario desconocido: {name} (disponibles: {', '.join(SCENARIOS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+def _check_race(args, ctx: Context) -> Optional[dict]:
+    race = ctx.race
+    if race is None:
+        return None
+    client = Client(args.base_url, args.timeout, None)
+    status, data, _ = client.request("GET", f"/projects/{race['project_id']}/expediente",
+                                     headers={"Authorization": f"Bearer {ctx.admin_token}"})
+    if status != 200:
+        return {"error": status}
+    files = next((it["files"] for st in json.loads(data)["stages"] if st["stage"]["id"] == race["stage_id"]
+                  for it in st["deliverables"] if it["key"] == race["key"]), [])
+    versions = sorted(f["version"] for f in files)
+    return {
+        "files": len(versions),
+        "unique_versions": len(versions) == len(set(versions)),
+        "gap_free": versions == list(range(versions[0], versions[0] + len(versions))) if versions else True,
+        "active": sum(1 for f in files if f["is_active"]),
+    }
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def run(args) -> dict:
+    mix = _parse_mix(args.scenarios)
+    ctx = prepare(args)
+    names, weights = zip(*mix)
+    started = time.monotonic()
+    warmup_until = started + args.warmup
+    deadline = warmup_until + args.duration
+    workers = [Worker(i, args, ctx, warmup_until) for i in range(args.concurrency)]
+
+    def loop(w: Worker):
+        done = 0
+        while time.monotonic() < deadline and (not args.requests or done < args.requests):
+            SCENARIOS[w.rng.choices(names, weights)[0]](w)
+            done += 1
+
+    threads = [threading.Thread(target=loop, args=(w,), daemon=True) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    measured = max(0.001, min(time.monotonic(), deadline) - warmup_until)
+
+    merged: Dict[str, list] = defaultdict(list)
+    errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for w in workers:
+        for name, s in w.samples.items():
+            merged[name].extend(s)
+        for name, errs in w.errors.items():
+            for k, v in errs.items():
+                errors[name][k] += v
+    total = sum(len(s) for s in merged.values())
+    result = {
+        "meta": {
+            "commit": _git_commit(), "base_url": args.base_url, "scenarios": args.scenarios,
+            "concurrency": args.concurrency, "duration_s": round(measured, 2), "warmup_s": args.warmup,
+            "accept_encoding": args.accept_encoding, "started_at": datetime.utcnow().isoformat(),
+            "rng_seed": args.rng_seed, "projects_sampled": len(ctx.deliverables),
+        },
+        "total": {"count": total, "throughput_rps": round(total / measured, 2)},
+        "requests": {name: _summarize(merged[name], errors.get(name, {}), measured) for name in sorted(merged)},
+        "checks": dict(ctx.checks),
+    }
+    if "upload-race" in names:
+        result["checks"]["upload_race"] = _check_race(args, ctx)
+    return result
+
+def compare(args):
+    a, b = (json.loads(Path(p).read_text()) for p in (args.baseline, args.candidate))
+
+    def delta(x: float, y: float) -> str:
+        return f"{100 * (y - x) / x:+.1f}%" if x else "n/a"
+
+    print(f"{'request':<52} {'p50 ms':>16} {'p99 ms':>16} {'req/s':>16}")
+    for name in sorted(set(a["requests"]) | set(b["requests"])):
+        ra, rb = a["requests"].get(name), b["requests"].get(name)
+        if not ra or not rb:
+            print(f"{name:<52} {'(sólo en uno de los dos)':>50}")
+            continue
+        la, lb = ra["latency_ms"], rb["latency_ms"]
+        print(f"{name:<52} {lb['p50']:>8} {delta(la['p50'], lb['p50']):>7} {lb['p99']:>8} {delta(la['p99'], lb['p99']):>7}"
+              f" {rb['throughput_rps']:>8} {delta(ra['throughput_rps'], rb['throughput_rps']):>7}")
+
+def _decode(data: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "gzip":
+        return zlib.decompress(data, 31)
+    if encoding == "br":
+        import brotli
+        return brotli.decompress(data)
+    return data
+
+def _time_render(fn: Callable[[], bytes], rounds: int) -> float:
+    fn()  # calentamiento
+    t0 = time.process_time()
+    for _ in range(rounds):
+        fn()
+    return 1000 * (time.process_time() - t0) / rounds
+
+def payload(args) -> dict:
+    """Mide las respuestas pesadas: bytes por codificación y ms de CPU al serializar."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    app = _app()
+    client = Client(args.base_url, args.timeout, None)
+    token = _login(client, args.admin_user, args.password)
+    if not token:
+        raise SystemExit(f"[ERROR] no se pudo iniciar sesión como {args.admin_user} (¿corriste `generate`?)")
+    auth = {"Authorization": f"Bearer {token}"}
+    status, data, _ = client.request("GET", "/projects", headers=auth)
+    bench = [p["id"] for p in json.loads(data) if p["name"].startswith(BENCH_PREFIX)] if status == 200 else []
+    encodings = [e.strip() for e in args.encodings.split(",")]
+
+    results = {}
+    for pid in bench[:args.projects]:
+        for label, path in ((f"expediente[{pid}]", f"/projects/{pid}/expediente"),
+                            (f"files[{pid}]", f"/projects/{pid}/files?limit={args.page_size}")):
+            entry: Dict[str, Any] = {"bytes": {}}
+            content = None
+            for enc in encodings:
+                client.accept_encoding = enc
+                status, data, headers = client.request("GET", path, headers=auth)
+                if status != 200:
+                    entry["bytes"][enc] = {"error": status}
+                    continue
+                served = headers.get("content-encoding")
+                entry["bytes"][enc] = {"bytes": len(data), "content_encoding": served}
+                if content is None:
+                    content = json.loads(_decode(data, served))
+            if content is not None:
+                plain = entry["bytes"].get("identity", {}).get("bytes") or len(json.dumps(content).encode())
+                for enc, b in entry["bytes"].items():
+                    if "bytes" in b:
+                        b["ratio"] = round(b["bytes"] / plain, 3)
+                std = _time_render(lambda: JSONResponse(jsonable_encoder(content)).body, args.rounds)
+                fast = _time_render(lambda: app.FastJSONResponse(content).body, args.rounds)
+                entry["serialize_ms"] = {"json+jsonable_encoder": round(std, 3), "fast": round(fast, 3),
+                                         "speedup": round(std / fast, 2) if fast else None}
+            results[label] = entry
+    client.accept_encoding = None
+    return {
+        "meta": {"commit": _git_commit(), "base_url": args.base_url, "orjson": app.orjson is not None,
+                 "brotli": app.brotli is not None, "rounds": args.rounds,
+                 "note": "serialize_ms: CPU por respuesta sobre el JSON ya decodificado (sin datetime/ORM)"},
+        "responses": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reproducible de la API (datos sintéticos + carga HTTP)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("generate", help="Carga datos sintéticos en la base y FILES_ROOT")
+    g.add_argument("--projects", type=int, default=100, help="Proyectos (alterna externo/interno)")
+    g.add_argument("--users", type=int, default=50, help="Colaboradores bench_u1..N (además de bench_admin)")
+    g.add_argument("--members", type=int, default=5, help="Miembros por proyecto")
+    g.add_argument("--versions", type=int, default=4, help="Máximo de versiones por entregable")
+    g.add_argument("--fill", type=float, default=0.8, help="Fracción de entregables con archivos")
+    g.add_argument("--info-files", type=int, default=50, help="Archivos de Información técnica por proyecto")
+    g.add_argument("--delete-requests", type=float, default=0.02, help="Fracción de archivos con borrado pendiente")
+    g.add_argument("--file-kb", type=int, default=64, help="Tamaño de cada archivo en disco")
+    g.add_argument("--words", type=int, default=200, help="Palabras de texto extraído por archivo")
+    g.add_argument("--no-disk", action="store_true", help="Sólo filas (escala de millones; las descargas fallan)")
+    g.add_argument("--password", default=BENCH_PASSWORD)
+    g.add_argument("--rng-seed", type=int, default=42)
+
+    r = sub.add_parser("run", help="Corre escenarios contra un servidor en marcha")
+    r.add_argument("--base-url", default="http://127.0.0.1:8000")
+    r.add_argument("--scenarios", default="expediente:3,files:3,search:1,download:1",
+                   help=f"Mezcla nombre[:peso],... de: {', '.join(SCENARIOS)}")
+    r.add_argument("--concurrency", type=int, default=20, help="Clientes concurrentes (hilos)")
+    r.add_argument("--duration", type=float, default=30, help="Segundos medidos")
+    r.add_argument("--warmup", type=float, default=5, help="Segundos previos sin medir")
+    r.add_argument("--requests", type=int, default=0, help="Tope de operaciones por cliente (0 = sin tope)")
+    r.add_argument("--timeout", type=float, default=60)
+    r.add_argument("--accept-encoding", default=None, help="p. ej. 'gzip, br' (se mide lo que viaja por el cable)")
+    r.add_argument("--admin-user", default=BENCH_ADMIN)
+    r.add_argument("--password", default=BENCH_PASSWORD)
+    r.add_argument("--login-users", type=int, default=20, help="Colaboradores con sesión durante la prueba")
+    r.add_argument("--sample-projects", type=int, default=50, help="Proyectos explorados para elegir objetivos")
+    r.add_argument("--page-size", type=int, default=200)
+    r.add_argument("--upload-kb", type=int, default=256)
+    r.add_argument("--zip-files", type=int, default=10)
+    r.add_argument("--rng-seed", type=int, default=42)
+    r.add_argument("--out", help="Guarda el JSON además de imprimirlo")
+
+    c = sub.add_parser("compare", help="Compara dos resultados de `run`")
+    c.add_argument("baseline")
+    c.add_argument("candidate")
+
+    pl = sub.add_parser("payload", help="Bytes por Accept-Encoding y CPU de serialización de las respuestas pesadas")
+    pl.add_argument("--base-url", default="http://127.0.0.1:8000")
+    pl.add_argument("--encodings", default="identity,gzip,br", help="Accept-Encoding a probar, separados por coma")
+    pl.add_argument("--projects", type=int, default=5, help="Proyectos [bench] medidos")
+    pl.add_argument("--page-size", type=int, default=200)
+    pl.add_argument("--rounds", type=int, default=50, help="Serializaciones por medición")
+    pl.add_argument("--timeout", type=float, default=60)
+    pl.add_argument("--admin-user", default=BENCH_ADMIN)
+    pl.add_argument("--password", default=BENCH_PASSWORD)
+    pl.add_argument("--out", help="Guarda el JSON además de imprimirlo")
+
+    sub.add_parser("cleanup", help="Borra proyectos [bench] y usuarios bench_*")
+
+    args = parser.parse_args()
+    if args.cmd == "generate":
+        generate(args)
+    elif args.cmd in ("run", "payload"):
+        result = run(args) if args.cmd == "run" else payload(args)
+        out = json.dumps(result, indent=2, ensure_ascii=False)
+        if args.out:
+            Path(args.out).write_text(out)
+        print(out)
+    elif args.cmd == "compare":
+        compare(args)
+    else:
+        cleanup(args)
+
+if __name__ == "__main__":
+    main()
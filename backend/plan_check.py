@@ -0,0 +1,198 @@
+# backend/plan_check.py
+# Verifica con EXPLAIN que las consultas principales de los endpoints usan índices.
+# Requiere PostgreSQL; --seed carga datos sintéticos (usar una base desechable).
+import sys, json, argparse
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import text
+
+from app import (
+    engine, IS_POSTGRES, SessionLocal, FileRecord, FileDeleteRequest, ProjectMember, User,
+    _encode_cursor, _keyset_stmt, _files_list_stmt, _files_page_stmt, _search_files_stmt, _snapshot_files_stmt,
+    _snapshot_pending_stmt, _active_version_stmt, _stage_file_counts_stmt, _pending_delete_stmt, _delete_queue_stmt,
+    _projects_stmt, _membership_stmt, _stages_stmt,
+)
+
+# tablas que crecen con el uso: un Seq Scan sobre ellas es una regresión
+WATCHED = {"files", "file_delete_requests", "project_members", "deliverables", "file_contents"}
+
+SEED_SQL = [
+    # usuarios
+    """
+    INSERT INTO users (username, password_hash, full_name, email, initials, role, can_create_projects, can_access_exptec, created_at)
+    SELECT 'plan_u' || g, 'x', 'Plan ' || g, 'plan' || g || '@example.com', 'PLN', 'colaborador', false, true,
+           now() - g * interval '1 minute'
+    FROM generate_series(1, :users) g
+    ON CONFLICT (username) DO NOTHING
+    """,
+    # proyectos
+    """
+    INSERT INTO projects (code, name, type, created_by, created_at)
+    SELECT 'PLAN' || lpad(g::text, 6, '0'), 'Proyecto sintético ' || g, 'externo',
+           (SELECT min(id) FROM users WHERE username LIKE 'plan_u%'), now() - g * interval '1 hour'
+    FROM generate_series(1, :projects) g
+    ON CONFLICT (code) DO NOTHING
+    """,
+    # 5 etapas por proyecto
+    """
+    INSERT INTO stages (project_id, code, name, order_index)
+    SELECT p.id, 'E' || s, 'Etapa ' || s, s
+    FROM projects p CROSS JOIN generate_series(1, 5) s
+    WHERE p.code LIKE 'PLAN%'
+    ON CONFLICT ON CONSTRAINT uq_stage_project_code DO NOTHING
+    """,
+    # 10 anclas de entregable por etapa
+    """
+    INSERT INTO deliverables (stage_id, key, title, required, multi, allowed_ext, order_index, last_version, is_override)
+    SELECT st.id, 'd' || d, 'Entregable ' || d, true, d % 2 = 0, 'pdf', d, 0, false
+    FROM stages st JOIN projects p ON p.id = st.project_id CROSS JOIN generate_series(1, 10) d
+    WHERE p.code LIKE 'PLAN%'
+    ON CONFLICT ON CONSTRAINT uq_deliverables_stage_key DO NOTHING
+    """,
+    # cada usuario es miembro de ~5 proyectos
+    """
+    INSERT INTO project_members (project_id, user_id, role)
+    SELECT p.id, u.id, 'viewer'
+    FROM users u JOIN projects p ON (p.id + u.id) % greatest(:projects / 5, 1) = 0
+    WHERE u.username LIKE 'plan_u%' AND p.code LIKE 'PLAN%'
+    ON CONFLICT ON CONSTRAINT uq_project_user DO NOTHING
+    """,
+    # archivos repartidos entre proyectos, etapas y entregables
+    """
+    WITH pp AS (
+        SELECT id, row_number() OVER (ORDER BY id) - 1 AS rn, count(*) OVER () AS n
+        FROM projects WHERE code LIKE 'PLAN%'
+    ), g AS (
+        SELECT g, (g % (SELECT max(n) FROM pp)) AS rn FROM generate_series(1, :files) g
+    )
+    INSERT INTO files (project_id, stage_id, deliverable_id, filename, path, size_bytes, content_type,
+                       uploaded_by, uploaded_at, is_active, version)
+    SELECT pp.id, st.id, d.id, 'archivo_' || g.g || '.pdf', '/dev/null', 1024, 'application/pdf',
+           (SELECT min(id) FROM users WHERE username LIKE 'plan_u%'),
+           now() - g.g * interval '1 second', g.g % 3 = 0, 1 + g.g % 3
+    FROM g
+    JOIN pp ON pp.rn = g.rn
+    JOIN stages st ON st.project_id = pp.id AND st.code = 'E' || (1 + g.g % 5)
+    JOIN deliverables d ON d.stage_id = st.id AND d.key = 'd' || (1 + g.g % 10)
+    """,
+    # ~1% de los archivos con solicitud de borrado (la mitad pendiente)
+    """
+    INSERT INTO file_delete_requests (file_id, requested_by, reason, status, requested_at)
+    SELECT f.id, f.uploaded_by, 'sintética', CASE WHEN f.id % 2 = 0 THEN 'pending' ELSE 'rejected' END, f.uploaded_at
+    FROM files f JOIN projects p ON p.id = f.project_id
+    WHERE p.code LIKE 'PLAN%' AND f.id % 100 = 0
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+CLEANUP_SQL = [
+    "DELETE FROM file_delete_requests WHERE file_id IN (SELECT f.id FROM files f JOIN projects p ON p.id = f.project_id WHERE p.code LIKE 'PLAN%')",
+    "DELETE FROM files WHERE project_id IN (SELECT id FROM projects WHERE code LIKE 'PLAN%')",
+    "DELETE FROM deliverables WHERE stage_id IN (SELECT s.id FROM stages s JOIN projects p ON p.id = s.project_id WHERE p.code LIKE 'PLAN%')",
+    "DELETE FROM stages WHERE project_id IN (SELECT id FROM projects WHERE code LIKE 'PLAN%')",
+    "DELETE FROM project_members WHERE project_id IN (SELECT id FROM projects WHERE code LIKE 'PLAN%')",
+    "DELETE FROM projects WHERE code LIKE 'PLAN%'",
+    "DELETE FROM users WHERE username LIKE 'plan_u%'",
+]
+
+
+def seed(files: int, projects: int, users: int):
+    params = {"files": files, "projects": projects, "users": users}
+    with engine.begin() as conn:
+        for stmt in SEED_SQL:
+            conn.execute(text(stmt), params)
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE"))
+
+def cleanup():
+    with engine.begin() as conn:
+        for stmt in CLEANUP_SQL:
+            conn.execute(text(stmt))
+
+def sample_params(db) -> Dict[str, Any]:
+    # una fila real para parametrizar las consultas
+    f = db.query(FileRecord).filter(FileRecord.deliverable_id.isnot(None)).order_by(FileRecord.id.desc()).first()
+    m = db.query(ProjectMember).join(User, User.id == ProjectMember.user_id)\
+        .filter(User.role == "colaborador").order_by(ProjectMember.id.desc()).first()
+    if f is None or m is None:
+        raise SystemExit("Sin datos: ejecuta con --seed en una base desechable")
+    return {"project_id": f.project_id, "stage_id": f.stage_id, "deliverable_id": f.deliverable_id,
+            "file_id": f.id, "uploaded_at": f.uploaded_at, "member": db.get(User, m.user_id), "admin": User(id=0, role="admin")}
+
+def queries(p: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """Consultas principales de cada endpoint, con los mismos constructores que usa app.py."""
+    recent = [FileRecord.uploaded_at, FileRecord.id]
+    cursor = _encode_cursor(p["uploaded_at"], p["file_id"])
+    files_list, _ = _files_list_stmt(p["project_id"], None)
+    return [
+        ("GET /projects/{id}/files (1a página)",
+         _files_page_stmt(files_list, None, "recent", None, 50, 0)[0]),
+        ("GET /projects/{id}/files (cursor)",
+         _files_page_stmt(files_list, None, "recent", cursor, 50, 0)[0]),
+        ("GET /files/search (admin, recientes)",
+         _keyset_stmt(_search_files_stmt(p["admin"]), recent, (datetime, int), None, 50)),
+        ("GET /files/search (colaborador)",
+         _keyset_stmt(_search_files_stmt(p["member"]), recent, (datetime, int), None, 50)),
+        ("GET /projects/{id}/expediente (archivos)", _snapshot_files_stmt(p["project_id"])),
+        ("GET /projects/{id}/expediente (borrados pendientes)", _snapshot_pending_stmt(p["project_id"])),
+        ("GET /projects/{id}/progress (archivos por etapa)", _stage_file_counts_stmt(p["project_id"])),
+        ("POST /upload/expediente (activo vigente)", _active_version_stmt(p["deliverable_id"])),
+        ("POST /files/{id}/request-delete (pendiente)", _pending_delete_stmt(p["file_id"])),
+        ("GET /file-delete-requests (cola)",
+         _keyset_stmt(_delete_queue_stmt(), [FileDeleteRequest.requested_at, FileDeleteRequest.id], (datetime, int),
+                      None, 50, descending=False)),
+        ("GET /projects (colaborador)", _projects_stmt(p["member"])),
+        ("ensure_member (membresía)", _membership_stmt(p["project_id"], p["member"].id)),
+        ("GET /projects/{id}/stages", _stages_stmt(p["project_id"])),
+    ]
+
+def _seq_scans(node: Dict[str, Any]) -> List[str]:
+    found = []
+    if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in WATCHED:
+        found.append(node["Relation Name"])
+    for child in node.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+def explain(conn, stmt) -> Dict[str, Any]:
+    compiled = stmt.compile(dialect=engine.dialect)
+    plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica que las consultas principales usan índices (EXPLAIN)")
+    parser.add_argument("--seed", action="store_true", help="Carga datos sintéticos antes de revisar")
+    parser.add_argument("--files", type=int, default=1_000_000, help="Archivos sintéticos con --seed")
+    parser.add_argument("--projects", type=int, default=2_000, help="Proyectos sintéticos con --seed")
+    parser.add_argument("--users", type=int, default=500, help="Usuarios sintéticos con --seed")
+    parser.add_argument("--cleanup", action="store_true", help="Borra los datos sintéticos al terminar")
+    parser.add_argument("--json", action="store_true", help="Imprime los planes completos")
+    args = parser.parse_args()
+
+    if not IS_POSTGRES:
+        print("[ERROR] plan_check requiere PostgreSQL (DATABASE_URL)", file=sys.stderr); sys.exit(2)
+    if args.seed:
+        seed(args.files, args.projects, args.users)
+
+    failed = 0
+    with SessionLocal() as db, engine.connect() as conn:
+        p = sample_params(db)
+        for name, stmt in queries(p):
+            plan = explain(conn, stmt)
+            seqs = _seq_scans(plan)
+            status = "FAIL" if seqs else "OK"
+            failed += bool(seqs)
+            detail = f" (Seq Scan: {', '.join(sorted(set(seqs)))})" if seqs else ""
+            print(f"[{status}] {name}: {plan['Node Type']}, costo {plan['Total Cost']}{detail}")
+            if args.json:
+                print(json.dumps(plan, indent=2))
+
+    if args.cleanup:
+        cleanup()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# backend/reconcile_storage.py
+import sys, json, argparse
+
+from app import RECONCILE_WORKERS, StorageReport, SessionLocal, run_reconcile_report, reconcile_storage
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcilia FILES_ROOT/projects con la tabla files")
+    parser.add_argument("--full", action="store_true", help="Revisa todas las carpetas (no sólo las modificadas)")
+    parser.add_argument("--workers", type=int, default=None, help="Hilos de os.scandir en paralelo")
+    parser.add_argument("--save", action="store_true", help="Guarda el resultado en storage_reports (visible en la API)")
+    args = parser.parse_args()
+
+    workers = args.workers or RECONCILE_WORKERS
+    if args.save:
+        with SessionLocal() as db:
+            rep = StorageReport(mode="full" if args.full else "incremental", status="running")
+            db.add(rep); db.commit()
+            report_id = rep.id
+        run_reconcile_report(report_id, args.full, workers=workers)
+        with SessionLocal() as db:
+            rep = db.get(StorageReport, report_id)
+            print(rep.summary or rep.error)
+            sys.exit(0 if rep.status == "done" else 1)
+
+    summary = reconcile_storage(full=args.full, workers=workers)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    sys.exit(1 if summary["orphans"] or summary["missing"] or summary["size_mismatch"] or summary["stale_uploads"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 # backend/seed_deliverables.py
-import os, sys, argparse
-from typing import Dict, Any, List
-from sqlalchemy import create_engine
+import os, sys, json, hashlib, argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Tuple, Optional
+from sqlalchemy import create_engine, select, insert, delete, exists, false, literal_column, or_
 from sqlalchemy.orm import sessionmaker
 
 # Importa tus modelos desde app.py
-from app import Base, Project, Stage, DeliverableSpec, engine as app_engine
+from app import (
+    Base, Project, Stage, DeliverableSpec, FileRecord, ChecklistTemplate, TemplateStage, TemplateDeliverable,
+    engine as app_engine, dialect_insert, IS_POSTGRES, SPEC_FIELDS, TEMPLATE_CACHE, template_tree,
+)
 
 # ---------- SEED (idéntico al aprobado) ----------
 SEED = {
@@ -479,77 +483,205 @@ SEED = {
 }
 
 
+STAGE_FIELDS = ("name", "order_index")
+
+
 def get_session():
     # reutilizamos el engine de app para evitar dobles configs
     SessionLocal = sessionmaker(bind=app_engine, autoflush=False, autocommit=False)
     return SessionLocal()
 
-def ensure_stage(db, project_id: int, code: str, name: str, order: int) -> Stage:
-    s = db.query(Stage).filter(Stage.project_id==project_id, Stage.code==code).first()
-    if s:  # update name/order si difieren
-        changed = False
-        if s.name != name: s.name, changed = name, True
-        if s.order_index != order: s.order_index, changed = order, True
-        if changed: db.add(s); db.flush()
-        return s
-    s = Stage(project_id=project_id, code=code, name=name, order_index=order)
-    db.add(s); db.flush()
-    return s
-
-def ensure_deliverable(db, stage_id: int, d: Dict[str, Any]) -> DeliverableSpec:
-    row = db.query(DeliverableSpec).filter(
-        DeliverableSpec.stage_id == stage_id,
-        DeliverableSpec.key == d["key"]
-    ).first()
-    allowed_ext_csv = ",".join(d["allowed_ext"])
-    if row:
-        # idempotente: actualiza metadata si cambió
-        row.title = d["title"]
-        row.required = bool(d["required"])
-        row.multi = bool(d["multi"])
-        row.allowed_ext = allowed_ext_csv
-        row.order_index = int(d.get("order", 0))
-        row.optional_group = d.get("optional_group")
-        db.add(row)
-        return row
-    row = DeliverableSpec(
-        stage_id=stage_id,
-        key=d["key"],
-        title=d["title"],
-        required=bool(d["required"]),
-        multi=bool(d["multi"]),
-        allowed_ext=allowed_ext_csv,
-        order_index=int(d.get("order", 0)),
-        optional_group=d.get("optional_group")
-    )
-    db.add(row)
-    return row
-
-def seed_project(db, project: Project) -> Dict[str, int]:
+def project_kind(project: Project) -> str:
     code_up = (project.code or "").strip().upper()
     kind = "externo" if code_up.startswith("EE") else "interno"
     if kind not in SEED:
         raise RuntimeError(f"SEED no tiene la clave '{kind}'. Claves disponibles: {list(SEED.keys())}")
-    data = SEED[kind]["stages"]
+    return kind
+
+def template_checksum(kind: str) -> str:
+    return hashlib.sha256(json.dumps(SEED[kind], sort_keys=True).encode()).hexdigest()
 
-    created_stages = 0
-    created_delivs = 0
+def latest_template(db, kind: str) -> Optional[ChecklistTemplate]:
+    return db.query(ChecklistTemplate).filter(ChecklistTemplate.kind == kind)\
+        .order_by(ChecklistTemplate.version.desc()).first()
 
-    for st in data:
-        stage = ensure_stage(db, project.id, st["code"], st["name"], st["order"])
-        if db.is_modified(stage, include_collections=False):
-            pass  # stage updated
-        delivs = st.get("deliverables", [])
-        before = db.query(DeliverableSpec).filter(DeliverableSpec.stage_id==stage.id).count()
-        for d in delivs:
-            ensure_deliverable(db, stage.id, d)
-        after = db.query(DeliverableSpec).filter(DeliverableSpec.stage_id==stage.id).count()
-        if after > before:
-            created_delivs += (after - before)
+def template_deliverable_rows(stage_ids: Dict[str, int], kind: str) -> List[Dict[str, Any]]:
+    rows = []
+    for st in SEED[kind]["stages"]:
+        for d in st.get("deliverables", []):
+            rows.append({
+                "template_stage_id": stage_ids[st["code"]],
+                "key": d["key"],
+                "title": d["title"],
+                "required": bool(d["required"]),
+                "multi": bool(d["multi"]),
+                "allowed_ext": ",".join(d["allowed_ext"]),
+                "order_index": int(d.get("order", 0)),
+                "optional_group": d.get("optional_group"),
+            })
+    return rows
+
+def sync_templates(db, commit: bool = True) -> Dict[str, int]:
+    """Registra una versión nueva de plantilla por tipo cuando el SEED cambió. Devuelve {tipo: template_id}."""
+    out = {}
+    for kind in SEED:
+        checksum = template_checksum(kind)
+        cur = latest_template(db, kind)
+        if cur is not None and cur.checksum == checksum:
+            out[kind] = cur.id
+            continue
+        tpl = ChecklistTemplate(kind=kind, version=(cur.version + 1) if cur else 1, checksum=checksum)
+        db.add(tpl)
         db.flush()
+        stage_ids = dict(db.execute(
+            insert(TemplateStage).values([
+                {"template_id": tpl.id, "code": st["code"], "name": st["name"], "order_index": st["order"]}
+                for st in SEED[kind]["stages"]
+            ]).returning(TemplateStage.code, TemplateStage.id)
+        ).all())
+        rows = template_deliverable_rows(stage_ids, kind)
+        if rows:
+            db.execute(insert(TemplateDeliverable).values(rows))
+        out[kind] = tpl.id
+    if commit:
+        db.commit()
+    return out
+
+def upsert(db, model, rows: List[Dict[str, Any]], conflict: Tuple[str, ...], fields: Tuple[str, ...]) -> Tuple[int, int]:
+    """INSERT ... ON CONFLICT DO UPDATE sólo cuando algún campo cambió. Devuelve (creados, actualizados)."""
+    if not rows:
+        return 0, 0
+    existing = None
+    if not IS_POSTGRES:
+        # sin xmax: se distinguen altas de cambios con las llaves que ya existían
+        keys = [getattr(model, c) for c in conflict]
+        scope = {r[conflict[0]] for r in rows}
+        existing = {tuple(r) for r in db.execute(select(*keys).where(keys[0].in_(scope)))}
+    stmt = dialect_insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(conflict),
+        set_={f: stmt.excluded[f] for f in fields},
+        where=or_(*[getattr(model, f).is_distinct_from(stmt.excluded[f]) for f in fields]),
+    )
+    if IS_POSTGRES:
+        # xmax = 0 sólo en filas recién insertadas; las no modificadas no regresan
+        flags = db.execute(stmt.returning(literal_column("(xmax = 0)"))).scalars().all()
+        created = sum(1 for f in flags if f)
+        return created, len(flags) - created
+    returned = db.execute(stmt.returning(*[getattr(model, c) for c in conflict])).all()
+    created = sum(1 for r in returned if tuple(r) not in existing)
+    return created, len(returned) - created
+
+def _link_rows(db, project: Project, tree: dict, changes: List[str]) -> Tuple[int, int]:
+    """Enlaza las filas del proyecto con los entregables de la plantilla fijada.
+    Las copias heredadas de la siembra anterior sólo quedan como override si divergen de la plantilla."""
+    linked = overrides = 0
+    rows = db.query(Stage.code, DeliverableSpec)\
+        .join(DeliverableSpec, DeliverableSpec.stage_id == Stage.id)\
+        .filter(Stage.project_id == project.id).all()
+    for code, row in rows:
+        d = tree["by_key"].get((code, row.key))
+        if d is None or row.template_deliverable_id == d["id"]:
+            continue  # entregable propio del proyecto, o ya enlazado
+        if row.template_deliverable_id is None:
+            diff = [f for f in SPEC_FIELDS if getattr(row, f) != d[f]]
+            row.is_override = bool(diff)
+            if diff:
+                overrides += 1
+                changes.append(f"override {code}/{row.key}: {', '.join(diff)}")
+        row.template_deliverable_id = d["id"]
+        linked += 1
+        changes.append(f"link {code}/{row.key}")
+    db.flush()
+    return linked, overrides
+
+def _prune_rows(db, project: Project) -> int:
+    """Borra las filas que sólo repiten la plantilla: sin override, sin archivos y sin versiones emitidas."""
+    res = db.execute(
+        delete(DeliverableSpec).where(
+            DeliverableSpec.stage_id.in_(select(Stage.id).where(Stage.project_id == project.id)),
+            DeliverableSpec.template_deliverable_id.isnot(None),
+            DeliverableSpec.is_override == false(),
+            DeliverableSpec.last_version == 0,
+            ~exists().where(FileRecord.deliverable_id == DeliverableSpec.id),
+        ).execution_options(synchronize_session=False)
+    )
+    return res.rowcount or 0
 
-    db.commit()
-    return {"created_stages": created_stages, "created_deliverables": created_delivs}
+def seed_project(db, project: Project, commit: bool = True, upgrade: bool = False) -> Dict[str, Any]:
+    """Fija la plantilla del proyecto (la vigente si no tenía o con upgrade), crea sus etapas y
+    reduce las filas de entregables a anclas con archivos y overrides."""
+    kind = project_kind(project)
+    changes: List[str] = []
+    template_id = project.template_id
+    if template_id is None or upgrade:
+        template_id = sync_templates(db, commit=False)[kind]
+    if template_id != project.template_id:
+        changes.append(f"plantilla #{project.template_id} -> #{template_id}")
+        project.template_id = template_id
+    tree = template_tree(db, template_id)
+
+    created_stages, updated_stages = upsert(
+        db, Stage,
+        [{"project_id": project.id, "code": st["code"], "name": st["name"], "order_index": st["order_index"]}
+         for st in tree["stages"]],
+        ("project_id", "code"), STAGE_FIELDS,
+    )
+    if created_stages or updated_stages:
+        changes.append(f"etapas: {created_stages} nuevas, {updated_stages} actualizadas")
+    linked, overrides = _link_rows(db, project, tree, changes)
+    pruned = _prune_rows(db, project)
+    if pruned:
+        changes.append(f"prune: {pruned} filas redundantes")
+    if commit:
+        db.commit()
+    return {
+        "template_id": template_id,
+        "created_stages": created_stages,
+        "updated_stages": updated_stages,
+        "linked_deliverables": linked,
+        "overrides": overrides,
+        "pruned_deliverables": pruned,
+        "changes": changes,
+    }
+
+def ensure_templates(db) -> Dict[str, int]:
+    """Arranque de la app: plantilla vigente registrada y proyectos existentes fijados (una sola vez)."""
+    ids = sync_templates(db)
+    pending = db.query(Project).filter(Project.template_id.is_(None), Project.deleted_at.is_(None)).all()
+    for p in pending:
+        try:
+            seed_project(db, p)
+        except Exception as e:
+            db.rollback()
+            print(f"WARN plantilla proyecto {p.code}:", e)
+    return ids
+
+def _seed_one(project_id: int, dry_run: bool, upgrade: bool) -> Tuple[str, Dict[str, Any]]:
+    # una sesión y una transacción por proyecto (modo --all en paralelo)
+    db = get_session()
+    try:
+        p = db.get(Project, project_id)
+        code = p.code
+        res = seed_project(db, p, commit=not dry_run, upgrade=upgrade)
+        if dry_run:
+            db.rollback()
+            TEMPLATE_CACHE.pop(res["template_id"], None)  # pudo ser una versión que no se guardó
+        return code, res
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _report(code: str, res: Dict[str, Any], dry_run: bool):
+    changes = res.pop("changes")
+    if not dry_run:
+        print(f"[OK] {code}: {res}")
+        return
+    print(f"[DRY-RUN] {code}: {len(changes)} cambios")
+    for line in changes:
+        print(f"  ~ {line}")
 
 def main():
     parser = argparse.ArgumentParser(description="Seed Expediente IMT deliverables")
@@ -557,32 +689,52 @@ def main():
     group.add_argument("--all", action="store_true", help="Sembrar en todos los proyectos")
     group.add_argument("--project-id", type=int, help="Sembrar en un proyecto por ID")
     group.add_argument("--project-code", type=str, help="Sembrar en un proyecto por código")
+    group.add_argument("--templates", action="store_true", help="Sólo registrar la versión vigente de las plantillas")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra las diferencias sin escribir")
+    parser.add_argument("--upgrade", action="store_true", help="Mueve los proyectos a la última versión de plantilla")
+    parser.add_argument("--workers", type=int, default=4, help="Proyectos en paralelo con --all")
     args = parser.parse_args()
 
     db = get_session()
 
+    if args.templates:
+        for kind, tid in sync_templates(db, commit=not args.dry_run).items():
+            print(f"[OK] plantilla {kind}: #{tid}")
+        return
+
     if args.all:
-        projects = db.query(Project).all()
-        for p in projects:
-            res = seed_project(db, p)
-            print(f"[OK] {p.code}: {res}")
+        # la versión nueva (si la hay) se registra antes, para que los workers no compitan por crearla
+        if not args.dry_run:
+            sync_templates(db)
+        ids = [pid for (pid,) in db.query(Project.id).filter(Project.deleted_at.is_(None)).order_by(Project.id)]
+        db.close()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {pool.submit(_seed_one, pid, args.dry_run, args.upgrade): pid for pid in ids}
+            for fut in as_completed(futures):
+                try:
+                    code, res = fut.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"[ERROR] Proyecto id={futures[fut]}: {e}", file=sys.stderr)
+                    continue
+                _report(code, res, args.dry_run)
+        if failed:
+            sys.exit(1)
         return
 
     if args.project_id:
         p = db.get(Project, args.project_id)
         if not p:
             print(f"[ERROR] Proyecto id={args.project_id} no existe", file=sys.stderr); sys.exit(1)
-        res = seed_project(db, p)
-        print(f"[OK] {p.code}: {res}")
-        return
-
-    if args.project_code:
+    else:
         p = db.query(Project).filter(Project.code == args.project_code).first()
         if not p:
             print(f"[ERROR] Proyecto code={args.project_code} no existe", file=sys.stderr); sys.exit(1)
-        res = seed_project(db, p)
-        print(f"[OK] {p.code}: {res}")
-        return
+    pid = p.id
+    db.close()
+    code, res = _seed_one(pid, args.dry_run, args.upgrade)
+    _report(code, res, args.dry_run)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+# backend/tests/conftest.py
+# Pruebas contra SQLite temporal: la configuración de app.py se lee al importarlo,
+# así que el entorno se fija antes del import.
+import io
+import os
+import sys
+import itertools
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TMP = Path(tempfile.mkdtemp(prefix="expedientes-tests-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP / 'db.sqlite'}"
+os.environ["FILES_ROOT"] = str(_TMP / "data")
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ.setdefault("SCRUB_ENABLE", "false")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app as A  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+_codes = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(A.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    client.post("/auth/register", data=dict(username="admin", password="x", full_name="Admin",
+                                            email="admin@example.com", initials="ADM"))
+    token = client.post("/auth/login", data=dict(username="admin", password="x")).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def project(client, admin_headers):
+    r = client.post("/projects", data=dict(code=f"{next(_codes):04d}", name="Prueba", type="externo"),
+                    headers=admin_headers)
+    assert r.status_code in (200, 201), r.text
+    return r.json()
+
+
+@pytest.fixture
+def upload(client, admin_headers):
+    def _upload(project: dict, stage: int = 0, item: int = 0, name: str = "doc.pdf", body: bytes = b"%PDF prueba"):
+        exp = client.get(f"/projects/{project['id']}/expediente", headers=admin_headers).json()
+        st = exp["stages"][stage]
+        r = client.post("/upload/expediente",
+                        data=dict(project_id=project["id"], stage_id=st["stage"]["id"],
+                                  deliverable_key=st["deliverables"][item]["key"], reason="prueba"),
+                        files={"file": (name, io.BytesIO(body), "application/pdf")}, headers=admin_headers)
+        assert r.status_code == 200, r.text
+        return r.json()["file"]
+    return _upload
@@ -0,0 +1,62 @@
+# Scrubber de integridad: el hash de cada archivo corre sin conexión ni transacción abierta.
+import hashlib
+import threading
+
+from sqlalchemy import event
+
+import app as A
+
+
+def test_scrub_batch_hashes_without_holding_a_connection(client, admin_headers, project, upload, monkeypatch):
+    good = upload(project, name="bueno.pdf", body=b"%PDF contenido bueno")
+    bad = upload(project, item=1, name="malo.pdf", body=b"%PDF contenido malo")
+    with A.SessionLocal() as db:
+        A.Path(db.get(A.FileRecord, bad["id"]).path).write_bytes(b"alterado")
+        db.query(A.FileRecord).update({A.FileRecord.verified_at: A.datetime(2000, 1, 1)})
+        db.query(A.FileRecord).filter(A.FileRecord.id.in_([good["id"], bad["id"]])).update(
+            {A.FileRecord.verified_at: None}, synchronize_session=False)
+        db.commit()
+
+    # conexiones tomadas por este hilo (el del scrubber): el indexador y el reaper usan el mismo pool
+    me = threading.get_ident()
+    held = {"n": 0}
+
+    def on_checkout(*_):
+        if threading.get_ident() == me:
+            held["n"] += 1
+
+    def on_checkin(*_):
+        if threading.get_ident() == me:
+            held["n"] -= 1
+
+    checked_out = []
+    real_hash = A._hash_file
+
+    def spy(path, throttle=None):
+        checked_out.append(held["n"])
+        return real_hash(path, throttle)
+
+    monkeypatch.setattr(A, "_hash_file", spy)
+    event.listen(A.engine, "checkout", on_checkout)
+    event.listen(A.engine, "checkin", on_checkin)
+    try:
+        assert A._IntegrityScrubber(batch=2)._scrub_batch() is True
+    finally:
+        event.remove(A.engine, "checkout", on_checkout)
+        event.remove(A.engine, "checkin", on_checkin)
+    assert checked_out == [0, 0]
+
+    with A.SessionLocal() as db:
+        assert db.get(A.FileRecord, good["id"]).verify_status == "ok"
+        assert db.get(A.FileRecord, bad["id"]).verify_status == "mismatch"
+
+
+def test_verify_fills_missing_sha256(client, admin_headers, project, upload):
+    f = upload(project, name="sin_hash.pdf", body=b"%PDF sin hash")
+    with A.SessionLocal() as db:
+        db.get(A.FileRecord, f["id"]).sha256 = None
+        db.commit()
+    r = client.post(f"/admin/integrity/{f['id']}/verify", headers=admin_headers)
+    assert r.status_code == 200 and r.json()["status"] == "ok"
+    with A.SessionLocal() as db:
+        assert db.get(A.FileRecord, f["id"]).sha256 == hashlib.sha256(b"%PDF sin hash").hexdigest()
@@ -0,0 +1,12 @@
+# /metrics no es público: token del scraper o JWT de admin.
+import app as A
+
+
+def test_metrics_requires_token_or_admin(client, admin_headers, monkeypatch):
+    monkeypatch.setattr(A, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=admin_headers).status_code == 200
+
+    monkeypatch.setattr(A, "METRICS_TOKEN", "scrape-secreto")
+    assert client.get("/metrics", headers={"Authorization": "Bearer otro"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secreto"}).status_code == 200
@@ -0,0 +1,94 @@
+# Paginación keyset: empates en la clave de orden no deben saltar ni repetir filas.
+from datetime import datetime
+
+import app as A
+
+
+def _add_files(project: dict, names: list) -> list:
+    # filas directas: mismo uploaded_at para forzar empates también en el orden "recent"
+    when = datetime(2024, 1, 1, 12, 0, 0)
+    with A.SessionLocal() as db:
+        recs = [A.FileRecord(project_id=project["id"], filename=n, size_bytes=1, content_type="application/pdf",
+                             path=str(A.FILES_ROOT / "projects" / project["code"] / n), uploaded_at=when)
+                for n in names]
+        db.add_all(recs)
+        db.commit()
+        return [r.id for r in recs]
+
+
+def _walk(client, headers, url: str, params: dict) -> list:
+    seen, cursor = [], None
+    for _ in range(100):
+        r = client.get(url, params={**params, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        seen.extend(i["id"] for i in body["items"])
+        cursor = body["next_cursor"]
+        if not cursor:
+            return seen
+    raise AssertionError("la paginación no termina")
+
+
+def test_relevance_pages_through_ties(client, admin_headers, project):
+    # tres grupos de nombres: dentro de cada grupo la similitud es idéntica
+    ids = _add_files(project, ["plano.pdf"] * 7 + ["plano_final.pdf"] * 6 + ["otro plano v2.pdf"] * 5 + ["memoria.pdf"] * 3)
+    expected = set(ids[:18])
+    for prefix in ("", "/async"):
+        for limit in (1, 3, 4):
+            seen = _walk(client, admin_headers, f"{prefix}/projects/{project['id']}/files",
+                         {"q": "plano", "sort": "relevance", "limit": limit})
+            assert len(seen) == len(set(seen)), f"duplicados con limit={limit} {prefix}"
+            assert set(seen) == expected, f"huecos con limit={limit} {prefix}"
+
+
+def test_recent_pages_through_equal_timestamps(client, admin_headers, project):
+    ids = _add_files(project, [f"acta_{i}.pdf" for i in range(11)])
+    seen = _walk(client, admin_headers, f"/projects/{project['id']}/files", {"limit": 4})
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_user_search_cursor_is_exact(client, admin_headers):
+    for i in range(6):
+        client.post("/users", data=dict(username=f"empate{i}", password="x", full_name="E", email=f"e{i}@x",
+                                        initials="EMP"), headers=admin_headers)
+    seen, cursor = [], None
+    while True:
+        r = client.get("/users", params={"q": "empate", "limit": 2, **({"cursor": cursor} if cursor else {})},
+                       headers=admin_headers)
+        assert r.status_code == 200, r.text
+        seen.extend(u["username"] for u in r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert sorted(seen) == [f"empate{i}" for i in range(6)]
+
+
+def test_recent_pages_through_server_timestamps(client, admin_headers, project, upload):
+    # uploaded_at lo pone la base (func.now()): varias cargas caen en el mismo segundo
+    ids = [upload(project, name=f"v{i}.pdf")["id"] for i in range(5)]
+    seen = _walk(client, admin_headers, f"/projects/{project['id']}/files", {"limit": 2})
+    assert sorted(seen) == sorted(ids) and len(seen) == len(set(seen))
+    seen = []
+    cursor = None
+    while True:
+        params = {"q": "v", "limit": 2, **({"cursor": cursor} if cursor else {})}
+        body = client.get("/files/search", params=params, headers=admin_headers).json()
+        seen.extend(i["id"] for i in body["items"] if i["id"] in ids)
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(ids)
+
+
+def test_name_index_sees_renames(client, project):
+    fid, = _add_files(project, ["renombre_antiguo.pdf"])
+    with A.SessionLocal() as db:
+        assert fid in A._FILENAME_INDEX.search(db, "renombre_antiguo")
+        db.get(A.FileRecord, fid).filename = "renombre_nuevo.pdf"
+        db.commit()
+        assert fid not in A._FILENAME_INDEX.search(db, "renombre_antiguo")
+        assert fid in A._FILENAME_INDEX.search(db, "renombre_nuevo")
+
+        db.execute(A.update(A.FileRecord).where(A.FileRecord.id == fid).values(filename="renombre_masivo.pdf"))
+        db.commit()
+        assert fid in A._FILENAME_INDEX.search(db, "renombre_masivo")
@@ -0,0 +1,46 @@
+# Aprobación de solicitudes de borrado de proyecto: solicitud y purga cambian juntas o no cambian.
+from datetime import datetime
+
+import app as A
+
+
+def _request_for(project: dict) -> int:
+    with A.SessionLocal() as db:
+        admin = db.query(A.User).filter(A.User.username == "admin").one()
+        req = A.ProjectDeleteRequest(project_id=project["id"], requested_by=admin.id, reason="prueba", status="pending")
+        db.add(req)
+        db.commit()
+        return req.id
+
+
+def test_approve_missing_project_leaves_request_pending(client, admin_headers, project):
+    req_id = _request_for(project)
+    with A.SessionLocal() as db:
+        db.get(A.Project, project["id"]).deleted_at = datetime.utcnow()  # tombstone sin trabajo de purga
+        db.commit()
+
+    r = client.post(f"/project-delete-requests/{req_id}/approve", headers=admin_headers)
+    assert r.status_code == 404
+
+    with A.SessionLocal() as db:
+        assert db.get(A.ProjectDeleteRequest, req_id).status == "pending"
+        assert db.query(A.ProjectPurge).filter(A.ProjectPurge.project_id == project["id"]).count() == 0
+
+
+def test_approve_creates_purge_job(client, admin_headers, project):
+    req_id = _request_for(project)
+    r = client.post(f"/project-delete-requests/{req_id}/approve", headers=admin_headers)
+    assert r.status_code == 200, r.text
+    with A.SessionLocal() as db:
+        job = db.get(A.ProjectPurge, r.json()["purge_id"])
+        assert job is not None and job.project_id == project["id"]
+
+
+def test_bulk_download_of_tombstoned_project_is_404(client, admin_headers, project, upload):
+    f = upload(project)
+    url = f"/projects/{project['id']}/files/bulk-download"
+    assert client.post(url, json={"ids": [f["id"]]}, headers=admin_headers).status_code == 200
+    with A.SessionLocal() as db:
+        db.get(A.Project, project["id"]).deleted_at = datetime.utcnow()
+        db.commit()
+    assert client.post(url, json={"ids": [f["id"]]}, headers=admin_headers).status_code == 404
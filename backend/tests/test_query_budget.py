@@ -0,0 +1,90 @@
+# Presupuesto de consultas por endpoint, detector de N+1 y assert_max_queries.
+import pytest
+
+import app as A
+
+
+def _endpoint(path: str, method: str = "GET"):
+    return next(r.endpoint for r in A.app.routes if getattr(r, "path", None) == path and method in r.methods)
+
+
+def _count(counter, **labels) -> float:
+    return counter._values.get(counter._key(labels), 0)
+
+
+def test_within_budget_is_untouched(client, admin_headers, project, monkeypatch):
+    monkeypatch.setattr(A, "QUERY_BUDGET_ENFORCE", True)
+    r = client.get(f"/projects/{project['id']}/files", headers=admin_headers)
+    assert r.status_code == 200, r.text
+
+
+def test_enforced_budget_replaces_response_after_handler(client, admin_headers, project, monkeypatch):
+    monkeypatch.setattr(A, "QUERY_BUDGET_ENFORCE", True)
+    monkeypatch.setattr(_endpoint("/projects/{project_id}/files"), "__query_budget__", 1, raising=False)
+    r = client.get(f"/projects/{project['id']}/files", headers=admin_headers)
+    assert r.status_code == 500
+    assert "Presupuesto de consultas excedido" in r.json()["detail"]
+
+
+def test_enforced_budget_does_not_break_writes(client, admin_headers, project, upload, monkeypatch):
+    # el endpoint termina su transacción; sólo la respuesta cambia
+    f = upload(project, name="presupuesto.pdf")
+    endpoint = _endpoint("/files/{file_id}/request-delete", "POST")
+    monkeypatch.setattr(A, "QUERY_BUDGET_ENFORCE", True)
+    monkeypatch.setattr(endpoint, "__query_budget__", 1, raising=False)
+    r = client.post(f"/files/{f['id']}/request-delete", data={"reason": "x"}, headers=admin_headers)
+    assert r.status_code == 500
+    with A.SessionLocal() as db:
+        assert db.query(A.FileDeleteRequest).filter_by(file_id=f["id"], status="pending").count() == 1
+
+
+def test_budget_overrun_is_counted_when_not_enforced(client, admin_headers, project, monkeypatch):
+    monkeypatch.setattr(A, "QUERY_BUDGET_ENFORCE", False)
+    monkeypatch.setattr(_endpoint("/projects/{project_id}/files"), "__query_budget__", 1, raising=False)
+    route = "/projects/{project_id}/files"
+    before = _count(A.DB_BUDGET_EXCEEDED, route=route)
+    r = client.get(f"/projects/{project['id']}/files", headers=admin_headers)
+    assert r.status_code == 200
+    assert _count(A.DB_BUDGET_EXCEEDED, route=route) == before + 1
+
+
+def test_n1_detector_flags_repeated_statement(monkeypatch, capsys):
+    monkeypatch.setattr(A, "QUERY_N1_THRESHOLD", 3)
+    monkeypatch.setattr(A, "_N1_REPORTED", set())
+    stats = A._new_request_stats()
+    stats["statements"] = {"SELECT * FROM stages WHERE id = ?": 5, "SELECT 1": 1}
+    stats["sql_count"] = 6
+    before = _count(A.DB_REPEATED_STATEMENTS, route="/prueba")
+    A._check_request_queries(stats, "/prueba")
+    A._check_request_queries(stats, "/prueba")
+    assert _count(A.DB_REPEATED_STATEMENTS, route="/prueba") == before + 2
+    assert capsys.readouterr().out.count("posible N+1") == 1  # un WARN por patrón
+
+
+def test_list_endpoints_have_no_n1(client, admin_headers, project, upload, monkeypatch):
+    for i in range(4):
+        upload(project, name=f"n1_{i}.pdf")  # versiones del mismo entregable
+    monkeypatch.setattr(A, "QUERY_N1_THRESHOLD", 3)
+    with A.assert_max_queries(100) as capture:
+        for path in (f"/projects/{project['id']}/expediente", f"/projects/{project['id']}/files",
+                     f"/projects/{project['id']}/progress", "/projects"):
+            assert client.get(path, headers=admin_headers).status_code == 200
+    for req in capture:
+        assert max(req["statements"].values()) < 3, req
+
+
+def test_assert_max_queries():
+    with A.assert_max_queries(2):
+        with A.SessionLocal() as db:
+            db.query(A.User).count()
+    with pytest.raises(AssertionError, match="consultas SQL"):
+        with A.assert_max_queries(1):
+            with A.SessionLocal() as db:
+                db.query(A.User).count()
+                db.query(A.Project).count()
+
+
+def test_assert_max_queries_counts_requests(client, admin_headers, project):
+    with pytest.raises(AssertionError):
+        with A.assert_max_queries(1):
+            client.get(f"/projects/{project['id']}/expediente", headers=admin_headers)
@@ -0,0 +1,44 @@
+# Planes de las consultas principales (EXPLAIN) sobre PostgreSQL con datos sintéticos.
+# app.py lee DATABASE_URL al importarse y conftest ya lo fijó a SQLite, así que la revisión
+# corre en un proceso aparte apuntando a TEST_POSTGRES_URL (usar una base desechable).
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+PG_URL = os.getenv("TEST_POSTGRES_URL")
+BACKEND = Path(__file__).resolve().parents[1]
+
+SCRIPT = """
+import json
+import app
+import plan_check as pc
+
+app.create_db()
+app.run_migrations()
+pc.cleanup()
+pc.seed(files=200_000, projects=1_000, users=200)
+try:
+    out = {}
+    with app.SessionLocal() as db, app.engine.connect() as conn:
+        for name, stmt in pc.queries(pc.sample_params(db)):
+            out[name] = sorted(set(pc._seq_scans(pc.explain(conn, stmt))))
+    print(json.dumps(out))
+finally:
+    pc.cleanup()
+"""
+
+
+@pytest.mark.skipif(not PG_URL, reason="TEST_POSTGRES_URL no definido")
+def test_hot_statements_use_indexes(tmp_path):
+    env = dict(os.environ, DATABASE_URL=PG_URL, FILES_ROOT=str(tmp_path), SCRUB_ENABLE="false")
+    env.pop("DATABASE_REPLICA_URL", None)
+    proc = subprocess.run([sys.executable, "-c", SCRIPT], cwd=BACKEND, env=env,
+                          capture_output=True, text=True, timeout=600)
+    assert proc.returncode == 0, proc.stderr
+    plans = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert plans, "sin consultas revisadas"
+    assert {name: seqs for name, seqs in plans.items() if seqs} == {}
@@ -0,0 +1,39 @@
+# Reconciliación incremental: borrados de registros y staging abandonado.
+import os
+import time
+
+import app as A
+
+
+def test_incremental_reports_orphan_when_unlink_fails(client, admin_headers, project, upload, monkeypatch):
+    f = upload(project, name="huerfano.pdf")
+    with A.SessionLocal() as db:
+        path = db.get(A.FileRecord, f["id"]).path
+    A.reconcile_storage()  # deja la carpeta registrada como limpia
+
+    def fail(self, *a, **kw):
+        raise OSError("disco de sólo lectura")
+
+    monkeypatch.setattr(A.Path, "unlink", fail)
+    assert client.delete(f"/files/{f['id']}", headers=admin_headers).status_code == 200
+    monkeypatch.undo()
+
+    summary = A.reconcile_storage()
+    assert path in [o["path"] for o in summary["orphan_samples"]]
+    os.unlink(path)
+
+
+def test_reports_stale_staging_files(client):
+    A.UPLOAD_TMP.mkdir(parents=True, exist_ok=True)
+    old = A.UPLOAD_TMP / "abandonado.part"
+    fresh = A.UPLOAD_TMP / "en_curso.part"
+    old.write_bytes(b"x" * 10)
+    fresh.write_bytes(b"y")
+    past = time.time() - A.RECONCILE_STAGING_MAX_AGE_S - 60
+    os.utime(old, (past, past))
+    try:
+        stale = [s["path"] for s in A.reconcile_storage()["stale_upload_samples"]]
+        assert str(old) in stale and str(fresh) not in stale
+    finally:
+        old.unlink()
+        fresh.unlink()
@@ -0,0 +1,144 @@
+# Read-your-writes con réplica: qué cuenta como escritura y cuándo se vuelve a leer de la réplica.
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event, text
+
+import app as A
+
+
+@pytest.fixture
+def tracking(monkeypatch):
+    # los listeners sólo se registran con DATABASE_REPLICA_URL; aquí se montan sobre SessionLocal
+    monkeypatch.setattr(A, "_RECENT_WRITES", {})
+    monkeypatch.setattr(A, "_PROCESS_STARTED", -1e9)
+    for name, fn in A._WRITE_TRACKING:
+        event.listen(A.SessionLocal, name, fn)
+    yield A._RECENT_WRITES
+    for name, fn in A._WRITE_TRACKING:
+        event.remove(A.SessionLocal, name, fn)
+
+
+def test_reads_and_text_selects_do_not_pin_to_primary(tracking):
+    with A.SessionLocal() as db:
+        db.info["user_id"] = 4242
+        db.execute(text("SELECT 1"))
+        db.query(A.User).count()
+        db.commit()
+    assert 4242 not in tracking
+    assert A._reads_from_primary(4242) is False
+
+
+def test_write_pins_user_until_window_expires(tracking, monkeypatch):
+    with A.SessionLocal() as db:
+        db.info["user_id"] = 4243
+        db.add(A.User(username="ryw_prueba", password_hash="x", role="colaborador", full_name="R",
+                      email="ryw@example.com", initials="RYW"))
+        db.commit()
+    assert 4243 in tracking
+    assert A._reads_from_primary(4243) is True  # sin LSN (SQLite): rige la ventana de tiempo
+
+    at, lsn = tracking[4243]
+    tracking[4243] = (at - A.REPLICA_STICKY_SECONDS - 1, lsn)
+    assert A._reads_from_primary(4243) is False
+    assert 4243 not in tracking
+
+
+def test_core_update_counts_as_write(tracking):
+    with A.SessionLocal() as db:
+        db.info["user_id"] = 4246
+        db.execute(A.update(A.User).where(A.User.id == -1).values(full_name="x"))
+        db.commit()
+    assert 4246 in tracking
+
+
+def test_rollback_discards_write_flag(tracking):
+    with A.SessionLocal() as db:
+        db.info["user_id"] = 4244
+        db.execute(A.update(A.User).where(A.User.id == -1).values(full_name="x"))
+        db.rollback()
+        db.commit()
+    assert 4244 not in tracking
+
+
+def test_lsn_decides_within_window(tracking, monkeypatch):
+    A._record_user_write(4245, "0/16B3748")
+    monkeypatch.setattr(A, "_replica_caught_up", lambda lsn: False)
+    assert A._reads_from_primary(4245) is True
+    monkeypatch.setattr(A, "_replica_caught_up", lambda lsn: True)
+    assert A._reads_from_primary(4245) is False
+
+
+def test_primary_right_after_start(monkeypatch):
+    monkeypatch.setattr(A, "_RECENT_WRITES", {})
+    monkeypatch.setattr(A, "_PROCESS_STARTED", A.time.monotonic())
+    assert A._reads_from_primary(1) is True
+
+
+# Con un primario y una réplica reales (streaming replication). app.py fija los engines al importarse,
+# así que corre en un proceso aparte; se pausa la reproducción del WAL en la réplica para que el
+# LSN de la escritura quede pendiente de forma determinista (requiere permiso para pg_wal_replay_pause).
+PG_URL = os.getenv("TEST_POSTGRES_URL")
+PG_REPLICA_URL = os.getenv("TEST_POSTGRES_REPLICA_URL")
+
+REPLICA_SCRIPT = """
+import time, uuid
+from sqlalchemy import text
+import app
+
+app.create_db()
+app.run_migrations()
+app._PROCESS_STARTED = -1e9
+
+def routed(user):
+    gen = app.get_read_db(db=primary, current=user)
+    s = next(gen)
+    target = "primary" if s is primary else "replica"
+    gen.close()
+    return target
+
+def replay(fn):
+    with app.replica_engine.connect() as conn:
+        conn.execute(text(f"SELECT {fn}()"))
+
+with app.SessionLocal() as primary:
+    user = app.User(username="ryw_" + uuid.uuid4().hex[:12], password_hash="x", role="colaborador",
+                    full_name="RYW", email="ryw@example.com", initials="RYW")
+    primary.add(user); primary.commit()
+    primary.refresh(user)
+    assert routed(user) == "replica"  # el alta no fue en nombre del usuario
+
+    replay("pg_wal_replay_pause")
+    try:
+        primary.info["user_id"] = user.id
+        user.full_name = "RYW escrito"
+        primary.commit()
+        lsn = app._RECENT_WRITES[user.id][1]
+        assert lsn, "sin LSN del primario"
+        for _ in range(3):
+            assert routed(user) == "primary"
+            time.sleep(0.2)
+    finally:
+        replay("pg_wal_replay_resume")
+
+    deadline = time.monotonic() + 30
+    while not app._replica_caught_up(lsn):
+        assert time.monotonic() < deadline, "la réplica no reprodujo el LSN"
+        time.sleep(0.2)
+    assert routed(user) == "replica"
+    primary.delete(user); primary.commit()
+print("ok")
+"""
+
+
+@pytest.mark.skipif(not (PG_URL and PG_REPLICA_URL),
+                    reason="TEST_POSTGRES_URL / TEST_POSTGRES_REPLICA_URL no definidos")
+def test_read_your_writes_against_real_replica(tmp_path):
+    env = dict(os.environ, DATABASE_URL=PG_URL, DATABASE_REPLICA_URL=PG_REPLICA_URL,
+               REPLICA_STICKY_SECONDS="300", FILES_ROOT=str(tmp_path), SCRUB_ENABLE="false")
+    proc = subprocess.run([sys.executable, "-c", REPLICA_SCRIPT], cwd=Path(A.__file__).parent, env=env,
+                          capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
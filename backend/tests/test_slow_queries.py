@@ -0,0 +1,38 @@
+# Registro de consultas lentas: qué se re-ejecuta con EXPLAIN ANALYZE y qué se guarda de los parámetros.
+import json
+
+import app as A
+
+
+def test_explain_mode_only_analyzes_pure_reads():
+    log = A._SlowQueryLog()
+    assert log._explain_mode("SELECT files.id FROM files WHERE files.project_id = %(p)s") == "analyze"
+    for stmt in (
+        "SELECT * FROM deliverable_specs WHERE id = %(id)s FOR UPDATE",
+        "SELECT id FROM files FOR NO KEY UPDATE SKIP LOCKED",
+        "SELECT id FROM files FOR SHARE",
+        "SELECT nextval('files_id_seq')",
+        "UPDATE users SET full_name = %(n)s WHERE id = %(id)s",
+        "INSERT INTO files (filename) VALUES (%(f)s)",
+        "WITH x AS (DELETE FROM files RETURNING id) SELECT count(*) FROM x",
+    ):
+        assert log._explain_mode(stmt) == "plain", stmt
+    assert log._explain_mode("SELECT pg_try_advisory_lock(%(k)s)") is None
+    assert log._explain_mode("SELECT pg_advisory_lock(%(k)s)") is None
+
+
+def test_params_are_redacted_by_default(monkeypatch):
+    monkeypatch.setattr(A, "SLOW_QUERY_LOG_PARAMS", False)
+    monkeypatch.setattr(A, "SLOW_QUERY_EXPLAIN_RATE", 0.0)
+    log = A._SlowQueryLog()
+    log._store({"engine": A.engine, "statement": "UPDATE users SET password_hash = ? WHERE id = ?",
+                "parameters": ("$2b$12$secreto", 7), "executemany": False, "duration_ms": 250.0,
+                "route": "/users/{user_id}", "username": "admin"})
+    with A.SessionLocal() as db:
+        row = db.query(A.SlowQuery).order_by(A.SlowQuery.id.desc()).first()
+    assert "secreto" not in row.params
+    assert json.loads(row.params) == ["str(14)", "int"]
+
+
+def test_param_shapes_executemany():
+    assert A._param_shapes([{"a": "x", "b": 1}, {"a": "yy", "b": 2}]) == {"rows": 2, "first": {"a": "str(1)", "b": "int"}}
@@ -0,0 +1,21 @@
+# Cargas concurrentes a un mismo entregable: versiones únicas, sin huecos y en carpetas distintas.
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import app as A
+
+N = 8
+
+
+def test_concurrent_uploads_get_unique_gapless_versions(client, admin_headers, project, upload):
+    with ThreadPoolExecutor(max_workers=N) as pool:
+        files = list(pool.map(lambda i: upload(project, name=f"v{i}.pdf", body=b"%PDF " + bytes([i])), range(N)))
+
+    with A.SessionLocal() as db:
+        recs = db.query(A.FileRecord).filter(A.FileRecord.id.in_([f["id"] for f in files])).all()
+        assert len({r.deliverable_id for r in recs}) == 1
+        assert sorted(r.version for r in recs) == list(range(1, N + 1))
+        dirs = {os.path.dirname(r.path) for r in recs}
+        assert dirs == {str(A.Path(recs[0].path).parents[1] / f"v{v}") for v in range(1, N + 1)}
+        assert all(os.path.exists(r.path) for r in recs)
+        assert sum(r.is_active for r in recs) == 1  # entregable de archivo único: sólo la última queda activa
@@ -43,6 +43,22 @@ function asForm(obj) {
     return fd;
 }
 
+// Recorre todas las páginas de un listado { items, next_cursor }
+async function fetchAllPages(path, token, errorMsg) {
+    const items = [];
+    let cursor = null;
+    do {
+        const qs = new URLSearchParams({ limit: "500" });
+        if (cursor) qs.set("cursor", cursor);
+        const r = await fetch(`${API}${path}?${qs}`, { headers: authHeaders(token) });
+        const j = await r.json();
+        if (!r.ok) throw new Error(j.detail || errorMsg);
+        items.push(...(j.items || []));
+        cursor = j.next_cursor;
+    } while (cursor);
+    return items;
+}
+
 // Subida con progreso real usando XHR (para mostrar barra)
 function xhrUpload(url, formData, token, onProgress) {
     return new Promise((resolve, reject) => {
@@ -214,10 +230,7 @@ export async function bulkRequestDelete(projectId, ids, reason, token) {
 }
 
 export async function listDeleteRequests(token) {
-    const r = await fetch(`${API}/file-delete-requests`, { headers: authHeaders(token) });
-    const j = await r.json();
-    if (!r.ok) throw new Error(j.detail || "Error listando solicitudes");
-    return j.items || [];
+    return fetchAllPages("/file-delete-requests", token, "Error listando solicitudes");
 }
 
 export async function approveDeleteRequest(reqId, token) {
@@ -441,10 +454,7 @@ export async function requestProjectDelete(projectId, reason, token) {
 }
 
 export async function listProjectDeleteRequests(token) {
-    const r = await fetch(`${API}/project-delete-requests`, { headers: authHeaders(token) });
-    const j = await r.json();
-    if (!r.ok) throw new Error(j.detail || "Error listando solicitudes de proyecto");
-    return j.items || [];
+    return fetchAllPages("/project-delete-requests", token, "Error listando solicitudes de proyecto");
 }
 
 export async function approveProjectDeleteRequest(reqId, token) {